@@ -0,0 +1,32 @@
+from typing import Dict
+
+import pytest
+
+_SCALING_CURVES = pytest.StashKey[Dict[str, Dict]]()
+
+
+def pytest_configure(config):
+    config.stash[_SCALING_CURVES] = {}
+
+
+@pytest.fixture
+def scaling_curves(request) -> Dict[str, Dict]:
+    """
+    Scaling curves of benchmarked functions, printed at the end of the session
+    """
+    return request.config.stash[_SCALING_CURVES]
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    curves = config.stash[_SCALING_CURVES]
+    if not curves:
+        return
+    terminalreporter.section("scaling curves")
+    for name, curve in curves.items():
+        points = ", ".join(
+            f"{pools} pools: {seconds * 1000:.1f}ms"
+            for pools, seconds in curve["seconds"].items()
+        )
+        terminalreporter.write_line(
+            f"{name}: {points} (exponent {curve['exponent']:.2f}, max {curve['max_exponent']})"
+        )
@@ -0,0 +1,82 @@
+"""
+Micro-benchmark for the abi and contract cache in fee_allocator.helpers.
+
+Replays the contract construction done per core pool by get_twap_bpt_price and
+_get_balancer_pool_tokens_balances (vault twice, pool once, ERC20 once per token),
+once the way it was done before the cache (abi read from disk and a new contract
+every time) and once through get_contract. No rpc calls are made.
+
+Usage:
+    python benchmarks/contract_cache.py [--pools 100] [--tokens 3]
+"""
+
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+from web3 import Web3
+
+from fee_allocator.helpers import BALANCER_CONTRACTS
+from fee_allocator.helpers import get_contract
+
+ABI_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fee_allocator/abi"
+)
+CHAIN = "mainnet"
+
+
+def _address(i: int) -> str:
+    return Web3.to_checksum_address(f"0x{i:040x}")
+
+
+def uncached_pool(web3: Web3, pool: int, tokens: int) -> None:
+    def contract(address, abi_name):
+        with open(f"{ABI_DIR}/{abi_name}.json") as f:
+            return web3.eth.contract(address=address, abi=json.load(f))
+
+    vault = BALANCER_CONTRACTS[CHAIN]["BALANCER_VAULT_ADDRESS"]
+    contract(vault, "BalancerVault")
+    contract(_address(pool), "WeighedPool")
+    contract(vault, "BalancerVault")
+    for token in range(tokens):
+        contract(_address(10_000 + token), "ERC20")
+
+
+def cached_pool(web3: Web3, pool: int, tokens: int) -> None:
+    vault = BALANCER_CONTRACTS[CHAIN]["BALANCER_VAULT_ADDRESS"]
+    get_contract(web3, CHAIN, vault, "BalancerVault")
+    get_contract(web3, CHAIN, _address(pool), "WeighedPool")
+    get_contract(web3, CHAIN, vault, "BalancerVault")
+    for token in range(tokens):
+        get_contract(web3, CHAIN, _address(10_000 + token), "ERC20")
+
+
+def measure(fn, web3: Web3, pools: int, tokens: int) -> tuple[float, int]:
+    """
+    Returns (cpu seconds per pool, peak bytes allocated while handling one more pool)
+    """
+    start = time.process_time()
+    for pool in range(pools):
+        fn(web3, pool, tokens)
+    elapsed = time.process_time() - start
+    tracemalloc.start()
+    fn(web3, pools, tokens)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / pools, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pools", type=int, default=100)
+    parser.add_argument("--tokens", type=int, default=3)
+    args = parser.parse_args()
+
+    web3 = Web3(Web3.HTTPProvider("http://127.0.0.1:1"))
+    for name, fn in (("uncached", uncached_pool), ("cached", cached_pool)):
+        cpu, allocated = measure(fn, web3, args.pools, args.tokens)
+        print(
+            f"{name:>8}: {cpu * 1e3:.3f} ms cpu/pool, {allocated / 1024:.1f} KiB peak/pool"
+        )
@@ -0,0 +1,165 @@
+"""
+Memory benchmark for pool snapshot decoding.
+
+Builds synthetic poolSnapshots responses (pages of 1000 records, full page count per block,
+two blocks per chain) and decodes them:
+- dicts: json.loads of responses with all fields of the previous query, every chain
+  held until the end of the run, the way run_fees used to keep pool_snapshots
+- records: streaming decode of responses to the current query into newest PoolSnapshot
+  per pool, released per chain
+
+Each mode runs in a fresh subprocess, so peak RSS is comparable.
+
+Usage:
+    python benchmarks/snapshot_memory.py [--chains 7] [--pools 600] [--days 9]
+"""
+
+import argparse
+import io
+import json
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import ijson
+
+from fee_allocator.snapshots import SnapshotDecoder
+
+PAGE_SIZE = 1000
+MAX_RECORDS = 5000
+
+
+def build_pages(pools: int, days: int, seed: int, full_query: bool) -> list[bytes]:
+    """
+    One block worth of poolSnapshots pages, daily snapshots of every pool, newest first.
+    full_query adds the fields that were requested before the query was trimmed
+    """
+    rnd = random.Random(seed)
+    records = []
+    for day in range(days):
+        for pool in range(pools):
+            pool_id = f"0x{pool:040x}{seed:024x}"
+            records.append(
+                {
+                    "pool": {
+                        "address": pool_id[:42],
+                        "id": pool_id,
+                        "symbol": f"B-{pool}-{seed}",
+                        "totalProtocolFeePaidInBPT": (
+                            f"{rnd.uniform(0, 1e6):.18f}" if pool % 3 else None
+                        ),
+                        "tokens": [
+                            {
+                                "symbol": f"T{token}",
+                                "address": f"0x{token:040x}",
+                                "paidProtocolFees": f"{rnd.uniform(0, 1e4):.18f}",
+                            }
+                            for token in range(2 + pool % 3)
+                        ],
+                    },
+                    "timestamp": 1_700_000_000 - day * 86400,
+                    "protocolFee": f"{rnd.uniform(0, 1e5):.18f}",
+                    "swapFees": f"{rnd.uniform(0, 1e6):.18f}",
+                    "swapVolume": f"{rnd.uniform(0, 1e9):.18f}",
+                    "liquidity": f"{rnd.uniform(0, 1e9):.18f}",
+                }
+            )
+    if not full_query:
+        for record in records:
+            for field in ("protocolFee", "swapFees", "swapVolume", "liquidity"):
+                del record[field]
+            for token in record["pool"]["tokens"]:
+                del token["symbol"]
+    records = records[:MAX_RECORDS]
+    return [
+        json.dumps({"data": {"poolSnapshots": records[i : i + PAGE_SIZE]}}).encode()
+        for i in range(0, len(records), PAGE_SIZE)
+    ]
+
+
+def decode_dicts(pages: list[bytes]) -> list[dict]:
+    snapshots = []
+    for page in pages:
+        snapshots.extend(json.loads(page)["data"]["poolSnapshots"])
+    return snapshots
+
+
+def decode_records(pages: list[bytes]) -> dict:
+    snapshots = {}
+    for page in pages:
+        decoder = SnapshotDecoder(snapshots)
+        for prefix, event, value in ijson.parse(io.BytesIO(page)):
+            decoder.feed(prefix, event, value)
+        decoder.finish()
+    return snapshots
+
+
+def run_mode(mode: str, chains: int, pools: int, days: int) -> None:
+    # Responses are generated up front, only decoding is measured
+    full_query = mode == "dicts"
+    responses = [
+        (
+            build_pages(pools, days, chain * 2, full_query),
+            build_pages(pools, days, chain * 2 + 1, full_query),
+        )
+        for chain in range(chains)
+    ]
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    start = time.perf_counter()
+    held = []
+    for pages_now, pages_2_weeks_ago in responses:
+        if mode == "dicts":
+            held.append((decode_dicts(pages_now), decode_dicts(pages_2_weeks_ago)))
+        else:
+            chain_snapshots = (
+                decode_records(pages_now),
+                decode_records(pages_2_weeks_ago),
+            )
+            # Fees of the chain are collected here, then snapshots are released
+            del chain_snapshots
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        json.dumps(
+            {
+                "mode": mode,
+                "seconds": round(elapsed, 2),
+                "peak_traced_mb": round(peak / 2**20, 1),
+                "peak_rss_growth_mb": round((rss - baseline_rss) / 1024, 1),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chains", type=int, default=7)
+    parser.add_argument("--pools", type=int, default=600)
+    parser.add_argument("--days", type=int, default=9)
+    parser.add_argument("--mode", choices=["dicts", "records"])
+    args = parser.parse_args()
+    if args.mode:
+        run_mode(args.mode, args.chains, args.pools, args.days)
+        sys.exit(0)
+    for mode in ("dicts", "records"):
+        subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--mode",
+                mode,
+                "--chains",
+                str(args.chains),
+                "--pools",
+                str(args.pools),
+                "--days",
+                str(args.days),
+            ],
+            check=True,
+        )
@@ -0,0 +1,97 @@
+"""
+Startup time benchmark for the allocator CLI and its modules.
+
+Measures wall time of `python main.py --help` and the import time of the heavy modules.
+For imports both the total time (including third party libraries such as web3) and the
+time spent in fee_allocator modules themselves is reported, the latter is where any
+import-time network or file work would show up. The run fails when `--help` or the total
+import time of a module exceeds max_seconds.
+
+Usage:
+    python benchmarks/startup.py [--runs 5] [--max_seconds 1.0]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import List
+from typing import Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = [
+    "fee_allocator.tx_builder.tx_builder",
+    "fee_allocator.accounting.fee_pipeline",
+    "fee_allocator.helpers",
+]
+
+
+def time_help(runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "main.py", "--help"],
+            cwd=ROOT,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def time_import(module: str, runs: int) -> Tuple[float, float]:
+    """
+    Returns median (total, own) import time in seconds for a module
+    """
+    totals, owns = [], []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=ROOT,
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        total, own = _parse_importtime(result.stderr.splitlines(), module)
+        totals.append(total)
+        owns.append(own)
+    return statistics.median(totals), statistics.median(owns)
+
+
+def _parse_importtime(lines: List[str], module: str) -> Tuple[float, float]:
+    total_us = 0
+    own_us = 0
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            continue  # header line
+        name = name.strip()
+        if name.startswith("fee_allocator"):
+            own_us += int(self_us)
+        if name == module:
+            total_us = int(cumulative_us)
+    return total_us / 1e6, own_us / 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max_seconds", type=float, default=1.0)
+    args = parser.parse_args()
+
+    failed = False
+    help_time = time_help(args.runs)
+    print(f"main.py --help: {help_time:.3f}s")
+    failed |= help_time > args.max_seconds
+    for module in MODULES:
+        total, own = time_import(module, args.runs)
+        print(f"import {module}: {total:.3f}s total, {own:.3f}s in fee_allocator")
+        failed |= total > args.max_seconds
+    if failed:
+        print(f"FAILED: startup exceeded {args.max_seconds}s")
+        sys.exit(1)
@@ -0,0 +1,160 @@
+"""
+Synthetic epoch data at a configurable number of core pools, for benchmarks.
+
+Pool fees are lognormal, so a few pools earn most fees and a long tail earns less than the
+min vote incentive, like on mainnet. A third of the pools pay fees in pool tokens, the rest
+in BPT. Data is deterministic for a seed.
+"""
+
+import math
+import random
+from decimal import Decimal
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from fee_allocator.accounting.distribution import calc_and_split_incentives
+from fee_allocator.snapshots import PoolSnapshot
+
+CHAIN = "mainnet"
+FEE_CONSTANTS = {
+    "min_aura_incentive": 500,
+    "dao_share_pct": "0.175",
+    "vebal_share_pct": "0.125",
+    "min_existing_aura_incentive": 1500,
+    "min_vote_incentive_amount": 400,
+}
+AURA_VEBAL_SHARE = Decimal("0.6")
+# Lognormal parameters of fees earned by a pool in an epoch, in USD
+FEE_MU = 6.0
+FEE_SIGMA = 2.0
+
+
+def pool_id(index: int) -> str:
+    return f"0x{index:040x}{0:024x}"
+
+
+def token_address(index: int) -> str:
+    return f"0x{index:040x}"
+
+
+def synthetic_pool_fees(pools: int, seed: int = 0) -> List[float]:
+    rnd = random.Random(seed)
+    return [rnd.lognormvariate(FEE_MU, FEE_SIGMA) for _ in range(pools)]
+
+
+def synthetic_snapshots(
+    pools: int, seed: int = 0
+) -> Tuple[Dict[str, PoolSnapshot], Dict[str, PoolSnapshot], Dict, Dict]:
+    """
+    Returns pool snapshots now and 2 weeks ago, BPT twap prices keyed by chain
+    and token prices, priced so that every pool earned its synthetic fees
+    """
+    rnd = random.Random(seed)
+    snapshots_now = {}
+    snapshots_before = {}
+    bpt_prices = {}
+    token_prices = {}
+    for index, fees in enumerate(synthetic_pool_fees(pools, seed)):
+        _pool_id = pool_id(index)
+        paid_before = rnd.uniform(0, 1e6)
+        if index % 3:
+            bpt_prices[_pool_id] = Decimal(str(round(rnd.uniform(0.5, 5000), 6)))
+            paid_now = paid_before + fees / float(bpt_prices[_pool_id])
+            snapshot_now = PoolSnapshot(
+                _pool_id, _pool_id[:42], f"B-{index}", 0, f"{paid_now:.18f}"
+            )
+            snapshot_before = PoolSnapshot(
+                _pool_id, _pool_id[:42], f"B-{index}", 0, f"{paid_before:.18f}"
+            )
+        else:
+            bpt_prices[_pool_id] = None
+            tokens = [
+                token_address(index * 8 + token) for token in range(2 + index % 3)
+            ]
+            tokens_now = []
+            tokens_before = []
+            for token in tokens:
+                token_prices[token] = Decimal(str(round(rnd.uniform(0.01, 3000), 6)))
+                paid_now = paid_before + fees / len(tokens) / float(token_prices[token])
+                tokens_now.append((token, f"{paid_now:.18f}"))
+                tokens_before.append((token, f"{paid_before:.18f}"))
+            snapshot_now = PoolSnapshot(
+                _pool_id, _pool_id[:42], f"B-{index}", 0, None, tuple(tokens_now)
+            )
+            snapshot_before = PoolSnapshot(
+                _pool_id, _pool_id[:42], f"B-{index}", 0, None, tuple(tokens_before)
+            )
+        snapshots_now[_pool_id] = snapshot_now
+        snapshots_before[_pool_id] = snapshot_before
+    return snapshots_now, snapshots_before, {CHAIN: bpt_prices}, token_prices
+
+
+def synthetic_collected_fees(pools: int, seed: int = 0) -> Dict[str, Dict]:
+    """
+    collect_fee_info result for the synthetic pools
+    """
+    fees = {}
+    for index, pool_fees in enumerate(synthetic_pool_fees(pools, seed)):
+        _pool_id = pool_id(index)
+        in_bpt = bool(index % 3)
+        fees[_pool_id] = {
+            "symbol": f"B-{index}",
+            "pool_addr": _pool_id[:42],
+            "bpt_token_fee": round(pool_fees, 2) if in_bpt else 0,
+            "bpt_token_fee_in_usd": round(Decimal(pool_fees), 2) if in_bpt else 0,
+            "token_fees_in_usd": 0 if in_bpt else round(Decimal(pool_fees), 2),
+            "chain": CHAIN,
+            "token_fees": [],
+        }
+    return fees
+
+
+def synthetic_fees_to_distribute(collected_fees: Dict[str, Dict]) -> Decimal:
+    """
+    Fees to distribute match collected fees, like in a regular epoch
+    """
+    return sum(
+        (
+            Decimal(data["bpt_token_fee_in_usd"]) + Decimal(data["token_fees_in_usd"])
+            for data in collected_fees.values()
+        ),
+        Decimal(0),
+    )
+
+
+def synthetic_incentives(pools: int, seed: int = 0) -> Dict[str, Dict]:
+    """
+    calc_and_split_incentives result for the synthetic pools
+    """
+    collected_fees = synthetic_collected_fees(pools, seed)
+    return calc_and_split_incentives(
+        collected_fees,
+        CHAIN,
+        synthetic_fees_to_distribute(collected_fees),
+        Decimal(FEE_CONSTANTS["min_aura_incentive"]),
+        Decimal(FEE_CONSTANTS["dao_share_pct"]),
+        Decimal(FEE_CONSTANTS["vebal_share_pct"]),
+        Decimal(FEE_CONSTANTS["min_existing_aura_incentive"]),
+        AURA_VEBAL_SHARE,
+        [],
+        synthetic_mapped_pools_info(pools),
+    )
+
+
+def synthetic_mapped_pools_info(pools: int) -> Dict[str, str]:
+    return {pool_id(index): token_address(10**9 + index) for index in range(pools)}
+
+
+def scaling_exponent(sizes: List[int], seconds: List[float]) -> float:
+    """
+    Slope of log(seconds) over log(size), fitted by least squares.
+    1 is linear scaling, 2 is quadratic
+    """
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(second, 1e-9)) for second in seconds]
+    x_mean = sum(xs) / len(xs)
+    y_mean = sum(ys) / len(ys)
+    return sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys)) / sum(
+        (x - x_mean) ** 2 for x in xs
+    )
@@ -0,0 +1,188 @@
+"""
+Benchmarks of accounting functions over synthetic epochs of growing size.
+
+Every function is timed at each size of BENCHMARK_POOLS (comma separated, default 100,1000,10000)
+and the fitted exponent of time over pools is checked against its max, so a change making a
+function scale worse fails. Absolute timings can be compared with a saved run:
+
+    python -m pytest benchmarks --benchmark-autosave
+    python -m pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:25%
+"""
+
+import copy
+import os
+import time
+from decimal import Decimal
+from typing import Callable
+from typing import Tuple
+from unittest.mock import MagicMock
+
+import pytest
+
+from benchmarks.synthetic import CHAIN
+from benchmarks.synthetic import FEE_CONSTANTS
+from benchmarks.synthetic import AURA_VEBAL_SHARE
+from benchmarks.synthetic import scaling_exponent
+from benchmarks.synthetic import synthetic_collected_fees
+from benchmarks.synthetic import synthetic_fees_to_distribute
+from benchmarks.synthetic import synthetic_incentives
+from benchmarks.synthetic import synthetic_mapped_pools_info
+from benchmarks.synthetic import synthetic_snapshots
+from fee_allocator.accounting.collectors import collect_fee_info
+from fee_allocator.accounting.distribution import calc_and_split_incentives
+from fee_allocator.accounting.distribution import handle_aura_min
+from fee_allocator.accounting.distribution import re_distribute_incentives
+from fee_allocator.accounting.recon import generate_and_save_input_csv
+from fee_allocator.accounting.settings import Chains
+
+pytest.importorskip("pytest_benchmark")
+
+SIZES = [
+    int(size) for size in os.getenv("BENCHMARK_POOLS", "100,1000,10000").split(",")
+]
+ROUNDS = 3
+# Max fitted exponent of seconds over pools, 1 is linear. Timings at small sizes are noisy, so it has some slack
+MAX_SCALING_EXPONENT = 1.5
+
+
+def setup_collect_fee_info(pools: int) -> Callable[[], Tuple]:
+    snapshots_now, snapshots_before, bpt_prices, token_prices = synthetic_snapshots(
+        pools
+    )
+    args = (
+        list(snapshots_now.keys()),
+        Chains.MAINNET,
+        snapshots_now,
+        snapshots_before,
+        0,
+        1,
+        bpt_prices,
+        token_prices,
+    )
+    return lambda: args
+
+
+def setup_calc_and_split_incentives(pools: int) -> Callable[[], Tuple]:
+    collected_fees = synthetic_collected_fees(pools)
+    args = (
+        collected_fees,
+        CHAIN,
+        synthetic_fees_to_distribute(collected_fees),
+        Decimal(FEE_CONSTANTS["min_aura_incentive"]),
+        Decimal(FEE_CONSTANTS["dao_share_pct"]),
+        Decimal(FEE_CONSTANTS["vebal_share_pct"]),
+        Decimal(FEE_CONSTANTS["min_existing_aura_incentive"]),
+        AURA_VEBAL_SHARE,
+        [],
+        synthetic_mapped_pools_info(pools),
+    )
+    return lambda: args
+
+
+def setup_re_distribute_incentives(pools: int) -> Callable[[], Tuple]:
+    incentives = synthetic_incentives(pools)
+    return lambda: (
+        copy.deepcopy(incentives),
+        Decimal(FEE_CONSTANTS["min_aura_incentive"]),
+        Decimal(FEE_CONSTANTS["min_vote_incentive_amount"]),
+        Decimal("0.25"),
+        {},
+    )
+
+
+def setup_handle_aura_min(pools: int) -> Callable[[], Tuple]:
+    incentives = synthetic_incentives(pools)
+    return lambda: (
+        copy.deepcopy(incentives),
+        Decimal(FEE_CONSTANTS["min_aura_incentive"]),
+        {},
+    )
+
+
+def setup_generate_and_save_input_csv(pools: int) -> Callable[[], Tuple]:
+    args = (
+        synthetic_incentives(pools),
+        1_700_000_000,
+        synthetic_mapped_pools_info(pools),
+    )
+    return lambda: args
+
+
+# name: (function, setup, max scaling exponent)
+BENCHMARKS = {
+    "collect_fee_info": (
+        collect_fee_info,
+        setup_collect_fee_info,
+        MAX_SCALING_EXPONENT,
+    ),
+    "calc_and_split_incentives": (
+        calc_and_split_incentives,
+        setup_calc_and_split_incentives,
+        MAX_SCALING_EXPONENT,
+    ),
+    "re_distribute_incentives": (
+        re_distribute_incentives,
+        setup_re_distribute_incentives,
+        MAX_SCALING_EXPONENT,
+    ),
+    "handle_aura_min": (
+        handle_aura_min,
+        setup_handle_aura_min,
+        MAX_SCALING_EXPONENT,
+    ),
+    "generate_and_save_input_csv": (
+        generate_and_save_input_csv,
+        setup_generate_and_save_input_csv,
+        MAX_SCALING_EXPONENT,
+    ),
+}
+
+
+@pytest.fixture(autouse=True)
+def offline(mocker, tmp_path, capsys):
+    """
+    No gauge requests, csv files go to a temporary dir and progress prints are dropped
+    """
+    mocker.patch(
+        "fee_allocator.accounting.collectors.get_pools_gauges",
+        return_value=MagicMock(
+            has_alive_preferential_gauge=MagicMock(return_value=True)
+        ),
+    )
+    mocker.patch("fee_allocator.accounting.recon.PROJECT_ROOT", str(tmp_path))
+    os.makedirs(tmp_path / "fee_allocator/allocations/output_for_msig")
+    mocker.patch("builtins.print")
+
+
+@pytest.mark.parametrize("pools", SIZES)
+@pytest.mark.parametrize("name", list(BENCHMARKS))
+def test_benchmark(benchmark, name, pools):
+    func, setup, _ = BENCHMARKS[name]
+    make_args = setup(pools)
+    benchmark.group = name
+    benchmark.extra_info["pools"] = pools
+    benchmark.pedantic(func, setup=lambda: (make_args(), {}), rounds=ROUNDS)
+
+
+@pytest.mark.parametrize("name", list(BENCHMARKS))
+def test_scaling(name, scaling_curves):
+    func, setup, max_exponent = BENCHMARKS[name]
+    if len(SIZES) < 2:
+        pytest.skip("Scaling needs at least two sizes")
+    seconds = {}
+    for pools in SIZES:
+        make_args = setup(pools)
+        timings = []
+        for _ in range(ROUNDS):
+            args = make_args()
+            start = time.perf_counter()
+            func(*args)
+            timings.append(time.perf_counter() - start)
+        seconds[pools] = min(timings)
+    exponent = scaling_exponent(list(seconds.keys()), list(seconds.values()))
+    scaling_curves[name] = {
+        "seconds": seconds,
+        "exponent": exponent,
+        "max_exponent": max_exponent,
+    }
+    assert exponent <= max_exponent, f"{name} scales with pools^{exponent:.2f}"
@@ -0,0 +1,252 @@
+"""
+Intra-epoch fee accrual.
+
+A daily job stores cumulative protocol fee counters of core pools for every day of the epoch,
+with the fees accrued since the previous day and their USD value at that day's prices.
+The first day holds the counters at the epoch start. The end of epoch run sums stored
+deltas and the delta of the final day, so it only needs snapshots at the final block.
+"""
+
+from decimal import Decimal
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from web3 import Web3
+
+from fee_allocator.accounting.settings import Chains
+from fee_allocator.cache import disk_cache_get
+from fee_allocator.cache import disk_cache_set
+from fee_allocator.helpers import fetch_token_price_balgql_timerange
+from fee_allocator.helpers import get_balancer_pool_snapshots
+from fee_allocator.helpers import get_block_by_ts
+from fee_allocator.helpers import get_pools_gauges
+from fee_allocator.helpers import get_subgraph_url
+from fee_allocator.helpers import get_twap_bpt_prices
+from fee_allocator.snapshots import PoolSnapshot
+
+
+def _ledger_key(chain: str, epoch_start_ts: int) -> str:
+    return f"{chain}:{epoch_start_ts}"
+
+
+def get_accrual_ledger(chain: str, epoch_start_ts: int) -> Optional[Dict]:
+    """
+    Returns stored days of the epoch on the chain, oldest first, or None
+    """
+    return disk_cache_get("accrual", _ledger_key(chain, epoch_start_ts))
+
+
+def pool_fee_deltas(
+    pools: List[str],
+    snapshots_now: Dict[str, PoolSnapshot],
+    snapshots_before: Dict[str, PoolSnapshot],
+) -> Dict[str, Dict]:
+    """
+    Fees accrued by pools between two snapshots, in BPT or per pool token, keyed by pool id.
+    Pools without a snapshot before accrued their whole counters, like in collect_fee_info
+    """
+    deltas = {}
+    for pool in pools:
+        snapshot_now = snapshots_now.get(pool)
+        if snapshot_now is None:
+            continue
+        snapshot_before = snapshots_before.get(pool)
+        delta = {"bpt_token_fee": Decimal(0), "token_fees": {}}
+        if snapshot_now.total_protocol_fee_paid_in_bpt is not None:
+            delta["bpt_token_fee"] = Decimal(
+                snapshot_now.total_protocol_fee_paid_in_bpt
+            ) - Decimal(
+                snapshot_before and snapshot_before.total_protocol_fee_paid_in_bpt or 0
+            )
+        else:
+            for token_addr, paid_protocol_fees in snapshot_now.tokens:
+                paid_before = (
+                    snapshot_before.paid_protocol_fees(token_addr)
+                    if snapshot_before
+                    else None
+                )
+                delta["token_fees"][token_addr] = Decimal(paid_protocol_fees) - Decimal(
+                    paid_before or 0
+                )
+        deltas[pool] = delta
+    return deltas
+
+
+def track_chain_accrual(
+    chain: Chains,
+    web3: Web3,
+    pools: List[str],
+    epoch_start_ts: int,
+    timestamp: int,
+) -> Dict:
+    """
+    Store counters of pools at timestamp and fees accrued since the previous stored day,
+    valued with twap prices over that day. Days at or before the last stored one are skipped
+    """
+    ledger = get_accrual_ledger(chain.value, epoch_start_ts) or {
+        "pools": [],
+        "days": [],
+    }
+    graph_url = get_subgraph_url(chain.value)
+    new_pools = [pool for pool in pools if pool not in ledger["pools"]]
+    if new_pools:
+        # Counters at the epoch start are the baseline of pools added to tracking
+        block = get_block_by_ts(epoch_start_ts, chain.value)
+        snapshots = get_balancer_pool_snapshots(block, graph_url)
+        if not ledger["days"]:
+            ledger["days"].append(
+                {
+                    "timestamp": epoch_start_ts,
+                    "block": block,
+                    "counters": {},
+                    "fees": {},
+                }
+            )
+        ledger["days"][0]["counters"].update(_counters(new_pools, snapshots))
+        ledger["pools"] += new_pools
+    ledger_key = _ledger_key(chain.value, epoch_start_ts)
+    previous_day = ledger["days"][-1]
+    if timestamp <= previous_day["timestamp"]:
+        if new_pools:
+            disk_cache_set("accrual", ledger_key, ledger)
+        return ledger
+    block = get_block_by_ts(timestamp, chain.value)
+    snapshots = get_balancer_pool_snapshots(block, graph_url)
+    deltas = pool_fee_deltas(pools, snapshots, _baseline(ledger))
+    bpt_prices = get_twap_bpt_prices(
+        list(deltas.keys()),
+        chain.value,
+        web3,
+        previous_day["timestamp"],
+        timestamp,
+        block,
+    )
+    fees = {}
+    for pool, delta in deltas.items():
+        token_fees_in_usd = sum(
+            (
+                token_fee
+                * (
+                    fetch_token_price_balgql_timerange(
+                        token_addr, chain.value, previous_day["timestamp"], timestamp
+                    )
+                    or 0
+                )
+                for token_addr, token_fee in delta["token_fees"].items()
+            ),
+            Decimal(0),
+        )
+        fees[pool] = {
+            **delta,
+            "bpt_token_fee_in_usd": delta["bpt_token_fee"] * (bpt_prices[pool] or 0),
+            "token_fees_in_usd": token_fees_in_usd,
+        }
+    ledger["days"].append(
+        {
+            "timestamp": timestamp,
+            "block": block,
+            "counters": _counters(pools, snapshots),
+            "fees": fees,
+        }
+    )
+    disk_cache_set("accrual", ledger_key, ledger)
+    return ledger
+
+
+def accrued_usd(ledger: Dict) -> Dict[str, Decimal]:
+    """
+    Running view of the epoch: USD value of fees accrued so far per pool,
+    every day valued at its own prices
+    """
+    accrued = {}
+    for day in ledger["days"]:
+        for pool, fees in day["fees"].items():
+            accrued[pool] = (
+                accrued.get(pool, Decimal(0))
+                + fees["bpt_token_fee_in_usd"]
+                + fees["token_fees_in_usd"]
+            )
+    return accrued
+
+
+def is_tracked(ledger: Optional[Dict], pools: List[str]) -> bool:
+    """
+    Whether the ledger has baseline counters of all pools, so it can replace the epoch start snapshots
+    """
+    return ledger is not None and set(pools) <= set(ledger["pools"])
+
+
+def collect_accrued_fee_info(
+    pools: list[str],
+    chain: Chains,
+    pools_now: Dict[str, PoolSnapshot],
+    ledger: Dict,
+    start_ts: int,
+    end_ts: int,
+    bpt_twap_prices: Dict[str, Dict],
+    token_prices: Optional[Dict[str, Optional[Decimal]]] = None,
+) -> Dict[str, Dict]:
+    """
+    collect_fee_info result for the epoch from stored daily deltas and the delta between
+    the last stored day and pools_now. Accrued fees are valued with epoch twap prices,
+    fetched on demand unless passed in token_prices
+    """
+    accrued = pool_fee_deltas(pools, pools_now, _baseline(ledger))
+    for day in ledger["days"]:
+        for pool, fees in day["fees"].items():
+            if pool not in accrued:
+                continue
+            accrued[pool]["bpt_token_fee"] += fees["bpt_token_fee"]
+            for token_addr, token_fee in fees["token_fees"].items():
+                accrued[pool]["token_fees"][token_addr] = (
+                    accrued[pool]["token_fees"].get(token_addr, Decimal(0)) + token_fee
+                )
+    fees = {}
+    poolutil = get_pools_gauges(chain.value)
+    for pool, delta in accrued.items():
+        if not poolutil.has_alive_preferential_gauge(pool):
+            print(
+                f"WARNING:pool_id {pool} on {chain} is in the core pools list but has no pref gauge. Skipped."
+            )
+            continue
+        snapshot_now = pools_now[pool]
+        bpt_token_fee = float(delta["bpt_token_fee"])
+        token_fees_in_usd = Decimal(0)
+        for token_addr, token_fee in delta["token_fees"].items():
+            if token_prices is not None:
+                token_price = token_prices.get(token_addr) or 0
+            else:
+                token_price = (
+                    fetch_token_price_balgql_timerange(
+                        token_addr, chain.value, start_ts, end_ts
+                    )
+                    or 0
+                )
+            token_fees_in_usd += token_fee * Decimal(token_price)
+        fees[pool] = {
+            "symbol": snapshot_now.symbol,
+            "pool_addr": snapshot_now.pool_address,
+            "bpt_token_fee": round(bpt_token_fee, 2),
+            "bpt_token_fee_in_usd": round(
+                Decimal(bpt_token_fee) * (bpt_twap_prices[chain.value][pool] or 0), 2
+            ),
+            "token_fees_in_usd": round(token_fees_in_usd, 2),
+            "chain": chain.value,
+            "token_fees": [],
+        }
+    return fees
+
+
+def _counters(pools: List[str], snapshots: Dict[str, PoolSnapshot]) -> Dict[str, List]:
+    return {pool: snapshots[pool].to_list() for pool in pools if pool in snapshots}
+
+
+def _baseline(ledger: Dict) -> Dict[str, PoolSnapshot]:
+    """
+    Latest stored counters of every tracked pool
+    """
+    counters = {}
+    for day in ledger["days"]:
+        counters.update(day["counters"])
+    return {pool: PoolSnapshot.from_list(data) for pool, data in counters.items()}
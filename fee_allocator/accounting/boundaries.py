@@ -0,0 +1,96 @@
+"""
+Epoch boundaries shared by consecutive runs.
+
+The end of an epoch is the start of the next one, so every run stores its end boundary per chain:
+the block at timestamp_now and snapshots of core pools at that block. The next run seeds the
+local cache with the boundary stored for its timestamp_2_weeks_ago, so the fetch plan and fee
+collection find the start block and snapshots cached instead of fetching them again.
+Boundaries are stored next to the allocations, so they outlive the local cache. Only runs
+ending at 00:00 UTC, where epochs end, store a boundary.
+"""
+
+import json
+import os
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from fee_allocator.accounting import PROJECT_ROOT
+from fee_allocator.cache import disk_cache_get
+from fee_allocator.cache import disk_cache_set
+from fee_allocator.cache import is_thread_readonly
+from fee_allocator.helpers import clamp_block_timestamp
+from fee_allocator.helpers import get_subgraph_url
+from fee_allocator.snapshots import PoolSnapshot
+
+BOUNDARIES_DIR = os.path.join(PROJECT_ROOT, "fee_allocator/allocations/boundaries")
+
+
+def is_epoch_boundary(timestamp: int) -> bool:
+    """
+    Epochs start and end at 00:00 UTC, runs ending at any other time are previews
+    """
+    return timestamp % 86400 == 0
+
+
+def _boundary_file(chain: str, timestamp: int) -> str:
+    return os.path.join(BOUNDARIES_DIR, f"{chain}_{timestamp}.json")
+
+
+def save_boundary(
+    chain: str,
+    timestamp: int,
+    block: int,
+    snapshots: Dict[str, PoolSnapshot],
+    pools: List[str],
+) -> Optional[str]:
+    """
+    Store the block at timestamp and snapshots of pools at that block.
+    Nothing is stored by stages that ran out of time
+    """
+    if is_thread_readonly():
+        return None
+    os.makedirs(BOUNDARIES_DIR, exist_ok=True)
+    file_name = _boundary_file(chain, timestamp)
+    with open(file_name, "w") as f:
+        json.dump(
+            {
+                "chain": chain,
+                "timestamp": timestamp,
+                "block": block,
+                "snapshots": [
+                    snapshots[pool].to_list() for pool in pools if pool in snapshots
+                ],
+            },
+            f,
+            indent=2,
+        )
+    return file_name
+
+
+def load_boundary(chain: str, timestamp: int) -> Optional[Dict]:
+    try:
+        with open(_boundary_file(chain, timestamp)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def seed_start_boundary(chain: str, timestamp: int, pools: List[str]) -> bool:
+    """
+    Seed the local cache with the block and pool snapshots stored for timestamp.
+    Snapshots are only seeded when they cover all pools, a pool missing from them would
+    look like it paid its whole fee counters in the epoch. Returns whether snapshots were seeded
+    """
+    boundary = load_boundary(chain, timestamp)
+    if boundary is None:
+        return False
+    block_key = f"{chain}:{clamp_block_timestamp(timestamp)}"
+    if disk_cache_get("blocks", block_key) is None:
+        disk_cache_set("blocks", block_key, boundary["block"])
+    if not set(pools) <= {data[0] for data in boundary["snapshots"]}:
+        return False
+    snapshots_key = f"{get_subgraph_url(chain)}:{boundary['block']}"
+    if disk_cache_get("pool_snapshots", snapshots_key) is None:
+        disk_cache_set("pool_snapshots", snapshots_key, boundary["snapshots"])
+    return True
@@ -0,0 +1,66 @@
+import time
+from typing import Dict
+
+from munch import Munch
+from web3 import Web3
+
+from fee_allocator.accounting.fee_pipeline import fetch_pipeline_configs
+from fee_allocator.accounting.fee_pipeline import get_valid_core_pools
+from fee_allocator.accounting.fee_pipeline import store_core_pools
+from fee_allocator.accounting.logger import logger
+from fee_allocator.accounting.settings import BLOCK_SAMPLE_INTERVAL
+from fee_allocator.accounting.settings import CACHE_MAX_AGE_DAYS
+from fee_allocator.accounting.settings import Chains
+from fee_allocator.cache import prune_disk_cache
+from fee_allocator.helpers import get_balancer_pool_snapshots
+from fee_allocator.helpers import get_block_by_ts
+from fee_allocator.helpers import get_pools_tokens
+from fee_allocator.helpers import get_subgraph_url
+from fee_allocator.helpers import get_token_price_history
+from fee_allocator.helpers import get_tokens_metadata
+
+
+def warm_caches(
+    web3_instances: Munch[Web3],
+    timestamp_now: int,
+    timestamp_2_weeks_ago: int,
+) -> Dict[str, int]:
+    """
+    Prefetch data of the running epoch into the local disk cache: core pools list,
+    block samples every BLOCK_SAMPLE_INTERVAL seconds, pool snapshots at the epoch start,
+    token metadata and price histories of core pool tokens.
+    Meant to run daily during the epoch, samples that are already cached are not fetched again
+    and stored price histories are only extended with the prices since the previous day
+    """
+    pruned = prune_disk_cache(CACHE_MAX_AGE_DAYS * 24 * 60 * 60)
+    core_pools, _, _ = fetch_pipeline_configs()
+    store_core_pools(core_pools)
+    stats = {"pruned": pruned, "blocks": 0, "tokens": 0}
+    for chain in Chains:
+        listed_core_pools = core_pools.get(chain.value)
+        if listed_core_pools is None:
+            continue
+        logger.info(f"Warming caches for {chain.value}")
+        pools = get_valid_core_pools(chain, listed_core_pools)
+        if not pools:
+            continue
+        sample_timestamps = range(
+            timestamp_2_weeks_ago, timestamp_now, BLOCK_SAMPLE_INTERVAL
+        )
+        blocks = [get_block_by_ts(ts, chain.value) for ts in sample_timestamps]
+        stats["blocks"] += len(blocks)
+        if not blocks:
+            continue
+        # Snapshots at the start of the epoch are the same for the final run
+        get_balancer_pool_snapshots(blocks[0], get_subgraph_url(chain.value))
+        web3 = web3_instances[chain.value]
+        tokens = get_pools_tokens(web3, chain.value, list(pools.keys()))
+        get_tokens_metadata(web3, chain.value, tokens)
+        for token in tokens:
+            get_token_price_history(token, chain.value, int(time.time()))
+        stats["tokens"] += len(tokens)
+    logger.info(
+        f"Warmed {stats['blocks']} block samples and {stats['tokens']} tokens, "
+        f"pruned {stats['pruned']} stale cache files"
+    )
+    return stats
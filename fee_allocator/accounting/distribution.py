@@ -4,10 +4,17 @@ from decimal import Decimal
 from typing import Dict
 from typing import List
 from typing import Optional
+from typing import Tuple
 import requests
 
-from bal_tools import BalPoolsGauges
+from fee_allocator.accounting.logger import logger
+from fee_allocator.accounting.money import apportion
+from fee_allocator.accounting.money import from_micro
+from fee_allocator.accounting.money import mul_micro
+from fee_allocator.accounting.money import to_micro
 from fee_allocator.accounting.settings import Chains, OVERRIDES_URL
+from fee_allocator.accounting.settings import HTTP_TIMEOUT
+from fee_allocator.helpers import get_last_join_exit
 
 
 # TODO remove existing existing_aura_bribs from function.  Perhaps find another way to count aura votes already placed
@@ -28,38 +35,39 @@ def calc_and_split_incentives(
     Calculate and split incentives between aura and balancer pools
     """
     pool_incentives = {}
+    # Totals are split in integer micro-USDC so that every cent is accounted for
+    fees_to_distribute_micro = to_micro(fees_to_distribute)
+    fees_to_dao_micro = mul_micro(fees_to_distribute_micro, dao_share)
+    fees_to_vebal_micro = mul_micro(fees_to_distribute_micro, vebal_share)
     # Calculate pool share in fees
-    fees_to_distr_wo_dao_vebal = (
-        fees_to_distribute
-        - (fees_to_distribute * dao_share)
-        - (fees_to_distribute * vebal_share)
+    fees_to_distr_wo_dao_vebal_micro = (
+        fees_to_distribute_micro - fees_to_dao_micro - fees_to_vebal_micro
     )
     # Calculate totals
-    bpt_fees = sum([data["bpt_token_fee_in_usd"] for pool, data in fees.items()])
-    token_fees = sum([data["token_fees_in_usd"] for pool, data in fees.items()])
-    total_fees = bpt_fees + token_fees
+    pool_fees = {
+        pool: data["bpt_token_fee_in_usd"] + data["token_fees_in_usd"]
+        for pool, data in fees.items()
+    }
+    total_fees = sum(pool_fees.values())
     if not total_fees:
         return {}
-    for pool, data in fees.items():
-        pool_fees = data["bpt_token_fee_in_usd"] + data["token_fees_in_usd"]
-        pool_share = pool_fees / Decimal(total_fees)
-        # If aura incentives is less than 500 USDC, we pay all incentives to balancer
-        total_incentive = pool_share * fees_to_distr_wo_dao_vebal
-
-        aura_incentives = round(total_incentive * aura_vebal_share, 4)
-        bal_incentives = round(total_incentive - aura_incentives, 4)
-        fees_to_dao = round(pool_share * fees_to_distribute * dao_share, 4)
-        fees_to_vebal = round(pool_share * fees_to_distribute * vebal_share, 4)
+    pool_weights = [to_micro(fee) for fee in pool_fees.values()]
+    total_incentives = apportion(fees_to_distr_wo_dao_vebal_micro, pool_weights)
+    fees_to_dao = apportion(fees_to_dao_micro, pool_weights)
+    fees_to_vebal = apportion(fees_to_vebal_micro, pool_weights)
+    for index, (pool, data) in enumerate(fees.items()):
         # Split fees between aura and bal fees
+        aura_incentives = mul_micro(total_incentives[index], aura_vebal_share)
+        bal_incentives = total_incentives[index] - aura_incentives
         pool_incentives[pool] = {
             "chain": chain,
             "symbol": data["symbol"],
-            "earned_fees": pool_fees,
-            "fees_to_vebal": fees_to_vebal,
-            "fees_to_dao": fees_to_dao,
-            "total_incentives": aura_incentives + bal_incentives,
-            "aura_incentives": aura_incentives,
-            "bal_incentives": bal_incentives,
+            "earned_fees": pool_fees[pool],
+            "fees_to_vebal": from_micro(fees_to_vebal[index]),
+            "fees_to_dao": from_micro(fees_to_dao[index]),
+            "total_incentives": from_micro(total_incentives[index]),
+            "aura_incentives": from_micro(aura_incentives),
+            "bal_incentives": from_micro(bal_incentives),
             "redirected_incentives": Decimal(0),
             "reroute_incentives": Decimal(0),
         }
@@ -79,15 +87,28 @@ def filter_dusty_bal_incentives(
     return incentives
 
 
-def handle_aura_min(incentives: dict, min_aura_incentive: Decimal):
+def fetch_overrides() -> Dict[str, Dict]:
+    """
+    Fetch pool incentives overrides config
+    """
+    return requests.get(OVERRIDES_URL, timeout=HTTP_TIMEOUT).json()
+
+
+def handle_aura_min(
+    incentives: dict,
+    min_aura_incentive: Decimal,
+    overrides: Optional[Dict[str, Dict]] = None,
+):
     """
     Redistribute all incentives away from pools that are < min_aura_incentive amount.
-    Compensate by moving bal incentives to Aura incentives on pools that are already over the limit
+    Compensate by moving bal incentives to Aura incentives on pools that are already over the limit.
+    Replaced by solve_aura_min in the pipeline, kept as its test oracle and benchmark baseline
     """
     # First we shift all incentives from pools that are under the min_aura_incentive to the balancer market
     # We keep track of our debt to the Aura market
 
-    overrides = requests.get(OVERRIDES_URL).json()
+    if overrides is None:
+        overrides = fetch_overrides()
     debt_to_aura_market = 0
     for pool_id, _data in incentives.items():
         override_data = overrides.get(pool_id, {})
@@ -116,10 +137,10 @@ def handle_aura_min(incentives: dict, min_aura_incentive: Decimal):
             print(
                 f"WARNING: {incentives[pool_id]['chain']}:{pool_id} has no pools over min_aura_incentive, but owes {debt_to_aura_market} to the aura market.  Debt will not be repaid."
             )
-            amount_per_pool = 0
-        else:
-            amount_per_pool = round(debt_to_aura_market / num_pools_over_min, 4)
-        for pool_id in pools_over_aura_min:
+        amounts_per_pool = apportion(
+            to_micro(debt_to_aura_market), [1] * num_pools_over_min
+        )
+        for pool_id, amount_per_pool in zip(pools_over_aura_min, amounts_per_pool):
             ## TODO: Consider this logic as an additional test/more sensitive handlingthat could allow pool selection based
             #   on total_incentives instead of aura incentives
             #   if (incentives['aura_incentives'] + amount_per_pool) < min_aura_incentive:
@@ -127,15 +148,12 @@ def handle_aura_min(incentives: dict, min_aura_incentive: Decimal):
             # Distribute the aura_debt to the pools that are over the min_aura_incentive
             if incentives[pool_id]["total_incentives"] > 0:
                 # TODO:  Need to think about edge cases here and watch them.
-                incentives[pool_id]["aura_incentives"] += min(
-                    amount_per_pool, incentives[pool_id]["bal_incentives"]
-                )
-                incentives[pool_id]["bal_incentives"] -= min(
-                    amount_per_pool, incentives[pool_id]["bal_incentives"]
-                )
-                debt_repaid += min(
-                    amount_per_pool, incentives[pool_id]["bal_incentives"]
+                shift = min(
+                    from_micro(amount_per_pool), incentives[pool_id]["bal_incentives"]
                 )
+                incentives[pool_id]["aura_incentives"] += shift
+                incentives[pool_id]["bal_incentives"] -= shift
+                debt_repaid += shift
             if debt_to_aura_market - debt_repaid >= 0:
                 print(
                     f"{incentives[pool_id]['chain']}:{pool_id}  remaining debt to aura market: {debt_to_aura_market}, Debt repaid: {debt_repaid}, debt remaining: {debt_to_aura_market - debt_repaid}"
@@ -143,17 +161,89 @@ def handle_aura_min(incentives: dict, min_aura_incentive: Decimal):
     return incentives
 
 
+def solve_aura_min(
+    incentives: Dict[str, Dict],
+    min_aura_incentive: Decimal,
+    overrides: Optional[Dict[str, Dict]] = None,
+    buffer: Decimal = Decimal(0),
+) -> Tuple[Dict[str, Dict], Decimal]:
+    """
+    Final Aura/BAL split in one pass. Every pool ends with either 0 or at least min_aura_incentive
+    Aura incentives, pools overridden to bal get no Aura incentives.
+    Pools already over min_aura_incentive keep their Aura incentives. Of the pools within buffer
+    below it, as many as the Aura total can top up are kept, the largest by total incentives first.
+    Aura incentives of all other pools are Aura debt, which repays top ups first. The rest is split
+    evenly between kept pools in incentives order, capped by their BAL incentives.
+    Returns incentives and debt that could not be repaid
+    """
+    if overrides is None:
+        overrides = fetch_overrides()
+    min_aura = to_micro(min_aura_incentive)
+    min_candidate_aura = to_micro(min_aura_incentive * (1 - Decimal(buffer)))
+    aura = {
+        pool_id: to_micro(_data["aura_incentives"])
+        for pool_id, _data in incentives.items()
+    }
+    bal = {
+        pool_id: to_micro(_data["bal_incentives"])
+        for pool_id, _data in incentives.items()
+    }
+    total_aura = sum(aura.values())
+    candidates = [
+        pool_id
+        for pool_id in incentives
+        if overrides.get(pool_id, {}).get("voting_pool_override") != "bal"
+        and aura[pool_id] >= min_candidate_aura
+        and aura[pool_id] + bal[pool_id] >= min_aura
+    ]
+    kept = [pool_id for pool_id in candidates if aura[pool_id] >= min_aura]
+    below_min = sorted(
+        (pool_id for pool_id in candidates if aura[pool_id] < min_aura),
+        key=lambda pool_id: -(aura[pool_id] + bal[pool_id]),
+    )
+    if below_min:
+        # Every kept pool below the min ends with at least min_aura
+        kept_aura = sum(aura[pool_id] for pool_id in kept)
+        kept += below_min[: (total_aura - kept_aura) // min_aura]
+    top_ups = {pool_id: max(min_aura - aura[pool_id], 0) for pool_id in kept}
+    debt = total_aura - sum(aura[pool_id] for pool_id in kept) - sum(top_ups.values())
+    # Even split with caps: pools with the least room left are filled first
+    order = {pool_id: index for index, pool_id in enumerate(incentives)}
+    shifts = dict(top_ups)
+    by_room = sorted(kept, key=lambda pool_id: bal[pool_id] - top_ups[pool_id])
+    for index, pool_id in enumerate(by_room):
+        room = bal[pool_id] - top_ups[pool_id]
+        pools_left = len(by_room) - index
+        if room * pools_left >= debt:
+            for pool_id_left, part in zip(
+                sorted(by_room[index:], key=order.get),
+                apportion(debt, [1] * pools_left),
+            ):
+                shifts[pool_id_left] += part
+            debt = 0
+            break
+        shifts[pool_id] += room
+        debt -= room
+    for pool_id, _data in incentives.items():
+        shift = shifts.get(pool_id, -aura[pool_id])
+        _data["aura_incentives"] = from_micro(aura[pool_id] + shift)
+        _data["bal_incentives"] = from_micro(bal[pool_id] - shift)
+    return incentives, from_micro(debt)
+
+
 def re_distribute_incentives(
     incentives: Dict[str, Dict],
     min_aura_incentive: Decimal,
     min_incentive_amount: Decimal,
     first_pass_buffer: Decimal = Decimal(0.25),
+    overrides: Optional[Dict[str, Dict]] = None,
 ) -> Dict[str, Dict]:
     """
     Redistribute all incentives away from pools that are < min_vote_incentive amount
     Insure that all pools receive at least min_aura_incentive, if not, distribute to BAL
     Maintain the AURA/BAL split systemwide by redistributing value from the BAL to AURA market on the largest pools
         in order to compensate for pools that surredered value to the BAL market.
+    Overrides config is fetched if not passed in
     """
     # Collect pools that received < min_vote_incentive_amount
     pools_to_redistribute = {}
@@ -165,62 +255,72 @@ def re_distribute_incentives(
     for pool_id, _data in incentives.items():
         if _data["total_incentives"] >= Decimal(min_incentive_amount):
             pools_to_receive[pool_id] = _data
-    # Redistribute incentives
+    # Collect incentives to redistribute in micro-USDC
+    incentives_to_redistribute_aura = 0
+    incentives_to_redistribute_bal = 0
     for pool_id, _data in pools_to_redistribute.items():
-        # Calculate incentives to redistribute
-        incentives_to_redistribute = _data["total_incentives"]
-        incentives_to_redistribute_aura = _data["aura_incentives"]
-        incentives_to_redistribute_bal = _data["bal_incentives"]
+        incentives_to_redistribute_aura += to_micro(_data["aura_incentives"])
+        incentives_to_redistribute_bal += to_micro(_data["bal_incentives"])
+        # Mark incentives as redistributed
+        incentives[pool_id]["redirected_incentives"] = -_data["total_incentives"]
         # Set incentives to redistribute to 0
         incentives[pool_id]["total_incentives"] = 0
         incentives[pool_id]["aura_incentives"] = 0
         incentives[pool_id]["bal_incentives"] = 0
-        # Mark incentives as redistributed
-        incentives[pool_id]["redirected_incentives"] = -incentives_to_redistribute
-        # Redistribute incentives
-        _pool_weights = {
-            pool_id_to_receive: _data_to_receive["earned_fees"]
-            / sum([x["earned_fees"] for x in pools_to_receive.values()])
-            for pool_id_to_receive, _data_to_receive in pools_to_receive.items()
-        }
-        for pool_id_to_receive, _data_to_receive in pools_to_receive.items():
-            # Calculate pool weight:
-            pool_weight = _pool_weights[pool_id_to_receive]
-            # Calculate incentives to receive
-            to_receive = round(incentives_to_redistribute * pool_weight, 4)
-            to_receive_aura = round(incentives_to_redistribute_aura * pool_weight, 4)
-            to_receive_bal = round(incentives_to_redistribute_bal * pool_weight, 4)
-            incentives[pool_id_to_receive]["aura_incentives"] += to_receive_aura
-            incentives[pool_id_to_receive]["bal_incentives"] += to_receive_bal
-            incentives[pool_id_to_receive]["total_incentives"] += to_receive
-            incentives[pool_id_to_receive]["redirected_incentives"] += to_receive
+    # Redistribute the sums proportionally to earned fees, each split once so
+    # rounding of every pool's share happens once too
+    _pool_weights = [to_micro(x["earned_fees"]) for x in pools_to_receive.values()]
+    to_receive_aura = apportion(incentives_to_redistribute_aura, _pool_weights)
+    to_receive_bal = apportion(incentives_to_redistribute_bal, _pool_weights)
+    for index, pool_id_to_receive in enumerate(pools_to_receive.keys()):
+        # Calculate incentives to receive
+        to_receive = from_micro(to_receive_aura[index] + to_receive_bal[index])
+        incentives[pool_id_to_receive]["aura_incentives"] += from_micro(
+            to_receive_aura[index]
+        )
+        incentives[pool_id_to_receive]["bal_incentives"] += from_micro(
+            to_receive_bal[index]
+        )
+        incentives[pool_id_to_receive]["total_incentives"] += to_receive
+        incentives[pool_id_to_receive]["redirected_incentives"] += to_receive
     # Now after everything is done, we need to make sure that all pools have at least min_aura_incentive
     # if not we need to redistribute all aura_incentives to bal_incentives for that pool and keep track of how much has been reallocated
 
-    # First redistribute with a % buffer.
+    # Pools within first_pass_buffer of min_aura_incentive may be topped up from the Aura debt
     print(f"Redistributing Aura with a {first_pass_buffer} buffer.")
-    result = handle_aura_min(
-        incentives, min_aura_incentive * Decimal(1 - first_pass_buffer)
+    result, unrepaid_debt = solve_aura_min(
+        incentives, min_aura_incentive, overrides, first_pass_buffer
     )
-    # Now redistribute again with no buffer
-    print(f"Final pass: Redistributing Aura with no buffer.")
-    return handle_aura_min(result, min_aura_incentive)
+    if unrepaid_debt:
+        chain = next(iter(result.values()))["chain"]
+        logger.warning(
+            f"{chain} owes {unrepaid_debt} to the aura market that pools over min_aura_incentive can't take. Debt will not be repaid."
+        )
+    return result
 
 
 def add_last_join_exit(
-    incentives: Dict[str, Dict], chain: Chains, alertTimeStamp: Optional[int] = None
+    incentives: Dict[str, Dict],
+    chain: Chains,
+    alertTimeStamp: Optional[int] = None,
+    last_join_exits: Optional[Dict[str, Optional[int]]] = None,
 ) -> Dict[str, Dict]:
     """
     adds last_join_exit for each pool in the incentives list for reporting.
-    Returns the same thing as inputed with the additional field added for each line
+    Returns the same thing as inputed with the additional field added for each line.
+    Timestamps are fetched per pool unless passed in last_join_exits, None where fetching failed
     """
-    q = BalPoolsGauges(chain.value)
     results = {}
     for pool_id, incentive_data in incentives.items():
         results[pool_id] = incentive_data
-        try:
-            timestamp = q.get_last_join_exit(pool_id)
-        except:
+        if last_join_exits is not None:
+            timestamp = last_join_exits.get(pool_id)
+        else:
+            try:
+                timestamp = get_last_join_exit(chain.value, pool_id)
+            except:
+                timestamp = None
+        if timestamp is None:
             results[pool_id]["last_join_exit"] = "Error fetching"
             continue
         gmt_time = datetime.datetime.utcfromtimestamp(timestamp)
@@ -0,0 +1,247 @@
+"""
+Local ledger of fees collected per epoch, synced from Mimic reports.
+
+The ledger indexes fees swept on every chain by epoch, in micro-USDC, under keys named like the
+report files in fee_allocator/fees_collected: <start>_<end> with dates as YYYY-MM-DD.
+A sync imports report files the ledger doesn't have yet, finds epochs missing after the latest
+one, fetches their reports concurrently and writes them to the ledger and as report files, so
+merging the file still triggers the fee round.
+"""
+
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import requests
+
+from fee_allocator.accounting import PROJECT_ROOT
+from fee_allocator.accounting.logger import logger
+from fee_allocator.accounting.money import from_micro
+from fee_allocator.accounting.money import to_micro
+from fee_allocator.accounting.settings import FEE_LEDGER_MAX_WORKERS
+from fee_allocator.accounting.settings import HTTP_TIMEOUT
+from fee_allocator.accounting.settings import MIMIC_CHAIN_ID
+from fee_allocator.accounting.settings import MIMIC_ENV_ID
+from fee_allocator.accounting.settings import MIMIC_SUMMARY_URL
+from fee_allocator.cache import disk_cache_get
+from fee_allocator.cache import disk_cache_set
+
+FEES_COLLECTED_DIR = os.path.join(PROJECT_ROOT, "fee_allocator/fees_collected")
+LEDGER_FILE = os.path.join(FEES_COLLECTED_DIR, "ledger.json")
+EPOCH_DAYS = 14
+RETRY_STATUS_FORCELIST = [429, 500, 502, 503, 504, 520]
+# Early report files name some dates with an underscore, like 2023-12_07
+_REPORT_FILE = re.compile(r"^fees_(\d{4}-\d{2}[-_]\d{2})_(\d{4}-\d{2}[-_]\d{2})\.json$")
+
+
+def epoch_key(start: date, end: date) -> str:
+    return f"{start.isoformat()}_{end.isoformat()}"
+
+
+def load_ledger() -> Dict[str, Dict]:
+    """
+    Returns stored epochs by key, oldest first
+    """
+    if not os.path.exists(LEDGER_FILE):
+        return {}
+    with open(LEDGER_FILE) as f:
+        return json.load(f)["epochs"]
+
+
+def save_ledger(epochs: Dict[str, Dict]) -> None:
+    with open(LEDGER_FILE, "w") as f:
+        json.dump(
+            {"epochs": dict(sorted(epochs.items(), key=lambda e: e[1]["end"]))},
+            f,
+            indent=2,
+        )
+        f.write("\n")
+
+
+def to_micro_fees(report: Dict) -> Dict[str, int]:
+    """
+    Fees per chain in micro-USDC. Mimic reports are in micro-USDC already,
+    older hand made reports are in USDC. Some of those have whole amounts, so a report
+    is only read as micro-USDC when all amounts are ints
+    """
+    if all(isinstance(amount, int) for amount in report.values()):
+        return {chain: int(amount) for chain, amount in report.items()}
+    return {chain: to_micro(amount) for chain, amount in report.items()}
+
+
+def import_report_files(epochs: Dict[str, Dict]) -> List[str]:
+    """
+    Add report files of fee_allocator/fees_collected missing from the ledger, returns their keys
+    """
+    imported = []
+    for file_name in sorted(os.listdir(FEES_COLLECTED_DIR)):
+        match = _REPORT_FILE.match(file_name)
+        if match is None:
+            continue
+        start, end = (date.fromisoformat(d.replace("_", "-")) for d in match.groups())
+        key = epoch_key(start, end)
+        if key in epochs:
+            continue
+        with open(os.path.join(FEES_COLLECTED_DIR, file_name)) as f:
+            report = json.load(f)
+        epochs[key] = {
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "fees": to_micro_fees(report),
+        }
+        imported.append(key)
+    return imported
+
+
+def missing_epochs(epochs: Dict[str, Dict], until: date) -> List[Tuple[date, date]]:
+    """
+    Epochs that ended by until and aren't stored, from the earliest stored one on.
+    Gaps left by failed syncs between stored epochs are included
+    """
+    if not epochs:
+        return []
+    stored_ends = {date.fromisoformat(epoch["end"]) for epoch in epochs.values()}
+    end = min(stored_ends)
+    missing = []
+    while end + timedelta(days=EPOCH_DAYS) <= until:
+        if end + timedelta(days=EPOCH_DAYS) not in stored_ends:
+            missing.append((end, end + timedelta(days=EPOCH_DAYS)))
+        end += timedelta(days=EPOCH_DAYS)
+    return missing
+
+
+def fetch_mimic_report(
+    end: date,
+    use_cache: bool = True,
+    retries: int = 3,
+    retry_backoff_factor: float = 0.5,
+) -> Dict[str, int]:
+    """
+    Mimic summary of fees swept for the epoch ending on end, in micro-USDC per chain.
+    Fails when the report has no fees yet. Reports are stored in the local disk cache
+    """
+    cached = disk_cache_get("mimic_reports", end.isoformat()) if use_cache else None
+    if cached is not None:
+        return cached
+    # docs: https://mimic-fi.notion.site/Balancer-API-explanation-1289958dbf4d80beb76ad13462898fee
+    params = {
+        "envId": MIMIC_ENV_ID,
+        "chainId": MIMIC_CHAIN_ID,
+        "startDate": (end - timedelta(days=1)).isoformat(),
+        "endDate": end.isoformat(),
+    }
+    for attempt in range(retries + 1):
+        try:
+            response = requests.get(
+                f"{MIMIC_SUMMARY_URL}{MIMIC_ENV_ID}",
+                params=params,
+                timeout=HTTP_TIMEOUT,
+            )
+            response.raise_for_status()
+            break
+        except requests.RequestException as e:
+            retryable = e.response is None or (
+                e.response.status_code in RETRY_STATUS_FORCELIST
+            )
+            if attempt == retries or not retryable:
+                raise
+            time.sleep(retry_backoff_factor * 2**attempt)
+    report = {
+        chain: int(amount) for chain, amount in response.json()["depositors"].items()
+    }
+    if sum(report.values()) <= 0:
+        raise ValueError(f"Sum of collected fees ending {end} is not > 0")
+    disk_cache_set("mimic_reports", end.isoformat(), report)
+    return report
+
+
+def write_report_file(start: date, end: date, fees: Dict[str, int]) -> str:
+    file_name = os.path.join(FEES_COLLECTED_DIR, f"fees_{epoch_key(start, end)}.json")
+    with open(file_name, "w") as f:
+        json.dump(fees, f, indent=2)
+    return file_name
+
+
+def sync_fee_ledger(
+    until: Optional[date] = None, refetch: Iterable[str] = ()
+) -> Dict[str, Dict]:
+    """
+    Import report files, fetch reports of missing epochs and of epochs ending on the
+    refetch dates, and store them in the ledger. Returns the ledger
+    """
+    until = until or datetime.now(timezone.utc).date()
+    epochs = load_ledger()
+    imported = import_report_files(epochs)
+    to_fetch = [(start, end, True) for start, end in missing_epochs(epochs, until)]
+    starts_by_end = {epoch["end"]: epoch["start"] for epoch in epochs.values()}
+    for end_day in refetch:
+        end = date.fromisoformat(end_day)
+        start = starts_by_end.get(end_day)
+        start = date.fromisoformat(start) if start else end - timedelta(days=EPOCH_DAYS)
+        to_fetch.append((start, end, False))
+    with ThreadPoolExecutor(max_workers=FEE_LEDGER_MAX_WORKERS) as executor:
+        futures = {
+            (start, end): executor.submit(fetch_mimic_report, end, use_cache)
+            for start, end, use_cache in to_fetch
+        }
+    fetched = []
+    for (start, end), future in futures.items():
+        try:
+            fees = future.result()
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"No Mimic report for the epoch ending {end}: {e}")
+            continue
+        key = epoch_key(start, end)
+        epochs[key] = {"start": start.isoformat(), "end": end.isoformat(), "fees": fees}
+        write_report_file(start, end, fees)
+        fetched.append(key)
+    if imported or fetched:
+        save_ledger(epochs)
+    logger.info(
+        f"Fee ledger: {len(epochs)} epochs, {len(imported)} imported from files, "
+        f"{len(fetched)} of {len(to_fetch)} fetched from Mimic"
+    )
+    return epochs
+
+
+def _to_usdc(fees: Dict[str, int]) -> Dict[str, float]:
+    return {chain: float(from_micro(amount)) for chain, amount in fees.items()}
+
+
+def get_epoch_fees(timestamp_now: int) -> Optional[Dict[str, float]]:
+    """
+    Fees to distribute per chain in USDC for the epoch ending on the day of timestamp_now,
+    None when the ledger doesn't have it
+    """
+    end = datetime.fromtimestamp(timestamp_now, timezone.utc).date().isoformat()
+    epochs_by_end = {epoch["end"]: epoch for epoch in load_ledger().values()}
+    if end not in epochs_by_end:
+        return None
+    return _to_usdc(epochs_by_end[end]["fees"])
+
+
+def get_report_fees(file_name: str) -> Optional[Dict[str, float]]:
+    """
+    Fees to distribute per chain in USDC for the epoch of a report file, imported into
+    the ledger when it isn't there yet. None for files that aren't epoch reports
+    """
+    match = _REPORT_FILE.match(file_name)
+    if match is None:
+        return None
+    start, end = (date.fromisoformat(d.replace("_", "-")) for d in match.groups())
+    epochs = load_ledger()
+    if epoch_key(start, end) not in epochs and import_report_files(epochs):
+        save_ledger(epochs)
+    epoch = epochs.get(epoch_key(start, end))
+    return _to_usdc(epoch["fees"]) if epoch is not None else None
@@ -1,170 +1,399 @@
-import datetime
+import json
 import os
+import time
 from decimal import Decimal
+from typing import Collection
 from typing import Dict
 from typing import List
+from typing import Optional
+from typing import Tuple
 
 import pandas as pd
 import requests
+import simplejson
 from munch import Munch
 from web3 import Web3
 
-from bal_tools import BalPoolsGauges, Subgraph
 from fee_allocator.accounting import PROJECT_ROOT
+from fee_allocator.accounting.accrual import accrued_usd
+from fee_allocator.accounting.accrual import collect_accrued_fee_info
+from fee_allocator.accounting.accrual import get_accrual_ledger
+from fee_allocator.accounting.accrual import is_tracked
+from fee_allocator.accounting.accrual import track_chain_accrual
+from fee_allocator.accounting.boundaries import is_epoch_boundary
+from fee_allocator.accounting.boundaries import save_boundary
+from fee_allocator.accounting.boundaries import seed_start_boundary
 from fee_allocator.accounting.collectors import collect_fee_info
 from fee_allocator.accounting.distribution import calc_and_split_incentives
 from fee_allocator.accounting.distribution import re_distribute_incentives
 from fee_allocator.accounting.distribution import re_route_incentives
 from fee_allocator.accounting.distribution import add_last_join_exit
+from fee_allocator.accounting.distribution import fetch_overrides
 from fee_allocator.accounting.distribution import filter_dusty_bal_incentives
 
+from fee_allocator.accounting.fee_ledger import get_report_fees
+from fee_allocator.accounting.fetch_plan import build_fetch_plan
+from fee_allocator.accounting.fetch_plan import execute_fetch_plan
+from fee_allocator.accounting.fetch_plan import format_fetch_plan
+from fee_allocator.accounting.freshness import FreshnessGate
+from fee_allocator.accounting.log_fees import collect_log_fee_info
 from fee_allocator.accounting.logger import logger
+from fee_allocator.accounting.settings import BPT_PRICE_SAMPLES
+from fee_allocator.accounting.settings import CHAIN_BUDGET
+from fee_allocator.accounting.settings import CONFIG_CACHE_TTL
 from fee_allocator.accounting.settings import CORE_POOLS_URL
 from fee_allocator.accounting.settings import Chains
 from fee_allocator.accounting.settings import FEE_CONSTANTS_URL
+from fee_allocator.accounting.settings import FEE_SOURCE
+from fee_allocator.accounting.settings import HTTP_TIMEOUT
 from fee_allocator.accounting.settings import REROUTE_CONFIG_URL
 from fee_allocator.accounting.settings import MIN_VERBAL_BRIBE_AFTER_ALL_REDISTRIBUTIONS
+from fee_allocator.accounting.stages import Deadline
+from fee_allocator.accounting.stages import is_stage_cached
+from fee_allocator.accounting.stages import reset_stages
+from fee_allocator.accounting.stages import run_stage
+from fee_allocator.accounting.stages import stage_runs
+from fee_allocator.cache import disk_cache_get
+from fee_allocator.cache import disk_cache_set
+from fee_allocator.cache import reset_single_flight
+from fee_allocator.gauge_registry import get_gauge_registry
 from fee_allocator.helpers import calculate_aura_vebal_share
 from fee_allocator.helpers import fetch_hh_aura_bribs
 from fee_allocator.helpers import get_balancer_pool_snapshots
 from fee_allocator.helpers import get_block_by_ts
-from fee_allocator.helpers import get_twap_bpt_price
+from fee_allocator.helpers import get_pools_gauges
+from fee_allocator.helpers import get_subgraph_url
+from fee_allocator.helpers import bpt_price_sample_timestamps
+from fee_allocator.helpers import get_sampled_twap_bpt_prices
+from fee_allocator.helpers import get_twap_bpt_prices
 
 
-def run_fees(
-    web3_instances: Munch[Web3],
+def load_fees_to_distribute(fees_file_name: str) -> Dict:
+    """
+    Load fees to distribute per chain from fee_allocator/fees_collected.
+    Epoch reports are read from the fee ledger, other files directly.
+    Mimic reports are in micro-USDC, they are translated to float USDC
+    """
+    fees_to_distribute = get_report_fees(fees_file_name)
+    if fees_to_distribute is not None:
+        return fees_to_distribute
+    fees_path = os.path.join(
+        PROJECT_ROOT, f"fee_allocator/fees_collected/{fees_file_name}"
+    )
+    with open(fees_path) as f:
+        fees_to_distribute = json.load(f)
+    if type(fees_to_distribute["mainnet"]) == int:
+        fees_to_distribute = {
+            k: float(Decimal(v) / Decimal(1e6)) for k, v in fees_to_distribute.items()
+        }
+    return fees_to_distribute
+
+
+def fetch_mapped_pools_info() -> Dict[str, str]:
+    """
+    Map pool ids to root gauge addresses, skipping killed gauges
+    """
+    registry = get_gauge_registry()
+    for pool_id in registry.killed():
+        print(
+            f"{pool_id} gauge:{registry.entries[pool_id]['gauge']} is killed, skipping"
+        )
+    return dict(registry.pool_to_gauge)
+
+
+def fetch_pipeline_configs() -> Tuple[Dict, Dict, Dict]:
+    """
+    Fetch current core pools, fee constants and re-route config
+    """
+    core_pools = requests.get(CORE_POOLS_URL, timeout=HTTP_TIMEOUT).json()
+    fee_constants = requests.get(FEE_CONSTANTS_URL, timeout=HTTP_TIMEOUT).json()
+    reroute_config = requests.get(REROUTE_CONFIG_URL, timeout=HTTP_TIMEOUT).json()
+    return core_pools, fee_constants, reroute_config
+
+
+def fetch_core_pools() -> Dict:
+    """
+    Core pools list stored by the cache warmer, fetched again when it is older than CONFIG_CACHE_TTL
+    """
+    cached = disk_cache_get("configs", "core_pools")
+    if cached is not None and time.time() - cached["fetched_at"] < CONFIG_CACHE_TTL:
+        return cached["core_pools"]
+    core_pools = requests.get(CORE_POOLS_URL, timeout=HTTP_TIMEOUT).json()
+    store_core_pools(core_pools)
+    return core_pools
+
+
+def store_core_pools(core_pools: Dict) -> None:
+    disk_cache_set(
+        "configs",
+        "core_pools",
+        {"fetched_at": int(time.time()), "core_pools": core_pools},
+    )
+
+
+def get_valid_core_pools(
+    chain: Chains,
+    listed_core_pools: Dict[str, str],
+    gauge_pools: Optional[Collection[str]] = None,
+) -> Dict:
+    """
+    Remove any core pools that don't have an alive preferential gauge. Those are looked up
+    in the gauge registry unless passed in gauge_pools
+    """
+    if gauge_pools is None:
+        poolutil = get_pools_gauges(chain.value)
+        gauge_pools = {
+            pool_id
+            for pool_id in listed_core_pools
+            if poolutil.has_alive_preferential_gauge(pool_id)
+        }
+    pools = {}
+    for pool_id, description in listed_core_pools.items():
+        if pool_id in gauge_pools:
+            pools[pool_id] = description
+        else:
+            print(
+                f"Warning pool {pool_id}({description}) on chain {chain} is in the core pools list but does not have a gauge.  Skipping."
+            )
+    return pools
+
+
+def collect_chain_fees(
+    chain: Chains,
+    web3: Web3,
+    pools: Dict[str, str],
+    listed_core_pools: Dict[str, str],
     timestamp_now: int,
     timestamp_2_weeks_ago: int,
-    output_file_name: str,
-    fees_to_distribute: dict,
-    mapped_pools_info: dict,
-) -> dict:
+    bpt_price_samples: int = BPT_PRICE_SAMPLES,
+    fee_source: str = FEE_SOURCE,
+    save_boundaries: bool = True,
+) -> Dict[str, Dict]:
     """
-    This function is used to run the fee allocation process
+    Fetch blocks, BPT prices and pool snapshots of a chain and collect fees of valid core pools.
+    With bpt_price_samples > 1 pool balances are averaged over that many blocks in the period.
+    With fee_source "logs" fees are rebuilt from events instead of pool snapshots.
+    Runs ending at an epoch boundary store it, unless save_boundaries is unset
     """
-    # Fetch current core pools:
-    core_pools = requests.get(CORE_POOLS_URL).json()
-    # Fetch fee constants:
-    fee_constants = requests.get(FEE_CONSTANTS_URL).json()
-    # Fetch re-route config:
-    reroute_config = requests.get(REROUTE_CONFIG_URL).json()
-    target_blocks = {}
-    pool_snapshots = {}
-    collected_fees = {}
-    incentives = {}
-    bpt_twap_prices = {chain.value: {} for chain in Chains}
-
-    # Estimate mainnet current block to calculate aura veBAL share
-    _target_mainnet_block = get_block_by_ts(timestamp_now, Chains.MAINNET.value)
-    aura_vebal_share = calculate_aura_vebal_share(
-        web3_instances["mainnet"], _target_mainnet_block
+    target_blocks = (
+        get_block_by_ts(timestamp_now, chain.value),  # Block now
+        get_block_by_ts(timestamp_2_weeks_ago, chain.value),  # Block 2 weeks ago
     )
     logger.info(
-        f"veBAL aura share at block {_target_mainnet_block}: {aura_vebal_share}"
+        f"Running fees collection for {chain.value} between blocks: {target_blocks}"
     )
-    existing_aura_bribs: List[Dict] = fetch_hh_aura_bribs()
-    # Collect all BPT prices:
-    for chain in Chains:
-        print(f"Collecting BPT prices for Chain {chain.value}")
-        poolutil = BalPoolsGauges(chain.value)
-        listed_core_pools = core_pools.get(chain.value, None)
-        pools = {}
-        if listed_core_pools is None or chain.value not in fees_to_distribute:
-            continue
-        ###  Remove any invalid core pools
-        for pool_id, description in listed_core_pools.items():
-            if poolutil.has_alive_preferential_gauge(pool_id):
-                pools[pool_id] = description
-            else:
-                print(
-                    f"Warning pool {pool_id}({description}) on chain {chain} is in the core pools list but does not have a gauge.  Skipping."
-                )
-        if not pools:
-            logger.warning(
-                f"{chain.value} has {fees_to_distribute[chain.value]} in fees but no core pools defined. setting fees to 0."
-            )
-            fees_to_distribute[chain.value] = 0
-            continue
 
-        target_blocks[chain.value] = (
-            get_block_by_ts(timestamp_now, chain.value),  # Block now
-            get_block_by_ts(timestamp_2_weeks_ago, chain.value),  # Block 2 weeks ago
+    logger.info(f"Collecting bpt prices for {chain.value}")
+    if bpt_price_samples > 1:
+        sample_blocks = [
+            get_block_by_ts(ts, chain.value)
+            for ts in bpt_price_sample_timestamps(
+                timestamp_2_weeks_ago, timestamp_now, bpt_price_samples
+            )
+        ]
+        chain_bpt_prices = get_sampled_twap_bpt_prices(
+            list(pools.keys()),
+            chain.value,
+            web3,
+            timestamp_2_weeks_ago,
+            timestamp_now,
+            sample_blocks,
         )
-        logger.info(
-            f"Running fees collection for {chain.value} between blocks: "
-            f"{target_blocks[chain.value]}"
+    else:
+        chain_bpt_prices = get_twap_bpt_prices(
+            list(pools.keys()),
+            chain.value,
+            web3,
+            timestamp_2_weeks_ago,
+            timestamp_now,
+            target_blocks[0],
         )
-
-        logger.info(f"Collecting bpt prices for {chain.value}")
-        for core_pool in pools.keys():
-            _bpt_price = get_twap_bpt_price(
-                core_pool,
-                chain.value,
-                getattr(web3_instances, chain.value),
-                start_date=datetime.datetime.fromtimestamp(timestamp_2_weeks_ago),
-                end_date=datetime.datetime.fromtimestamp(timestamp_now),
-                block_number=target_blocks[chain.value][0],
-            )
-            bpt_twap_prices[chain.value][core_pool] = _bpt_price
-            logger.info(
-                f"Collected bpt price for {pools[core_pool]} pool on {chain.value}: {_bpt_price}"
-            )
+    bpt_twap_prices = {chain.value: chain_bpt_prices}
+    for core_pool, _bpt_price in bpt_twap_prices[chain.value].items():
         logger.info(
-            f"Collecting pool snapshots for {chain.value} between blocks: "
-            f"{target_blocks[chain.value]}"
-        )
-        # Also, collect all pool snapshots:
-        graph_url = Subgraph(chain.value).get_subgraph_url()
-        pool_snapshots[chain.value] = (
-            get_balancer_pool_snapshots(
-                target_blocks[chain.value][0], graph_url
-            ),  # now
-            get_balancer_pool_snapshots(
-                target_blocks[chain.value][1], graph_url
-            ),  # 2 weeks ago
+            f"Collected bpt price for {pools[core_pool]} pool on {chain.value}: {_bpt_price}"
+        )
+    if fee_source == "logs":
+        if save_boundaries and is_epoch_boundary(timestamp_now):
+            save_boundary(chain.value, timestamp_now, target_blocks[0], {}, [])
+        return collect_log_fee_info(
+            listed_core_pools,
+            chain,
+            web3,
+            target_blocks[1],
+            target_blocks[0],
+            start_ts=timestamp_2_weeks_ago,
+            end_ts=timestamp_now,
+            bpt_twap_prices=bpt_twap_prices,
+        )
+    logger.info(
+        f"Collecting pool snapshots for {chain.value} between blocks: "
+        f"{target_blocks}"
+    )
+    graph_url = get_subgraph_url(chain.value)
+    snapshots_now = get_balancer_pool_snapshots(target_blocks[0], graph_url)
+    if save_boundaries and is_epoch_boundary(timestamp_now):
+        # The end of this epoch is the start of the next one
+        save_boundary(
+            chain.value,
+            timestamp_now,
+            target_blocks[0],
+            snapshots_now,
+            list(listed_core_pools),
         )
+    ledger = get_accrual_ledger(chain.value, timestamp_2_weeks_ago)
+    if is_tracked(ledger, list(pools.keys())):
+        # Fees until the last tracked day are stored, only snapshots now are needed
         logger.info(
-            f"Colllect fees for {chain.value} between blocks: "
-            f"{target_blocks[chain.value]}"
+            f"Collecting fees for {chain.value} from {len(ledger['days'])} tracked days "
+            f"and block {target_blocks[0]}"
         )
-        collected_fees[chain.value] = collect_fee_info(
-            core_pools[chain.value],
+        return collect_accrued_fee_info(
+            listed_core_pools,
             chain,
-            pool_snapshots[chain.value][0],
-            pool_snapshots[chain.value][1],
+            snapshots_now,
+            ledger,
             start_ts=timestamp_2_weeks_ago,
             end_ts=timestamp_now,
             bpt_twap_prices=bpt_twap_prices,
         )
+    # Also, collect all pool snapshots:
+    pool_snapshots = (
+        snapshots_now,
+        get_balancer_pool_snapshots(target_blocks[1], graph_url),  # 2 weeks ago
+    )
+    logger.info(f"Colllect fees for {chain.value} between blocks: {target_blocks}")
+    return collect_fee_info(
+        listed_core_pools,
+        chain,
+        pool_snapshots[0],
+        pool_snapshots[1],
+        start_ts=timestamp_2_weeks_ago,
+        end_ts=timestamp_now,
+        bpt_twap_prices=bpt_twap_prices,
+    )
 
-        # Now we have all the data we need to run the fee allocation process
-        logger.info(f"Running fee allocation for {chain.value}")
-        _incentives = calc_and_split_incentives(
-            collected_fees[chain.value],
+
+def run_accrual_tracker(
+    web3_instances: Munch[Web3], epoch_start_ts: int, timestamp: int
+) -> Dict[str, Decimal]:
+    """
+    Daily job storing fees accrued by core pools since the previous day on every chain.
+    Returns USD value of fees accrued so far in the epoch per chain
+    """
+    core_pools = fetch_core_pools()
+    accrued = {}
+    for chain in Chains:
+        listed_core_pools = core_pools.get(chain.value)
+        if listed_core_pools is None:
+            continue
+        pools = get_valid_core_pools(chain, listed_core_pools)
+        if not pools:
+            continue
+        ledger = track_chain_accrual(
+            chain,
+            web3_instances[chain.value],
+            list(pools.keys()),
+            epoch_start_ts,
+            timestamp,
+        )
+        accrued[chain.value] = sum(accrued_usd(ledger).values(), Decimal(0))
+        logger.info(
+            f"{chain.value}: {accrued[chain.value]:.2f} USD of fees accrued over "
+            f"{len(ledger['days']) - 1} tracked days"
+        )
+    return accrued
+
+
+def allocate_incentives(
+    chain: Chains,
+    chain_fees: Dict[str, Dict],
+    fees_to_distribute: Decimal,
+    fee_constants: Dict,
+    aura_vebal_share: Decimal,
+    existing_aura_bribs: List[Dict],
+    mapped_pools_info: Dict,
+    reroute_config: Dict,
+    overrides: Optional[Dict[str, Dict]] = None,
+    memoize: bool = False,
+) -> Dict[str, Dict]:
+    """
+    Split collected fees of a chain into incentives, then apply re-routing,
+    redistribution and dust filtering. With memoize every step is a stored stage,
+    so only steps after a changed input are recomputed
+    """
+    if overrides is None:
+        overrides = fetch_overrides()
+    min_aura_incentive = Decimal(fee_constants["min_aura_incentive"])
+    _incentives = run_stage(
+        "split",
+        {
+            "chain": chain.value,
+            "chain_fees": chain_fees,
+            "fees_to_distribute": fees_to_distribute,
+            "fee_constants": fee_constants,
+            "aura_vebal_share": aura_vebal_share,
+            "existing_aura_bribs": existing_aura_bribs,
+            "mapped_pools_info": mapped_pools_info,
+        },
+        lambda: calc_and_split_incentives(
+            chain_fees,
             chain.value,
-            Decimal(fees_to_distribute[chain.value]),
-            Decimal(fee_constants["min_aura_incentive"]),
+            Decimal(fees_to_distribute),
+            min_aura_incentive,
             Decimal(fee_constants["dao_share_pct"]),
             Decimal(fee_constants["vebal_share_pct"]),
             Decimal(fee_constants["min_existing_aura_incentive"]),
             Decimal(aura_vebal_share),
             existing_aura_bribs,
             mapped_pools_info,
-        )
-        re_routed_incentives = re_route_incentives(_incentives, chain, reroute_config)
-        redistributed_incentives = re_distribute_incentives(
+        ),
+        memoize,
+    )
+    re_routed_incentives = run_stage(
+        "reroute",
+        {
+            "chain": chain.value,
+            "incentives": _incentives,
+            "reroute_config": reroute_config,
+        },
+        lambda: re_route_incentives(_incentives, chain, reroute_config),
+        memoize,
+    )
+    redistributed_incentives = run_stage(
+        "redistribute",
+        {
+            "incentives": re_routed_incentives,
+            "fee_constants": fee_constants,
+            "overrides": overrides,
+        },
+        lambda: re_distribute_incentives(
             re_routed_incentives,
-            Decimal(fee_constants["min_aura_incentive"]),
+            min_aura_incentive,
             Decimal(fee_constants["min_vote_incentive_amount"]),
-        )
-        # Filter BAL incentives under 75 bucks to Aura
-        filtered_incentives = filter_dusty_bal_incentives(
+            overrides=overrides,
+        ),
+        memoize,
+    )
+    # Filter BAL incentives under 75 bucks to Aura
+    return run_stage(
+        "dust_filter",
+        {
+            "incentives": redistributed_incentives,
+            "min_incentive_amount": MIN_VERBAL_BRIBE_AFTER_ALL_REDISTRIBUTIONS,
+        },
+        lambda: filter_dusty_bal_incentives(
             redistributed_incentives, MIN_VERBAL_BRIBE_AFTER_ALL_REDISTRIBUTIONS
-        )
-        ## Add data about last join/exit
-        incentives[chain.value] = add_last_join_exit(filtered_incentives, chain)
-    # Wrap into dataframe and sort by earned fees and store to csv
-    joint_incentives_data = {
+        ),
+        memoize,
+    )
+
+
+def merge_incentives(incentives: Dict[str, Dict]) -> Dict[str, Dict]:
+    """
+    Merge incentives of all chains into one dict keyed by pool id
+    """
+    return {
         **incentives[Chains.MAINNET.value],
         **incentives[Chains.ARBITRUM.value],
         **incentives[Chains.POLYGON.value],
@@ -173,13 +402,279 @@ def run_fees(
         **incentives[Chains.GNOSIS.value],
         **incentives.get(Chains.ZKEVM.value, {}),
     }
+
+
+def incentives_to_df(joint_incentives_data: Dict[str, Dict]) -> pd.DataFrame:
+    """
+    Rows of the allocations csv, sorted by chain and earned fees
+    """
     joint_incentives_df = pd.DataFrame.from_dict(joint_incentives_data, orient="index")
+    return joint_incentives_df.sort_values(by=["chain", "earned_fees"], ascending=False)
 
-    incentives_df_sorted = joint_incentives_df.sort_values(
-        by=["chain", "earned_fees"], ascending=False
-    )
+
+def save_incentives(incentives: Dict[str, Dict], output_file_name: str) -> Dict:
+    """
+    Merge incentives of all chains, sort by earned fees and store to csv
+    """
+    joint_incentives_data = merge_incentives(incentives)
+    incentives_df_sorted = incentives_to_df(joint_incentives_data)
     allocations_file_name = os.path.join(
         PROJECT_ROOT, f"fee_allocator/allocations/{output_file_name}"
     )
     incentives_df_sorted.to_csv(allocations_file_name)
     return joint_incentives_data
+
+
+def save_epoch_inputs(
+    file_name: str,
+    collected_fees: Dict[str, Dict],
+    fees_to_distribute: Dict,
+    fee_constants: Dict,
+    aura_vebal_share: Decimal,
+    reroute_config: Dict,
+    overrides: Dict[str, Dict],
+) -> None:
+    """
+    Store everything the allocation stage depends on, so it can be replayed
+    by the scenario simulator without fetching anything
+    """
+    with open(file_name, "w") as f:
+        simplejson.dump(
+            {
+                "collected_fees": collected_fees,
+                "fees_to_distribute": fees_to_distribute,
+                "fee_constants": fee_constants,
+                "aura_vebal_share": aura_vebal_share,
+                "reroute_config": reroute_config,
+                "overrides": overrides,
+            },
+            f,
+            use_decimal=True,
+            indent=2,
+        )
+
+
+def save_run_manifest(
+    output_file_name: str, timestamp_now: int, timestamp_2_weeks_ago: int
+) -> str:
+    """
+    Store stages of the run next to the allocations: which outputs were reused,
+    which came from a fallback after a stage ran out of time, and how long each took
+    """
+    manifest_file_name = os.path.join(
+        PROJECT_ROOT,
+        "fee_allocator/allocations/manifests",
+        f"{os.path.splitext(output_file_name)[0]}.json",
+    )
+    os.makedirs(os.path.dirname(manifest_file_name), exist_ok=True)
+    runs = stage_runs()
+    with open(manifest_file_name, "w") as f:
+        json.dump(
+            {
+                "timestamp_now": timestamp_now,
+                "timestamp_2_weeks_ago": timestamp_2_weeks_ago,
+                "fallbacks": [
+                    f"{run['stage']}:{run['chain']}" if run["chain"] else run["stage"]
+                    for run in runs
+                    if run["fallback"]
+                ],
+                "stages": runs,
+            },
+            f,
+            indent=2,
+        )
+    return manifest_file_name
+
+
+def run_fees(
+    web3_instances: Munch[Web3],
+    timestamp_now: int,
+    timestamp_2_weeks_ago: int,
+    output_file_name: str,
+    fees_to_distribute: dict,
+    mapped_pools_info: Optional[dict] = None,
+    epoch_inputs_file: Optional[str] = None,
+    bpt_price_samples: int = BPT_PRICE_SAMPLES,
+    recompute: bool = False,
+    fee_source: str = FEE_SOURCE,
+) -> dict:
+    """
+    This function is used to run the fee allocation process.
+    Pools are mapped to gauges of the gauge registry unless mapped_pools_info is passed.
+    If epoch_inputs_file is passed, allocation inputs are stored there for the simulator.
+    Stage outputs stored by previous runs with the same inputs are reused unless recompute is set
+    """
+    reset_single_flight()
+    reset_stages()
+    memoize = not recompute
+    if mapped_pools_info is None:
+        # Refreshed as a stage of the run, so a fallback to the stored registry is in its manifest
+        mapped_pools_info = fetch_mapped_pools_info()
+    # Live configs are never memoized, the run fails when they can't be fetched in time
+    core_pools, fee_constants, reroute_config = run_stage(
+        "configs", {}, fetch_pipeline_configs, False
+    )
+    overrides = run_stage("overrides", {}, fetch_overrides, False)
+    collected_fees = {}
+    incentives = {}
+    # Inputs of the fee collection stage of every chain with fees and valid core pools
+    collection_inputs = {}
+    for chain in Chains:
+        listed_core_pools = core_pools.get(chain.value, None)
+        if listed_core_pools is None or chain.value not in fees_to_distribute:
+            continue
+        pools = run_stage(
+            "valid_core_pools",
+            {"chain": chain.value},
+            lambda: get_valid_core_pools(chain, listed_core_pools),
+            False,
+        )
+        if not pools:
+            logger.warning(
+                f"{chain.value} has {fees_to_distribute[chain.value]} in fees but no core pools defined. setting fees to 0."
+            )
+            fees_to_distribute[chain.value] = 0
+            continue
+        collection_inputs[chain] = {
+            "chain": chain.value,
+            "pools": pools,
+            "listed_core_pools": listed_core_pools,
+            "timestamp_now": timestamp_now,
+            "timestamp_2_weeks_ago": timestamp_2_weeks_ago,
+            "bpt_price_samples": bpt_price_samples,
+            "fee_source": fee_source,
+        }
+        # Start block and snapshots stored by the run of the previous epoch
+        seed_start_boundary(chain.value, timestamp_2_weeks_ago, list(listed_core_pools))
+    # Every chain starts once its subgraphs indexed past timestamp_now, mainnet is needed for the aura share
+    freshness_gate = FreshnessGate(
+        list(
+            dict.fromkeys(
+                [Chains.MAINNET.value, *(chain.value for chain in collection_inputs)]
+            )
+        ),
+        timestamp_now,
+        check_balancer_subgraph=fee_source == "subgraph",
+    )
+    # Fees rebuilt from events don't need snapshots prefetched
+    if fee_source == "subgraph" and (
+        not memoize
+        or not all(
+            is_stage_cached("collected_fees", inputs)
+            for inputs in collection_inputs.values()
+        )
+    ):
+        # Resolve blocks, pool reads, snapshots, token metadata and prices of all chains up front,
+        # collection below reads them from cache
+        fetch_plan = build_fetch_plan(
+            {
+                chain.value: inputs["pools"]
+                for chain, inputs in collection_inputs.items()
+            },
+            fees_to_distribute,
+            timestamp_now,
+            timestamp_2_weeks_ago,
+            bpt_price_samples,
+        )
+        logger.info(format_fetch_plan(fetch_plan))
+        # Prefetching only warms caches, when it runs out of time collection fetches the rest
+        run_stage(
+            "fetch_plan",
+            {},
+            lambda: execute_fetch_plan(
+                fetch_plan, web3_instances, freshness_gate.ready_chains()
+            ),
+            False,
+            fallback=dict,
+        )
+
+    # Estimate mainnet current block to calculate aura veBAL share
+    freshness_gate.wait(Chains.MAINNET.value)
+    _target_mainnet_block = get_block_by_ts(timestamp_now, Chains.MAINNET.value)
+    aura_vebal_share = run_stage(
+        "aura_vebal_share",
+        {"block": _target_mainnet_block},
+        lambda: calculate_aura_vebal_share(
+            web3_instances["mainnet"], _target_mainnet_block
+        ),
+        memoize,
+    )
+    logger.info(
+        f"veBAL aura share at block {_target_mainnet_block}: {aura_vebal_share}"
+    )
+    existing_aura_bribs: List[Dict] = run_stage(
+        "aura_bribs", {}, fetch_hh_aura_bribs, False
+    )
+    for chain_name in freshness_gate.ready_chains():
+        chain = Chains(chain_name)
+        if chain not in collection_inputs:
+            continue
+        inputs = collection_inputs[chain]
+        deadline = Deadline(CHAIN_BUDGET)
+        print(f"Collecting BPT prices for Chain {chain.value}")
+        collected_fees[chain.value] = run_stage(
+            "collected_fees",
+            inputs,
+            lambda: collect_chain_fees(
+                chain,
+                getattr(web3_instances, chain.value),
+                inputs["pools"],
+                inputs["listed_core_pools"],
+                timestamp_now,
+                timestamp_2_weeks_ago,
+                bpt_price_samples,
+                fee_source,
+            ),
+            memoize,
+            deadline,
+        )
+
+        # Now we have all the data we need to run the fee allocation process
+        logger.info(f"Running fee allocation for {chain.value}")
+        filtered_incentives = allocate_incentives(
+            chain,
+            collected_fees[chain.value],
+            fees_to_distribute[chain.value],
+            fee_constants,
+            aura_vebal_share,
+            existing_aura_bribs,
+            mapped_pools_info,
+            reroute_config,
+            overrides,
+            memoize,
+        )
+        ## Add data about last join/exit
+        incentives[chain.value] = run_stage(
+            "join_exit",
+            {
+                "chain": chain.value,
+                "incentives": filtered_incentives,
+                "timestamp_now": timestamp_now,
+            },
+            lambda: add_last_join_exit(filtered_incentives, chain),
+            memoize,
+            deadline,
+            # Last join/exit is only reported, so it's left out when out of time
+            fallback=lambda: {
+                pool_id: {**data, "last_join_exit": "Out of time"}
+                for pool_id, data in filtered_incentives.items()
+            },
+        )
+    if epoch_inputs_file:
+        save_epoch_inputs(
+            epoch_inputs_file,
+            collected_fees,
+            fees_to_distribute,
+            fee_constants,
+            aura_vebal_share,
+            reroute_config,
+            overrides,
+        )
+    # Previews don't store a manifest, only runs ending at an epoch boundary do
+    if is_epoch_boundary(timestamp_now):
+        manifest_file_name = save_run_manifest(
+            output_file_name, timestamp_now, timestamp_2_weeks_ago
+        )
+        logger.info(f"Run manifest stored to {manifest_file_name}")
+    # Wrap into dataframe and sort by earned fees and store to csv
+    return save_incentives(incentives, output_file_name)
@@ -0,0 +1,250 @@
+import asyncio
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import aiohttp
+from munch import Munch
+from web3 import Web3
+
+from fee_allocator.accounting.collectors import collect_fee_info
+from fee_allocator.accounting.distribution import add_last_join_exit
+from fee_allocator.accounting.fee_pipeline import allocate_incentives
+from fee_allocator.accounting.fee_pipeline import get_valid_core_pools
+from fee_allocator.accounting.fee_pipeline import save_epoch_inputs
+from fee_allocator.accounting.fee_pipeline import save_incentives
+from fee_allocator.accounting.freshness_async import AsyncFreshnessGate
+from fee_allocator.accounting.logger import logger
+from fee_allocator.accounting.settings import CORE_POOLS_URL
+from fee_allocator.accounting.settings import Chains
+from fee_allocator.accounting.settings import FEE_CONSTANTS_URL
+from fee_allocator.accounting.settings import OVERRIDES_URL
+from fee_allocator.accounting.settings import REROUTE_CONFIG_URL
+from fee_allocator.helpers import get_subgraph_url
+from fee_allocator.helpers_async import TokenPriceFetcher
+from fee_allocator.helpers_async import calculate_aura_vebal_share_async
+from fee_allocator.helpers_async import fetch_hh_aura_bribs_async
+from fee_allocator.helpers_async import fetch_json_async
+from fee_allocator.helpers_async import get_alive_gauge_pools_async
+from fee_allocator.helpers_async import get_async_web3
+from fee_allocator.helpers_async import get_balancer_pool_snapshots_async
+from fee_allocator.helpers_async import get_block_by_ts_async
+from fee_allocator.helpers_async import get_last_join_exit_async
+from fee_allocator.helpers_async import get_twap_bpt_price_async
+
+
+async def fetch_pipeline_configs_async(
+    session: aiohttp.ClientSession,
+) -> Tuple[Dict, Dict, Dict, Dict]:
+    """
+    Fetch core pools, fee constants, re-route config and overrides concurrently
+    """
+    return tuple(
+        await asyncio.gather(
+            *[
+                fetch_json_async(session, url)
+                for url in (
+                    CORE_POOLS_URL,
+                    FEE_CONSTANTS_URL,
+                    REROUTE_CONFIG_URL,
+                    OVERRIDES_URL,
+                )
+            ]
+        )
+    )
+
+
+async def collect_chain_fees_async(
+    chain: Chains,
+    web3: Web3,
+    listed_core_pools: Dict[str, str],
+    timestamp_now: int,
+    timestamp_2_weeks_ago: int,
+    freshness_gate: AsyncFreshnessGate,
+) -> Optional[Dict[str, Dict]]:
+    """
+    Fetch blocks, BPT prices and pool snapshots of a chain concurrently and collect fees,
+    once its subgraphs indexed past timestamp_now. Returns None if the chain has no valid core pools
+    """
+    gauge_pools = await get_alive_gauge_pools_async(
+        chain.value, list(listed_core_pools)
+    )
+    pools = get_valid_core_pools(chain, listed_core_pools, gauge_pools)
+    if not pools:
+        return None
+    await freshness_gate.wait(chain.value)
+    async_web3 = get_async_web3(web3)
+    token_prices = TokenPriceFetcher(timestamp_2_weeks_ago, timestamp_now)
+    block_now, block_2_weeks_ago = await asyncio.gather(
+        get_block_by_ts_async(timestamp_now, chain.value),
+        get_block_by_ts_async(timestamp_2_weeks_ago, chain.value),
+    )
+    logger.info(
+        f"Running fees collection for {chain.value} between blocks: "
+        f"{(block_now, block_2_weeks_ago)}"
+    )
+    graph_url = get_subgraph_url(chain.value)
+    bpt_prices, snapshots_now, snapshots_2_weeks_ago = await asyncio.gather(
+        asyncio.gather(
+            *[
+                get_twap_bpt_price_async(
+                    core_pool, chain.value, async_web3, token_prices, block_now
+                )
+                for core_pool in pools.keys()
+            ]
+        ),
+        get_balancer_pool_snapshots_async(block_now, graph_url),
+        get_balancer_pool_snapshots_async(block_2_weeks_ago, graph_url),
+    )
+    bpt_twap_prices = {chain.value: dict(zip(pools.keys(), bpt_prices))}
+    for core_pool, _bpt_price in bpt_twap_prices[chain.value].items():
+        logger.info(
+            f"Collected bpt price for {pools[core_pool]} pool on {chain.value}: {_bpt_price}"
+        )
+    # Prefetch prices of tokens that pools without BPT fees paid their fees in
+    fee_tokens = {
+        token_addr
+        for pool_id, snapshot in snapshots_now.items()
+        if pool_id in listed_core_pools
+        and snapshot.total_protocol_fee_paid_in_bpt is None
+        for token_addr, _ in snapshot.tokens
+    }
+    fee_token_prices = dict(
+        zip(
+            fee_tokens,
+            await asyncio.gather(
+                *[token_prices.get(token, chain.value) for token in fee_tokens]
+            ),
+        )
+    )
+    return collect_fee_info(
+        listed_core_pools,
+        chain,
+        snapshots_now,
+        snapshots_2_weeks_ago,
+        start_ts=timestamp_2_weeks_ago,
+        end_ts=timestamp_now,
+        bpt_twap_prices=bpt_twap_prices,
+        token_prices=fee_token_prices,
+        gauge_pools=gauge_pools,
+    )
+
+
+async def run_fees_async(
+    web3_instances: Munch[Web3],
+    timestamp_now: int,
+    timestamp_2_weeks_ago: int,
+    output_file_name: str,
+    fees_to_distribute: dict,
+    mapped_pools_info: dict,
+    epoch_inputs_file: Optional[str] = None,
+) -> dict:
+    """
+    Async variant of run_fees. All chains, pools and tokens are fetched concurrently
+    on one event loop, allocation logic and output are shared with the sync path
+    """
+    async with aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=60)
+    ) as session:
+        (
+            (core_pools, fee_constants, reroute_config, overrides),
+            existing_aura_bribs,
+        ) = await asyncio.gather(
+            fetch_pipeline_configs_async(session),
+            fetch_hh_aura_bribs_async(session),
+        )
+    chains: List[Chains] = [
+        chain
+        for chain in Chains
+        if core_pools.get(chain.value) is not None and chain.value in fees_to_distribute
+    ]
+    # Same gate as the sync path, every chain starts once its subgraphs indexed past timestamp_now
+    freshness_gate = AsyncFreshnessGate(
+        list(dict.fromkeys([Chains.MAINNET.value, *(chain.value for chain in chains)])),
+        timestamp_now,
+    )
+    await freshness_gate.wait(Chains.MAINNET.value)
+    _target_mainnet_block = await get_block_by_ts_async(
+        timestamp_now, Chains.MAINNET.value
+    )
+    aura_vebal_share = await calculate_aura_vebal_share_async(
+        get_async_web3(web3_instances["mainnet"]), _target_mainnet_block
+    )
+    logger.info(
+        f"veBAL aura share at block {_target_mainnet_block}: {aura_vebal_share}"
+    )
+    collected_fees = await asyncio.gather(
+        *[
+            collect_chain_fees_async(
+                chain,
+                web3_instances[chain.value],
+                core_pools[chain.value],
+                timestamp_now,
+                timestamp_2_weeks_ago,
+                freshness_gate,
+            )
+            for chain in chains
+        ]
+    )
+    filtered_incentives = {}
+    chain_collected_fees = {}
+    for chain, chain_fees in zip(chains, collected_fees):
+        if chain_fees is None:
+            logger.warning(
+                f"{chain.value} has {fees_to_distribute[chain.value]} in fees but no core pools defined. setting fees to 0."
+            )
+            fees_to_distribute[chain.value] = 0
+            continue
+        chain_collected_fees[chain.value] = chain_fees
+        logger.info(f"Running fee allocation for {chain.value}")
+        filtered_incentives[chain] = allocate_incentives(
+            chain,
+            chain_fees,
+            fees_to_distribute[chain.value],
+            fee_constants,
+            aura_vebal_share,
+            existing_aura_bribs,
+            mapped_pools_info,
+            reroute_config,
+            overrides,
+        )
+    ## Add data about last join/exit
+    pool_keys = [
+        (chain, pool_id)
+        for chain, chain_incentives in filtered_incentives.items()
+        for pool_id in chain_incentives
+    ]
+    last_join_exits = dict(
+        zip(
+            pool_keys,
+            await asyncio.gather(
+                *[
+                    get_last_join_exit_async(chain.value, pool_id)
+                    for chain, pool_id in pool_keys
+                ]
+            ),
+        )
+    )
+    incentives = {
+        chain.value: add_last_join_exit(
+            chain_incentives,
+            chain,
+            last_join_exits={
+                pool_id: last_join_exits[(chain, pool_id)]
+                for pool_id in chain_incentives
+            },
+        )
+        for chain, chain_incentives in filtered_incentives.items()
+    }
+    if epoch_inputs_file:
+        save_epoch_inputs(
+            epoch_inputs_file,
+            chain_collected_fees,
+            fees_to_distribute,
+            fee_constants,
+            aura_vebal_share,
+            reroute_config,
+            overrides,
+        )
+    return save_incentives(incentives, output_file_name)
@@ -0,0 +1,330 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import pandas as pd
+from munch import Munch
+from web3 import Web3
+
+from fee_allocator.accounting.logger import logger
+from fee_allocator.accounting.settings import BPT_PRICE_SAMPLES
+from fee_allocator.accounting.settings import Chains
+from fee_allocator.accounting.settings import PLAN_AVG_POOL_TOKENS
+from fee_allocator.accounting.settings import PLAN_MAX_WORKERS
+from fee_allocator.accounting.settings import PLAN_REQUEST_LATENCY
+from fee_allocator.accounting.stages import run_stage
+from fee_allocator.cache import disk_cache_get
+from fee_allocator.helpers import bpt_price_sample_timestamps
+from fee_allocator.helpers import clamp_block_timestamp
+from fee_allocator.helpers import get_balancer_pool_snapshots
+from fee_allocator.helpers import get_block_by_ts
+from fee_allocator.helpers import get_pools_state
+from fee_allocator.helpers import get_pools_tokens
+from fee_allocator.helpers import get_subgraph_url
+from fee_allocator.helpers import get_token_price_history
+from fee_allocator.helpers import get_tokens_metadata
+from fee_allocator.helpers import load_tokens_metadata
+from fee_allocator.rpc import get_batch_size
+
+# get_balancer_pool_snapshots fetches up to 5 pages per block
+SNAPSHOT_PAGES = 5
+# Core pools, fee constants, re-route config, overrides, hidden hand bribes and pools info
+CONFIG_REQUESTS = 6
+
+
+@dataclass
+class FetchStage:
+    name: str
+    kind: str
+    # Deduplicated items the stage needs (blocks, eth_calls, tokens, pages) and how many are cached
+    items: int
+    cached: int
+    requests: int
+    # Stages without dependencies inside the stage are prefetched on PLAN_MAX_WORKERS threads
+    parallel: bool = False
+
+    def estimated_seconds(self) -> float:
+        seconds = self.requests * PLAN_REQUEST_LATENCY[self.kind]
+        return seconds / PLAN_MAX_WORKERS if self.parallel else seconds
+
+
+@dataclass
+class FetchPlan:
+    timestamp_now: int
+    timestamp_2_weeks_ago: int
+    bpt_price_samples: int = BPT_PRICE_SAMPLES
+    # Core pools per chain, blocks to resolve and pool tokens known from the local cache.
+    # Tokens of the other pools are resolved when the plan is executed
+    pools: Dict[str, List[str]] = field(default_factory=dict)
+    blocks: List[Tuple[str, int]] = field(default_factory=list)
+    tokens: Dict[str, List[str]] = field(default_factory=dict)
+    stages: List[FetchStage] = field(default_factory=list)
+
+    def estimated_seconds(self) -> float:
+        return sum(stage.estimated_seconds() for stage in self.stages)
+
+    def to_df(self) -> pd.DataFrame:
+        df = pd.DataFrame([stage.__dict__ for stage in self.stages])
+        df["estimated_seconds"] = [
+            round(stage.estimated_seconds(), 1) for stage in self.stages
+        ]
+        return df.set_index("name")
+
+
+def _batches(calls: int) -> int:
+    return math.ceil(calls / get_batch_size())
+
+
+def build_fetch_plan(
+    core_pools: Dict[str, Dict[str, str]],
+    fees_to_distribute: Dict,
+    timestamp_now: int,
+    timestamp_2_weeks_ago: int,
+    bpt_price_samples: int = BPT_PRICE_SAMPLES,
+) -> FetchPlan:
+    """
+    Build the set of requests a run needs for the epoch from the core pools list and the
+    local cache, without fetching anything. Blocks, tokens and prices are deduplicated across
+    pools and chains. Gauge checks may drop pools at run time, so counts are upper bounds
+    """
+    plan = FetchPlan(timestamp_now, timestamp_2_weeks_ago, bpt_price_samples)
+    for chain in Chains:
+        listed_core_pools = core_pools.get(chain.value)
+        if listed_core_pools and chain.value in fees_to_distribute:
+            plan.pools[chain.value] = list(listed_core_pools.keys())
+    block_timestamps = {(Chains.MAINNET.value, timestamp_now)}
+    sample_timestamps = []
+    if bpt_price_samples > 1:
+        sample_timestamps = bpt_price_sample_timestamps(
+            timestamp_2_weeks_ago, timestamp_now, bpt_price_samples
+        )
+    for chain in plan.pools:
+        block_timestamps |= {(chain, timestamp_now), (chain, timestamp_2_weeks_ago)}
+        block_timestamps |= {(chain, ts) for ts in sample_timestamps}
+    plan.blocks = sorted(
+        (chain, clamp_block_timestamp(ts)) for chain, ts in block_timestamps
+    )
+    cached_blocks = {
+        (chain, ts): disk_cache_get("blocks", f"{chain}:{ts}")
+        for chain, ts in plan.blocks
+    }
+
+    pools_count = sum(len(pools) for pools in plan.pools.values())
+    pool_read_batches = 0
+    metadata_calls = metadata_cached = metadata_batches = 0
+    price_items = price_cached = 0
+    snapshot_items = snapshot_cached = 0
+    pool_reads = 0
+    for chain, pool_ids in plan.pools.items():
+        if bpt_price_samples > 1:
+            # getPool, then decimals and getPoolTokens and totalSupply at every sample
+            pool_reads += len(pool_ids) * (2 + 2 * bpt_price_samples)
+            pool_read_batches += _batches(len(pool_ids))
+            pool_read_batches += _batches(len(pool_ids) * (1 + 2 * bpt_price_samples))
+        else:
+            # getPool and getPoolTokens, then decimals and totalSupply of every pool
+            pool_reads += 4 * len(pool_ids)
+            pool_read_batches += 2 * _batches(2 * len(pool_ids))
+        unknown_pools = 0
+        tokens = {}
+        for pool_id in pool_ids:
+            pool_tokens = disk_cache_get("pool_tokens", f"{chain}:{pool_id}")
+            if pool_tokens is None:
+                unknown_pools += 1
+            else:
+                tokens.update(dict.fromkeys(pool_tokens))
+        plan.tokens[chain] = list(tokens)
+        chain_tokens = len(tokens) + unknown_pools * PLAN_AVG_POOL_TOKENS
+        chain_metadata_cached = sum(
+            disk_cache_get("tokens", f"{chain}:{token}") is not None for token in tokens
+        )
+        metadata_calls += 3 * chain_tokens
+        metadata_cached += 3 * chain_metadata_cached
+        metadata_batches += _batches(3 * (chain_tokens - chain_metadata_cached))
+        price_items += chain_tokens
+        for token in tokens:
+            cached_prices = disk_cache_get("prices", f"{chain}:{token.lower()}")
+            if cached_prices is not None and cached_prices["fetched_at"] >= (
+                timestamp_now
+            ):
+                price_cached += 1
+        for ts in (timestamp_now, timestamp_2_weeks_ago):
+            snapshot_items += SNAPSHOT_PAGES
+            block = cached_blocks[(chain, clamp_block_timestamp(ts))]
+            if block is not None and _snapshots_cached(chain, block):
+                snapshot_cached += SNAPSHOT_PAGES
+
+    blocks_cached = sum(block is not None for block in cached_blocks.values())
+    plan.stages = [
+        FetchStage("configs", "config", CONFIG_REQUESTS, 0, CONFIG_REQUESTS),
+        FetchStage(
+            "blocks",
+            "subgraph",
+            len(plan.blocks),
+            blocks_cached,
+            len(plan.blocks) - blocks_cached,
+            parallel=True,
+        ),
+        FetchStage("gauge checks", "gauge", pools_count, 0, pools_count),
+        FetchStage("aura veBAL share", "rpc_batch", 2, 0, 1),
+        FetchStage("pool reads", "rpc_batch", pool_reads, 0, pool_read_batches),
+        FetchStage(
+            "token metadata",
+            "rpc_batch",
+            metadata_calls,
+            metadata_cached,
+            metadata_batches,
+        ),
+        FetchStage(
+            "token prices",
+            "price",
+            price_items,
+            price_cached,
+            price_items - price_cached,
+            parallel=True,
+        ),
+        FetchStage(
+            "pool snapshots",
+            "subgraph",
+            snapshot_items,
+            snapshot_cached,
+            snapshot_items - snapshot_cached,
+            parallel=True,
+        ),
+        FetchStage("last join/exit", "gauge", pools_count, 0, pools_count),
+    ]
+    return plan
+
+
+def _snapshots_cached(chain: str, block: int) -> bool:
+    graph_url = get_subgraph_url(chain)
+    return disk_cache_get("pool_snapshots", f"{graph_url}:{block}") is not None
+
+
+def format_fetch_plan(plan: FetchPlan) -> str:
+    return (
+        f"Fetch plan for timestamps {plan.timestamp_2_weeks_ago} to {plan.timestamp_now}, "
+        f"{sum(len(pools) for pools in plan.pools.values())} core pools on "
+        f"{len(plan.pools)} chains\n"
+        f"{plan.to_df().to_string()}\n"
+        f"Requests: {sum(stage.requests for stage in plan.stages)}, "
+        f"estimated runtime: {plan.estimated_seconds():.0f}s"
+    )
+
+
+def resolve_plan_tokens(plan: FetchPlan, web3_instances: Munch[Web3]) -> None:
+    """
+    Add tokens of pools missing from the local cache to the plan, read in one batch per chain
+    """
+    for chain, pool_ids in plan.pools.items():
+        unknown_pools = [
+            pool_id
+            for pool_id in pool_ids
+            if disk_cache_get("pool_tokens", f"{chain}:{pool_id}") is None
+        ]
+        if unknown_pools:
+            tokens = get_pools_tokens(web3_instances[chain], chain, unknown_pools)
+            plan.tokens[chain] = list(dict.fromkeys(plan.tokens[chain] + tokens))
+
+
+def _prefetch_tokens_metadata(
+    web3_instances: Munch[Web3], chain: str, tokens: List[str]
+) -> Dict[str, Tuple[int, str, str]]:
+    """
+    Token metadata never changes, when it can't be fetched in time the metadata stored
+    by earlier runs is used and collection fetches metadata of the other tokens
+    """
+    return run_stage(
+        "token_metadata",
+        {"chain": chain},
+        lambda: dict(
+            zip(tokens, get_tokens_metadata(web3_instances[chain], chain, tokens))
+        ),
+        False,
+        fallback=lambda: load_tokens_metadata(chain, tokens),
+    )
+
+
+def _prefetch_pool_reads(
+    plan: FetchPlan, web3_instances: Munch[Web3], chain: str
+) -> None:
+    """
+    Read pools at the blocks BPT prices are computed at, once those blocks are resolved
+    """
+    timestamps = [plan.timestamp_now]
+    if plan.bpt_price_samples > 1:
+        timestamps = bpt_price_sample_timestamps(
+            plan.timestamp_2_weeks_ago, plan.timestamp_now, plan.bpt_price_samples
+        )
+    get_pools_state(
+        web3_instances[chain],
+        chain,
+        plan.pools[chain],
+        [get_block_by_ts(ts, chain) for ts in timestamps],
+    )
+
+
+def execute_fetch_plan(
+    plan: FetchPlan,
+    web3_instances: Munch[Web3],
+    chains: Optional[Iterable[str]] = None,
+) -> Dict[Tuple[str, int], int]:
+    """
+    Run the plan as one fetch phase, so collection of every chain runs against warm caches:
+    tokens of unknown pools, then token metadata and prices, blocks, pool reads and snapshots
+    on PLAN_MAX_WORKERS threads. Returns resolved blocks.
+    Blocks, pool reads and snapshots of a chain are fetched once chains yields it,
+    by default right away
+    """
+    resolve_plan_tokens(plan, web3_instances)
+    if chains is None:
+        chains = dict.fromkeys(chain for chain, _ in plan.blocks)
+    with ThreadPoolExecutor(max_workers=PLAN_MAX_WORKERS) as executor:
+        futures = [
+            executor.submit(get_token_price_history, token, chain, plan.timestamp_now)
+            for chain, tokens in plan.tokens.items()
+            for token in tokens
+        ]
+        futures += [
+            executor.submit(_prefetch_tokens_metadata, web3_instances, chain, tokens)
+            for chain, tokens in plan.tokens.items()
+            if tokens
+        ]
+        block_futures = {}
+        for chain in chains:
+            for block in plan.blocks:
+                if block[0] == chain:
+                    block_futures[block] = executor.submit(
+                        get_block_by_ts, block[1], chain
+                    )
+            if chain not in plan.pools:
+                continue
+            futures.append(
+                executor.submit(_prefetch_pool_reads, plan, web3_instances, chain)
+            )
+            futures += [
+                executor.submit(
+                    lambda chain, ts: get_balancer_pool_snapshots(
+                        get_block_by_ts(ts, chain), get_subgraph_url(chain)
+                    ),
+                    chain,
+                    ts,
+                )
+                for ts in (plan.timestamp_now, plan.timestamp_2_weeks_ago)
+            ]
+        for future in futures:
+            # Pool reads and snapshots are read back from the local cache, don't keep them here
+            future.result()
+        blocks = {block: future.result() for block, future in block_futures.items()}
+    logger.info(
+        f"Prefetched {len(blocks)} blocks, {2 * len(plan.pools)} snapshot sets, "
+        f"pool reads of {sum(len(pools) for pools in plan.pools.values())} pools "
+        f"and {sum(len(tokens) for tokens in plan.tokens.values())} tokens"
+    )
+    return blocks
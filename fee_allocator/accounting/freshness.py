@@ -0,0 +1,149 @@
+"""
+Subgraph freshness gate.
+
+Work on a chain needs its blocks subgraph indexed past the blocks looked up around the end of
+the period, and its Balancer subgraph indexed past the block at the end of the period. Subgraphs of all chains are polled
+concurrently, so every chain starts as soon as its own subgraphs caught up.
+"""
+
+import threading
+import time
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+from fee_allocator.accounting.logger import logger
+from fee_allocator.accounting.settings import SUBGRAPH_MAX_WAIT
+from fee_allocator.accounting.settings import SUBGRAPH_POLL_INTERVAL
+from fee_allocator.helpers import BLOCK_SEARCH_WINDOW
+from fee_allocator.helpers import clamp_block_timestamp
+from fee_allocator.helpers import get_block_by_ts
+from fee_allocator.helpers import get_blocks_subgraph_url
+from fee_allocator.helpers import get_indexed_block_timestamp
+from fee_allocator.helpers import get_subgraph_meta
+from fee_allocator.helpers import get_subgraph_url
+
+
+class SubgraphNotIndexed(Exception):
+    pass
+
+
+class FreshnessGate:
+    """
+    Polls subgraphs of every chain in a background thread until they indexed past timestamp.
+    Timestamps in the future are clamped like in get_block_by_ts, so the gate waits for the
+    blocks the run looks up. Without check_balancer_subgraph only blocks subgraphs are polled
+    """
+
+    def __init__(
+        self,
+        chains: List[str],
+        timestamp: int,
+        poll_interval: float = SUBGRAPH_POLL_INTERVAL,
+        max_wait: float = SUBGRAPH_MAX_WAIT,
+        check_balancer_subgraph: bool = True,
+    ):
+        self.timestamp = clamp_block_timestamp(timestamp)
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait
+        self.check_balancer_subgraph = check_balancer_subgraph
+        self.waited: Dict[str, float] = {}
+        self._ready = {chain: threading.Event() for chain in chains}
+        self._errors: Dict[str, str] = {}
+        # Chains in the order they caught up
+        self._order: List[str] = []
+        self._order_changed = threading.Condition()
+        for chain in chains:
+            threading.Thread(target=self._poll, args=(chain,), daemon=True).start()
+
+    def wait(self, chain: str) -> None:
+        """
+        Blocks until subgraphs of the chain indexed past timestamp
+        """
+        self._ready[chain].wait()
+        if chain in self._errors:
+            raise SubgraphNotIndexed(self._errors[chain])
+
+    def ready_chains(self) -> Iterator[str]:
+        """
+        Yields chains in the order their subgraphs caught up
+        """
+        for index in range(len(self._ready)):
+            with self._order_changed:
+                self._order_changed.wait_for(lambda: len(self._order) > index)
+                chain = self._order[index]
+            self.wait(chain)
+            yield chain
+
+    def _poll(self, chain: str) -> None:
+        start = time.monotonic()
+        # Blocks subgraph must have the blocks around timestamp, Balancer subgraph the block at
+        # timestamp. That block is looked up in the blocks subgraph once it caught up
+        blocks_url = get_blocks_subgraph_url(chain)
+        balancer_url = get_subgraph_url(chain) if self.check_balancer_subgraph else None
+        pending = [url for url in (blocks_url, balancer_url) if url is not None]
+        target_block = None
+        while pending:
+            if blocks_url in pending:
+                indexed = self._indexed_timestamp(chain, blocks_url)
+                if (
+                    indexed is not None
+                    and indexed >= self.timestamp + BLOCK_SEARCH_WINDOW
+                ):
+                    pending.remove(blocks_url)
+            if balancer_url in pending and blocks_url not in pending:
+                if target_block is None:
+                    target_block = self._target_block(chain)
+                indexed = self._indexed_block(chain, balancer_url)
+                if None not in (indexed, target_block) and indexed >= target_block:
+                    pending.remove(balancer_url)
+            if not pending:
+                break
+            if time.monotonic() - start + self.poll_interval > self.max_wait:
+                self._errors[chain] = (
+                    f"{chain} subgraphs didn't index past {self.timestamp} "
+                    f"within {self.max_wait:.0f}s: {', '.join(pending)}"
+                )
+                break
+            logger.info(f"Waiting for {chain} subgraphs to index past {self.timestamp}")
+            time.sleep(self.poll_interval)
+        self.waited[chain] = time.monotonic() - start
+        self._ready[chain].set()
+        with self._order_changed:
+            self._order.append(chain)
+            self._order_changed.notify_all()
+
+    def _target_block(self, chain: str) -> Optional[int]:
+        try:
+            return get_block_by_ts(self.timestamp, chain)
+        except Exception as e:
+            logger.warning(f"Couldn't look up {chain} block at {self.timestamp}: {e}")
+            return None
+
+    @staticmethod
+    def _indexed_timestamp(chain: str, graph_url: str) -> Optional[int]:
+        """
+        Timestamp of the last block indexed by a blocks subgraph, None when it couldn't be queried.
+        Graph nodes that don't report it in _meta are asked for the timestamp of that block
+        """
+        try:
+            number, timestamp = get_subgraph_meta(graph_url)
+            if timestamp is None:
+                timestamp = get_indexed_block_timestamp(graph_url, number)
+        except Exception as e:
+            logger.warning(f"Couldn't get indexing status of {chain} subgraph: {e}")
+            return None
+        return timestamp
+
+    @staticmethod
+    def _indexed_block(chain: str, graph_url: str) -> Optional[int]:
+        """
+        Number of the last block indexed by a subgraph, None when it couldn't be queried
+        """
+        try:
+            number, _ = get_subgraph_meta(graph_url)
+        except Exception as e:
+            logger.warning(f"Couldn't get indexing status of {chain} subgraph: {e}")
+            return None
+        return number
@@ -0,0 +1,116 @@
+"""
+Subgraph freshness gate of the async pipeline.
+
+Same checks as FreshnessGate, but subgraphs are polled in tasks on the running event loop
+instead of background threads.
+"""
+
+import asyncio
+import time
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from fee_allocator.accounting.freshness import SubgraphNotIndexed
+from fee_allocator.accounting.logger import logger
+from fee_allocator.accounting.settings import SUBGRAPH_MAX_WAIT
+from fee_allocator.accounting.settings import SUBGRAPH_POLL_INTERVAL
+from fee_allocator.helpers import BLOCK_SEARCH_WINDOW
+from fee_allocator.helpers import clamp_block_timestamp
+from fee_allocator.helpers import get_blocks_subgraph_url
+from fee_allocator.helpers import get_subgraph_url
+from fee_allocator.helpers_async import get_block_by_ts_async
+from fee_allocator.helpers_async import get_indexed_block_timestamp_async
+from fee_allocator.helpers_async import get_subgraph_meta_async
+
+
+class AsyncFreshnessGate:
+    """
+    Polls subgraphs of every chain in a task until they indexed past timestamp.
+    Must be created on the event loop it is awaited on
+    """
+
+    def __init__(
+        self,
+        chains: List[str],
+        timestamp: int,
+        poll_interval: float = SUBGRAPH_POLL_INTERVAL,
+        max_wait: float = SUBGRAPH_MAX_WAIT,
+        check_balancer_subgraph: bool = True,
+    ):
+        self.timestamp = clamp_block_timestamp(timestamp)
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait
+        self.check_balancer_subgraph = check_balancer_subgraph
+        self.waited: Dict[str, float] = {}
+        self._errors: Dict[str, str] = {}
+        self._tasks = {
+            chain: asyncio.ensure_future(self._poll(chain)) for chain in chains
+        }
+
+    async def wait(self, chain: str) -> None:
+        """
+        Returns once subgraphs of the chain indexed past timestamp
+        """
+        await self._tasks[chain]
+        if chain in self._errors:
+            raise SubgraphNotIndexed(self._errors[chain])
+
+    async def _poll(self, chain: str) -> None:
+        start = time.monotonic()
+        blocks_url = get_blocks_subgraph_url(chain)
+        balancer_url = get_subgraph_url(chain) if self.check_balancer_subgraph else None
+        pending = [url for url in (blocks_url, balancer_url) if url is not None]
+        target_block = None
+        while pending:
+            if blocks_url in pending:
+                indexed = await self._indexed_timestamp(chain, blocks_url)
+                if (
+                    indexed is not None
+                    and indexed >= self.timestamp + BLOCK_SEARCH_WINDOW
+                ):
+                    pending.remove(blocks_url)
+            if balancer_url in pending and blocks_url not in pending:
+                if target_block is None:
+                    target_block = await self._target_block(chain)
+                indexed = await self._indexed_block(chain, balancer_url)
+                if None not in (indexed, target_block) and indexed >= target_block:
+                    pending.remove(balancer_url)
+            if not pending:
+                break
+            if time.monotonic() - start + self.poll_interval > self.max_wait:
+                self._errors[chain] = (
+                    f"{chain} subgraphs didn't index past {self.timestamp} "
+                    f"within {self.max_wait:.0f}s: {', '.join(pending)}"
+                )
+                break
+            logger.info(f"Waiting for {chain} subgraphs to index past {self.timestamp}")
+            await asyncio.sleep(self.poll_interval)
+        self.waited[chain] = time.monotonic() - start
+
+    async def _target_block(self, chain: str) -> Optional[int]:
+        try:
+            return await get_block_by_ts_async(self.timestamp, chain)
+        except Exception as e:
+            logger.warning(f"Couldn't look up {chain} block at {self.timestamp}: {e}")
+            return None
+
+    @staticmethod
+    async def _indexed_timestamp(chain: str, graph_url: str) -> Optional[int]:
+        try:
+            number, timestamp = await get_subgraph_meta_async(graph_url)
+            if timestamp is None:
+                timestamp = await get_indexed_block_timestamp_async(graph_url, number)
+        except Exception as e:
+            logger.warning(f"Couldn't get indexing status of {chain} subgraph: {e}")
+            return None
+        return timestamp
+
+    @staticmethod
+    async def _indexed_block(chain: str, graph_url: str) -> Optional[int]:
+        try:
+            number, _ = await get_subgraph_meta_async(graph_url)
+        except Exception as e:
+            logger.warning(f"Couldn't get indexing status of {chain} subgraph: {e}")
+            return None
+        return number
@@ -0,0 +1,258 @@
+"""
+Fee collection from on-chain events, an alternative to pool snapshots of the subgraph.
+
+Protocol fees of a pool over a block range are rebuilt from:
+- BPT minted by the pool to the ProtocolFeesCollector, for pools paying fees in BPT
+- protocolFeeAmounts of Vault PoolBalanceChanged events, for pools paying fees in pool tokens
+  on joins and exits
+
+Block ranges are scanned with parallel eth_getLogs requests. Chunks shrink when the node rejects
+a range and grow while responses stay small. Fees are summed per block window aligned to
+LOGS_CACHE_WINDOW and kept in the local disk cache once final, so overlapping ranges reuse them.
+"""
+
+import hashlib
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from decimal import Decimal
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from eth_abi import decode
+from web3 import Web3
+
+from fee_allocator.accounting.collectors import collect_fee_info
+from fee_allocator.accounting.logger import logger
+from fee_allocator.accounting.settings import Chains
+from fee_allocator.accounting.settings import LOGS_CACHE_WINDOW
+from fee_allocator.accounting.settings import LOGS_CHUNK_BLOCKS
+from fee_allocator.accounting.settings import LOGS_CONFIRMATIONS
+from fee_allocator.accounting.settings import LOGS_MAX_CHUNK_BLOCKS
+from fee_allocator.accounting.settings import LOGS_MAX_WORKERS
+from fee_allocator.accounting.settings import LOGS_TARGET_PER_REQUEST
+from fee_allocator.cache import disk_cache_get
+from fee_allocator.cache import disk_cache_set
+from fee_allocator.helpers import BALANCER_CONTRACTS
+from fee_allocator.helpers import get_tokens_metadata
+from fee_allocator.snapshots import PoolSnapshot
+
+PROTOCOL_FEES_COLLECTOR_ADDRESS = "0xce88686553686DA562CE7Cea497CE749DA109f9F"
+TRANSFER_TOPIC = Web3.to_hex(Web3.keccak(text="Transfer(address,address,uint256)"))
+POOL_BALANCE_CHANGED_TOPIC = Web3.to_hex(
+    Web3.keccak(text="PoolBalanceChanged(bytes32,address,address[],int256[],uint256[])")
+)
+ZERO_ADDRESS_TOPIC = "0x" + "0" * 64
+COLLECTOR_TOPIC = "0x" + "0" * 24 + PROTOCOL_FEES_COLLECTOR_ADDRESS[2:].lower()
+
+# Inclusive block range
+BlockRange = Tuple[int, int]
+
+
+def scan_logs(
+    get_logs: Callable[[int, int], List], from_block: int, to_block: int
+) -> List:
+    """
+    Returns logs of get_logs(from_block, to_block) over the whole range, fetched in parallel
+    chunks. A failed chunk is split in halves and the chunk size halves, chunks double while
+    they return less than LOGS_TARGET_PER_REQUEST logs. Fails when a single block fails
+    """
+    chunk_size = LOGS_CHUNK_BLOCKS
+    next_block = from_block
+    retries: deque = deque()
+    logs = []
+    with ThreadPoolExecutor(max_workers=LOGS_MAX_WORKERS) as executor:
+        pending = {}
+        while True:
+            while len(pending) < LOGS_MAX_WORKERS and (
+                retries or next_block <= to_block
+            ):
+                if retries:
+                    block_range = retries.popleft()
+                else:
+                    block_range = (
+                        next_block,
+                        min(next_block + chunk_size - 1, to_block),
+                    )
+                    next_block = block_range[1] + 1
+                pending[executor.submit(get_logs, *block_range)] = block_range
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                start, end = pending.pop(future)
+                try:
+                    chunk_logs = future.result()
+                except Exception:
+                    if start == end:
+                        raise
+                    middle = (start + end) // 2
+                    retries.extend([(start, middle), (middle + 1, end)])
+                    chunk_size = max((end - start + 1) // 2, 1)
+                    continue
+                logs.extend(chunk_logs)
+                if len(chunk_logs) < LOGS_TARGET_PER_REQUEST // 2:
+                    chunk_size = min(chunk_size * 2, LOGS_MAX_CHUNK_BLOCKS)
+    return logs
+
+
+def cache_windows(from_block: int, to_block: int) -> List[BlockRange]:
+    """
+    Splits the range at multiples of LOGS_CACHE_WINDOW
+    """
+    windows = []
+    start = from_block
+    while start <= to_block:
+        end = min((start // LOGS_CACHE_WINDOW + 1) * LOGS_CACHE_WINDOW - 1, to_block)
+        windows.append((start, end))
+        start = end + 1
+    return windows
+
+
+def sum_fee_logs(
+    bpt_mint_logs: List, balance_changed_logs: List
+) -> Dict[str, Dict[str, int]]:
+    """
+    Returns raw fee amounts minted as BPT per pool address,
+    and paid in pool tokens per pool id and token
+    """
+    bpt_fees: Dict[str, int] = {}
+    for log in bpt_mint_logs:
+        pool_address = log["address"].lower()
+        bpt_fees[pool_address] = bpt_fees.get(pool_address, 0) + int.from_bytes(
+            bytes(log["data"]), "big"
+        )
+    token_fees: Dict[str, Dict[str, int]] = {}
+    for log in balance_changed_logs:
+        pool_id = Web3.to_hex(log["topics"][1])
+        tokens, _, protocol_fee_amounts = decode(
+            ["address[]", "int256[]", "uint256[]"], bytes(log["data"])
+        )
+        pool_fees = token_fees.setdefault(pool_id, {})
+        for token, amount in zip(tokens, protocol_fee_amounts):
+            if amount:
+                pool_fees[token.lower()] = pool_fees.get(token.lower(), 0) + amount
+    return {"bpt": bpt_fees, "tokens": token_fees}
+
+
+def get_pool_fee_amounts(
+    web3: Web3, chain: str, pool_ids: List[str], from_block: int, to_block: int
+) -> Dict[str, Dict]:
+    """
+    Returns raw fee amounts of pools paid after from_block up to to_block, like the difference
+    of snapshots at both blocks, see sum_fee_logs. Sums of cache windows with at least
+    LOGS_CONFIRMATIONS confirmations are stored in the local disk cache
+    """
+    pool_ids = sorted(pool_id.lower() for pool_id in pool_ids)
+    filter_hash = hashlib.sha1(",".join(pool_ids).encode()).hexdigest()
+    pool_addresses = [Web3.to_checksum_address(pool_id[:42]) for pool_id in pool_ids]
+    vault = BALANCER_CONTRACTS[chain]["BALANCER_VAULT_ADDRESS"]
+
+    def get_bpt_mint_logs(start: int, end: int) -> List:
+        return web3.eth.get_logs(
+            {
+                "fromBlock": start,
+                "toBlock": end,
+                "address": pool_addresses,
+                "topics": [TRANSFER_TOPIC, ZERO_ADDRESS_TOPIC, COLLECTOR_TOPIC],
+            }
+        )
+
+    def get_balance_changed_logs(start: int, end: int) -> List:
+        return web3.eth.get_logs(
+            {
+                "fromBlock": start,
+                "toBlock": end,
+                "address": vault,
+                "topics": [POOL_BALANCE_CHANGED_TOPIC, pool_ids],
+            }
+        )
+
+    final_block = web3.eth.block_number - LOGS_CONFIRMATIONS
+    totals = {"bpt": {}, "tokens": {}}
+    for start, end in cache_windows(from_block + 1, to_block):
+        cache_key = f"{chain}:{start}:{end}:{filter_hash}"
+        window_fees = disk_cache_get("fee_logs", cache_key)
+        if window_fees is None:
+            window_fees = sum_fee_logs(
+                scan_logs(get_bpt_mint_logs, start, end),
+                scan_logs(get_balance_changed_logs, start, end),
+            )
+            if end <= final_block:
+                disk_cache_set("fee_logs", cache_key, window_fees)
+        for pool_address, amount in window_fees["bpt"].items():
+            totals["bpt"][pool_address] = totals["bpt"].get(pool_address, 0) + amount
+        for pool_id, pool_fees in window_fees["tokens"].items():
+            pool_totals = totals["tokens"].setdefault(pool_id, {})
+            for token, amount in pool_fees.items():
+                pool_totals[token] = pool_totals.get(token, 0) + amount
+    return totals
+
+
+def collect_log_fee_info(
+    pools: List[str],
+    chain: Chains,
+    web3: Web3,
+    from_block: int,
+    to_block: int,
+    start_ts: int,
+    end_ts: int,
+    bpt_twap_prices: Dict[str, Dict],
+    token_prices: Optional[Dict[str, Optional[Decimal]]] = None,
+) -> Dict[str, Dict]:
+    """
+    collect_fee_info result for fees paid by pools between two blocks, rebuilt from events
+    """
+    pools = list(pools)
+    fee_amounts = get_pool_fee_amounts(web3, chain.value, pools, from_block, to_block)
+    tokens = list(
+        dict.fromkeys(
+            token for pool_fees in fee_amounts["tokens"].values() for token in pool_fees
+        )
+    )
+    pool_addresses = [pool_id[:42] for pool_id in pools]
+    metadata = dict(
+        zip(
+            pool_addresses + tokens,
+            get_tokens_metadata(web3, chain.value, pool_addresses + tokens),
+        )
+    )
+    # Fees accrued over the range as snapshots starting from zero
+    accrued = {}
+    for pool_id, pool_address in zip(pools, pool_addresses):
+        bpt_decimals, _, symbol = metadata[pool_address]
+        bpt_fee = fee_amounts["bpt"].get(pool_address.lower(), 0)
+        token_fees = fee_amounts["tokens"].get(pool_id.lower(), {})
+        accrued[pool_id] = PoolSnapshot(
+            pool_id,
+            pool_address,
+            symbol,
+            end_ts,
+            (
+                str(Decimal(bpt_fee) / Decimal(10**bpt_decimals))
+                if bpt_fee or not token_fees
+                else None
+            ),
+            tuple(
+                (token, str(Decimal(amount) / Decimal(10 ** metadata[token][0])))
+                for token, amount in token_fees.items()
+            ),
+        )
+    logger.info(
+        f"Rebuilt fees of {len(pools)} {chain.value} pools from events "
+        f"between blocks {from_block} and {to_block}"
+    )
+    return collect_fee_info(
+        pools,
+        chain,
+        accrued,
+        {},
+        start_ts=start_ts,
+        end_ts=end_ts,
+        bpt_twap_prices=bpt_twap_prices,
+        token_prices=token_prices,
+    )
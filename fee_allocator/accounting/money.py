@@ -0,0 +1,85 @@
+"""
+Fixed point money kernel.
+
+Amounts are represented as integer micro-USDC (1 USDC = 10**6), the same 6 decimal
+mantissa the tx builder emits. Splitting an amount is done with integer apportionment,
+so the parts always add up to the whole and sums reconcile to the last unit.
+"""
+
+from decimal import ROUND_HALF_UP
+from decimal import Decimal
+from itertools import accumulate
+from typing import List
+from typing import Sequence
+from typing import Union
+
+USDC_DECIMALS = 6
+MICRO_USDC = 10**USDC_DECIMALS
+
+Amount = Union[Decimal, float, int, str]
+
+
+def to_micro(amount: Amount) -> int:
+    """
+    Convert USD amount to integer micro-USDC, rounding half up.
+    Floats are converted through their shortest repr, so 0.1 becomes 100000
+    """
+    if isinstance(amount, float):
+        amount = repr(amount)
+    return int(
+        (Decimal(amount) * MICRO_USDC).quantize(Decimal(1), rounding=ROUND_HALF_UP)
+    )
+
+
+def from_micro(amount: int) -> Decimal:
+    """
+    Convert integer micro-USDC to an exact Decimal USD amount
+    """
+    return Decimal(int(amount)).scaleb(-USDC_DECIMALS)
+
+
+def quantize(amount: Amount) -> Decimal:
+    """
+    Round USD amount to the micro-USDC grid
+    """
+    return from_micro(to_micro(amount))
+
+
+def mul_micro(amount: int, fraction: Amount) -> int:
+    """
+    Multiply micro amount by a fraction, rounding half up to whole micro-USDC
+    """
+    if isinstance(fraction, float):
+        fraction = repr(fraction)
+    return int(
+        (amount * Decimal(fraction)).quantize(Decimal(1), rounding=ROUND_HALF_UP)
+    )
+
+
+def apportion(total: int, weights: Sequence[int]) -> List[int]:
+    """
+    Split integer total between weights so that parts always sum exactly to total.
+
+    Uses cumulative rounding: part_i = R(total * W_i / W) - R(total * W_(i-1) / W),
+    where W_i are the running sums of weights and R rounds half up. Every part is within
+    one unit of its exact share. With zero total weight the total is split evenly.
+    All math is on python ints, so there is no overflow at any scale.
+    """
+    if not weights:
+        return []
+    weights = [int(weight) for weight in weights]
+    weight_sum = sum(weights)
+    if weight_sum == 0:
+        weights = [1] * len(weights)
+        weight_sum = len(weights)
+    if weight_sum < 0:
+        weights = [-weight for weight in weights]
+        weight_sum = -weight_sum
+    boundaries = [
+        (2 * total * cumulative + weight_sum) // (2 * weight_sum)
+        for cumulative in accumulate(weights)
+    ]
+    return [
+        boundary - previous
+        for previous, boundary in zip([0] + boundaries[:-1], boundaries)
+    ]
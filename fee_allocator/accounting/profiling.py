@@ -0,0 +1,157 @@
+"""
+Profiling of fee pipeline runs.
+
+A sampling profiler reads stacks of every thread each PROFILE_INTERVAL seconds and files them
+under the pipeline stage and chain the thread works for. Samples are written as collapsed
+stacks, the input format of flamegraph.pl and speedscope, so a flamegraph shows wall time
+spent in Decimal math, JSON decoding, ABI encoding or waiting on the network per stage.
+Stage runs are written as a Chrome trace (chrome://tracing, Perfetto) with wall and CPU time
+of every stage on the thread that ran it, which shows how stages overlapped.
+"""
+
+import json
+import os
+import sys
+import threading
+from types import FrameType
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from fee_allocator.accounting import PROJECT_ROOT
+from fee_allocator.accounting.settings import PROFILE_INTERVAL
+from fee_allocator.accounting.stages import running_stage
+from fee_allocator.accounting.stages import stage_label
+
+OUTSIDE_STAGES = "outside_stages"
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _is_idle_worker(frame: FrameType) -> bool:
+    """
+    Executor workers waiting for work only sit in _worker, there's nothing to profile
+    """
+    return frame.f_code.co_name == "_worker" and frame.f_code.co_filename.endswith(
+        os.path.join("concurrent", "futures", "thread.py")
+    )
+
+
+def _waits_for_stage(names: List[str]) -> bool:
+    """
+    Callers of stages with a budget only wait for the thread running the stage
+    """
+    waiting = False
+    for name in names:
+        if name.startswith("_call_with_budget (stages.py"):
+            waiting = True
+        elif name.startswith("labeled (stages.py"):
+            waiting = False
+    return waiting
+
+
+def collapse_stack(frame: Optional[FrameType]) -> List[str]:
+    """
+    Frame names from the outermost frame to frame
+    """
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return names[::-1]
+
+
+class SamplingProfiler:
+    """
+    Samples stacks of all threads in a background thread between start() and stop()
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples: Dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own_thread = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread or _is_idle_worker(frame):
+                    continue
+                self.sample(thread_id, frame)
+
+    def sample(self, thread_id: int, frame: FrameType) -> None:
+        names = collapse_stack(frame)
+        if _waits_for_stage(names):
+            return
+        stage = running_stage(thread_id) or OUTSIDE_STAGES
+        stack = ";".join([stage, *names])
+        self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def collapsed(self) -> str:
+        """
+        One line per distinct stack: stage;outermost frame;...;innermost frame samples
+        """
+        return "".join(
+            f"{stack} {count}\n" for stack, count in sorted(self.samples.items())
+        )
+
+
+def chrome_trace(runs: List[Dict]) -> Dict:
+    """
+    Chrome trace events of stage runs, in microseconds since the first run started
+    """
+    if not runs:
+        return {"traceEvents": []}
+    origin = min(run["started_at"] for run in runs)
+    events = []
+    for run in runs:
+        events.append(
+            {
+                "name": stage_label(run["stage"], run),
+                "cat": "cached" if run["cached"] else "stage",
+                "ph": "X",
+                "ts": round((run["started_at"] - origin) * 1e6),
+                "dur": round(run["seconds"] * 1e6),
+                "pid": os.getpid(),
+                "tid": run["thread"],
+                "args": {
+                    "chain": run["chain"],
+                    "cpu_seconds": round(run["cpu_seconds"], 6),
+                    "cached": run["cached"],
+                    "fallback": run["fallback"],
+                },
+            }
+        )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def save_profile(
+    profiler: SamplingProfiler, runs: List[Dict], output_file_name: str
+) -> List[str]:
+    """
+    Write collapsed stacks and the Chrome trace of a run under fee_allocator/allocations/profiles
+    """
+    stem = os.path.join(
+        PROJECT_ROOT,
+        "fee_allocator/allocations/profiles",
+        os.path.splitext(output_file_name)[0],
+    )
+    os.makedirs(os.path.dirname(stem), exist_ok=True)
+    with open(f"{stem}.collapsed", "w") as f:
+        f.write(profiler.collapsed())
+    with open(f"{stem}.trace.json", "w") as f:
+        json.dump(chrome_trace(runs), f)
+    return [f"{stem}.collapsed", f"{stem}.trace.json"]
@@ -5,9 +5,14 @@ from typing import Dict
 from typing import Optional
 
 import pandas as pd
-import simplejson as json
 
 from fee_allocator.accounting import PROJECT_ROOT
+from fee_allocator.accounting.money import from_micro
+from fee_allocator.accounting.money import quantize
+from fee_allocator.accounting.money import to_micro
+from fee_allocator.accounting.settings import RECON_MAX_DELTA
+from fee_allocator.accounting.summary_store import ReconSummaryStore
+from fee_allocator.gauge_registry import get_gauge_registry
 
 
 def recon_and_validate(
@@ -22,22 +27,16 @@ def recon_and_validate(
     and raise exceptions if validation fails
     """
     # Move to separate function
-    all_fees_sum = Decimal(round(sum(fees_to_distribute.values()), 4))
-    all_incentives_sum = round(
+    # Sums are done in integer micro-USDC, so fees and incentives reconcile exactly
+    all_fees_sum = from_micro(sum(to_micro(x) for x in fees_to_distribute.values()))
+    all_incentives_sum = from_micro(
         sum(
-            [
-                sum(
-                    [
-                        x["fees_to_vebal"],
-                        x["fees_to_dao"],
-                        x["aura_incentives"],
-                        x["bal_incentives"],
-                    ]
-                )
-                for x in fees.values()
-            ]
-        ),
-        4,
+            to_micro(x["fees_to_vebal"])
+            + to_micro(x["fees_to_dao"])
+            + to_micro(x["aura_incentives"])
+            + to_micro(x["bal_incentives"])
+            for x in fees.values()
+        )
     )
     # If everything is 0 - don't store the summary
     if all_incentives_sum == 0 or all_fees_sum == 0:
@@ -71,7 +70,7 @@ def recon_and_validate(
             fee_info["total_incentives"] >= 0
         ), f"Recon Failed: {fee_info['pool_id???']} Balancer incentives of {fee_info['total_incentives']}should be >= 0"
 
-    assert abs_delta < Decimal(0.15), f"Reconciliation failed. Delta: {delta}"
+    assert abs_delta <= RECON_MAX_DELTA, f"Reconciliation failed. Delta: {delta}"
     print(f"During recon found a delta of {delta}")
     # Make sure all SUM(pct) == 1
     assert (
@@ -118,36 +117,20 @@ def recon_and_validate(
         "periodStart": timestamp_2_weeks_ago,
         "periodEnd": timestamp_now,
     }
-    recon_file_name = os.path.join(PROJECT_ROOT, "fee_allocator/summaries/recon.json")
-    # Append new summary to the file
-    with open(recon_file_name) as f:
-        existing_data = json.load(f)
-
-    # Make sure that the summary is not already in the file
-    already_in_file = False
-    for item in existing_data:
-        if (
-            item["periodStart"] == summary["periodStart"]
-            and item["periodEnd"] == summary["periodEnd"]
-        ):
-            # Don't append the summary if it's already in the file
-            already_in_file = True
-            break
-    if already_in_file:
-        return
-
-    existing_data.append(summary)
-    with open(recon_file_name, "w") as f:
-        json.dump(existing_data, f, use_decimal=True, indent=2)
+    # Append new summary to the store, skipping periods that are already recorded
+    ReconSummaryStore().append(summary)
 
 
 def generate_and_save_input_csv(
-    fees: dict, period_ends: int, mapped_pools_info: Dict
+    fees: dict, period_ends: int, mapped_pools_info: Optional[Dict] = None
 ) -> None:
     """
     Function that generates and saves csv in format:
-    target_root_gauge,platform,amount_of_incentives
+    target_root_gauge,platform,amount_of_incentives.
+    Pools are mapped to gauges of the gauge registry unless mapped_pools_info is passed
     """
+    if mapped_pools_info is None:
+        mapped_pools_info = get_gauge_registry().pool_to_gauge
     all_incentives_sum = sum(
         [
             sum(
@@ -174,7 +157,7 @@ def generate_and_save_input_csv(
             {
                 "target": mapped_pools_info[pool_id],
                 "platform": "aura",
-                "amount": round(fee_item["aura_incentives"], 4),
+                "amount": quantize(fee_item["aura_incentives"]),
             }
         )
         # Bal incentives
@@ -182,16 +165,16 @@ def generate_and_save_input_csv(
             {
                 "target": mapped_pools_info[pool_id],
                 "platform": "balancer",
-                "amount": round(fee_item["bal_incentives"], 4),
+                "amount": quantize(fee_item["bal_incentives"]),
             }
         )
     # Add DAO share to the output
-    dao_share = sum([x["fees_to_dao"] for x in fees.values()])
+    dao_share = from_micro(sum(to_micro(x["fees_to_dao"]) for x in fees.values()))
     output.append(
         {
             "target": "0x10A19e7eE7d7F8a52822f6817de8ea18204F2e4f",  # DAO msig
             "platform": "payment",
-            "amount": round(dao_share, 4),
+            "amount": dao_share,
         }
     )
     # Convert to dataframe and save to csv
@@ -0,0 +1,371 @@
+"""
+Long running allocator service.
+
+Keeps blocks, token metadata, price series, gauge registries, configs and collected fees
+warm in memory and serves allocations over a local HTTP/JSON API:
+
+    GET  /health
+    GET  /allocations?ts_now=...&ts_in_the_past=...&dao_share_pct=...&format=csv
+    POST /allocations  {"ts_now": ..., "fee_constants": {...}, "fees_to_distribute": {...}}
+    POST /refresh      drop cached configs
+
+Allocation rows are the same as in current_fees.csv.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+from decimal import InvalidOperation
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+import pandas as pd
+import simplejson
+from munch import Munch
+from web3 import Web3
+
+from fee_allocator.accounting.distribution import add_last_join_exit
+from fee_allocator.accounting.distribution import fetch_overrides
+from fee_allocator.accounting.fee_pipeline import allocate_incentives
+from fee_allocator.accounting.fee_pipeline import collect_chain_fees
+from fee_allocator.accounting.fee_pipeline import fetch_mapped_pools_info
+from fee_allocator.accounting.fee_pipeline import fetch_pipeline_configs
+from fee_allocator.accounting.fee_pipeline import get_valid_core_pools
+from fee_allocator.accounting.fee_pipeline import incentives_to_df
+from fee_allocator.accounting.fee_pipeline import load_fees_to_distribute
+from fee_allocator.accounting.fee_pipeline import merge_incentives
+from fee_allocator.accounting.logger import logger
+from fee_allocator.accounting.settings import CONFIG_CACHE_TTL
+from fee_allocator.accounting.settings import Chains
+from fee_allocator.accounting.settings import SERVICE_HOST
+from fee_allocator.accounting.settings import SERVICE_MAX_CACHED_PERIODS
+from fee_allocator.accounting.settings import SERVICE_PERIOD_GRANULARITY
+from fee_allocator.accounting.settings import SERVICE_PORT
+from fee_allocator.accounting.stages import reset_stages
+from fee_allocator.cache import reset_single_flight
+from fee_allocator.cache import ttl_cache
+from fee_allocator.helpers import calculate_aura_vebal_share
+from fee_allocator.helpers import fetch_hh_aura_bribs
+from fee_allocator.helpers import get_block_by_ts
+
+FEE_CONSTANT_PARAMS = [
+    "dao_share_pct",
+    "vebal_share_pct",
+    "min_aura_incentive",
+    "min_existing_aura_incentive",
+    "min_vote_incentive_amount",
+]
+QUERY_PARAMS = [
+    "ts_now",
+    "ts_in_the_past",
+    "fees_file_name",
+    "aura_vebal_share",
+    "format",
+    *FEE_CONSTANT_PARAMS,
+]
+DEFAULT_FEES_FILE_NAME = "current_fees_collected.json"
+
+
+@ttl_cache(CONFIG_CACHE_TTL)
+def fetch_service_configs() -> Dict:
+    """
+    Configs shared by all allocations, refreshed every CONFIG_CACHE_TTL seconds
+    """
+    core_pools, fee_constants, reroute_config = fetch_pipeline_configs()
+    return {
+        "core_pools": core_pools,
+        "fee_constants": fee_constants,
+        "reroute_config": reroute_config,
+        "overrides": fetch_overrides(),
+        "existing_aura_bribs": fetch_hh_aura_bribs(),
+        "mapped_pools_info": fetch_mapped_pools_info(),
+    }
+
+
+class AllocatorService:
+    """
+    Computes allocations from warm caches. Collected fees and the aura veBAL share
+    are kept per (ts_now, ts_in_the_past) period, so re-running a period with different
+    parameters only repeats the allocation stage
+    """
+
+    def __init__(
+        self,
+        web3_instances: Munch[Web3],
+        default_timestamps: Callable[[], Tuple[int, int]],
+    ):
+        self.web3_instances = web3_instances
+        self.default_timestamps = default_timestamps
+        self._periods: "OrderedDict[Tuple[int, int], Dict]" = OrderedDict()
+        self._period_locks: Dict[Tuple[int, int], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def resolve_period(
+        self, ts_now: Optional[int] = None, ts_in_the_past: Optional[int] = None
+    ) -> Tuple[int, int]:
+        """
+        Fill in default timestamps. Default ts_now is rounded down to SERVICE_PERIOD_GRANULARITY,
+        so repeated requests for the current epoch share collected fees
+        """
+        default_ts_now, default_ts_in_the_past = self.default_timestamps()
+        if ts_now is None:
+            ts_now = default_ts_now - default_ts_now % SERVICE_PERIOD_GRANULARITY
+        return int(ts_now), int(ts_in_the_past or default_ts_in_the_past)
+
+    def cached_periods(self) -> List[Tuple[int, int]]:
+        with self._lock:
+            return list(self._periods.keys())
+
+    def get_period(self, ts_now: int, ts_in_the_past: int) -> Dict:
+        """
+        Returns collected fees of all chains and aura veBAL share of a period,
+        computing them once even if requested concurrently
+        """
+        period = (ts_now, ts_in_the_past)
+        with self._lock:
+            if period in self._periods:
+                self._periods.move_to_end(period)
+                return self._periods[period]
+            period_lock = self._period_locks.setdefault(period, threading.Lock())
+        with period_lock:
+            with self._lock:
+                if period in self._periods:
+                    return self._periods[period]
+            period_data = self._collect_period(ts_now, ts_in_the_past)
+            with self._lock:
+                self._periods[period] = period_data
+                while len(self._periods) > SERVICE_MAX_CACHED_PERIODS:
+                    self._periods.popitem(last=False)
+                self._period_locks.pop(period, None)
+        return period_data
+
+    def _collect_period(self, ts_now: int, ts_in_the_past: int) -> Dict:
+        logger.info(f"Collecting fees between timestamps {ts_in_the_past} and {ts_now}")
+        # Identical requests are coalesced per collection, so the service doesn't accumulate them
+        reset_single_flight()
+        core_pools = fetch_service_configs()["core_pools"]
+        collected_fees = {}
+        for chain in Chains:
+            listed_core_pools = core_pools.get(chain.value)
+            if listed_core_pools is None:
+                continue
+            pools = get_valid_core_pools(chain, listed_core_pools)
+            if not pools:
+                continue
+            collected_fees[chain.value] = collect_chain_fees(
+                chain,
+                self.web3_instances[chain.value],
+                pools,
+                listed_core_pools,
+                ts_now,
+                ts_in_the_past,
+                # Boundaries are stored by pipeline runs, not by arbitrary periods of requests
+                save_boundaries=False,
+            )
+        aura_vebal_share = calculate_aura_vebal_share(
+            self.web3_instances["mainnet"],
+            get_block_by_ts(ts_now, Chains.MAINNET.value),
+        )
+        return {"collected_fees": collected_fees, "aura_vebal_share": aura_vebal_share}
+
+    def allocations(self, params: Dict) -> Tuple[Tuple[int, int], pd.DataFrame]:
+        """
+        Allocate fees of a period. params may override ts_now, ts_in_the_past, fees_file_name,
+        aura_vebal_share, fee_constants and fees_to_distribute per chain.
+        Returns the period and the rows of the allocations csv
+        """
+        # Stages record a run on every call, the service keeps only those of the last request
+        reset_stages()
+        ts_now, ts_in_the_past = self.resolve_period(
+            params.get("ts_now"), params.get("ts_in_the_past")
+        )
+        period = self.get_period(ts_now, ts_in_the_past)
+        configs = fetch_service_configs()
+        fee_constants = {**configs["fee_constants"], **params.get("fee_constants", {})}
+        fees_to_distribute = {
+            **load_fees_to_distribute(
+                params.get("fees_file_name") or DEFAULT_FEES_FILE_NAME
+            ),
+            **params.get("fees_to_distribute", {}),
+        }
+        aura_vebal_share = params.get("aura_vebal_share", period["aura_vebal_share"])
+        incentives = {chain.value: {} for chain in Chains}
+        for chain in Chains:
+            chain_fees = period["collected_fees"].get(chain.value)
+            if not chain_fees or chain.value not in fees_to_distribute:
+                continue
+            # Allocation works on copies, collected fees stay untouched in the cache
+            chain_incentives = allocate_incentives(
+                chain,
+                chain_fees,
+                fees_to_distribute[chain.value],
+                fee_constants,
+                aura_vebal_share,
+                configs["existing_aura_bribs"],
+                configs["mapped_pools_info"],
+                configs["reroute_config"],
+                configs["overrides"],
+            )
+            incentives[chain.value] = add_last_join_exit(chain_incentives, chain)
+        return (ts_now, ts_in_the_past), incentives_to_df(merge_incentives(incentives))
+
+    def warm(self) -> None:
+        """
+        Compute allocations of the current epoch, so the first request is served warm
+        """
+        try:
+            self.allocations({})
+        except Exception as e:
+            logger.warning(f"Warming the allocator service failed: {e}")
+
+
+def parse_params(query: Dict[str, List[str]], body: Optional[Dict] = None) -> Dict:
+    """
+    Normalize query string and json body params of an allocations request
+    """
+    params = dict(body or {})
+    for key, values in query.items():
+        if key not in QUERY_PARAMS:
+            raise ValueError(f"Unknown parameter {key}")
+        if key in FEE_CONSTANT_PARAMS:
+            params.setdefault("fee_constants", {})[key] = values[-1]
+        else:
+            params[key] = values[-1]
+    unknown = set(params) - set(QUERY_PARAMS) - {"fee_constants", "fees_to_distribute"}
+    unknown |= set(params.get("fee_constants", {})) - set(FEE_CONSTANT_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown parameters {sorted(unknown)}")
+    fees_file_name = params.get("fees_file_name")
+    if fees_file_name is not None and (
+        not isinstance(fees_file_name, str)
+        or os.path.basename(fees_file_name) != fees_file_name
+        or fees_file_name in ("", ".", "..")
+    ):
+        raise ValueError(
+            "fees_file_name must be a file name in fee_allocator/fees_collected"
+        )
+    try:
+        for key in ("ts_now", "ts_in_the_past"):
+            if params.get(key) is not None:
+                params[key] = int(params[key])
+        if params.get("aura_vebal_share") is not None:
+            params["aura_vebal_share"] = Decimal(str(params["aura_vebal_share"]))
+        params["fee_constants"] = {
+            key: Decimal(str(value))
+            for key, value in params.get("fee_constants", {}).items()
+        }
+        params["fees_to_distribute"] = {
+            chain: Decimal(str(value))
+            for chain, value in params.get("fees_to_distribute", {}).items()
+        }
+    except (TypeError, InvalidOperation):
+        raise ValueError("Timestamps and amounts must be numbers")
+    return params
+
+
+class AllocatorRequestHandler(BaseHTTPRequestHandler):
+    server_version = "FeeAllocator"
+
+    @property
+    def service(self) -> AllocatorService:
+        return self.server.service
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path == "/health":
+            self._send_json(
+                {"status": "ok", "cached_periods": self.service.cached_periods()}
+            )
+        elif url.path == "/allocations":
+            self._handle_allocations(parse_qs(url.query))
+        else:
+            self._send_json({"error": "Not found"}, status=404)
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        if url.path == "/refresh":
+            fetch_service_configs.cache_clear()
+            self._send_json({"status": "ok"})
+        elif url.path == "/allocations":
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                body = simplejson.loads(self.rfile.read(length) or "{}")
+            except ValueError:
+                self._send_json({"error": "Body must be json"}, status=400)
+                return
+            self._handle_allocations(parse_qs(url.query), body)
+        else:
+            self._send_json({"error": "Not found"}, status=404)
+
+    def _handle_allocations(
+        self, query: Dict[str, List[str]], body: Optional[Dict] = None
+    ) -> None:
+        try:
+            params = parse_params(query, body)
+        except ValueError as e:
+            self._send_json({"error": str(e)}, status=400)
+            return
+        try:
+            (ts_now, ts_in_the_past), df = self.service.allocations(params)
+        except Exception as e:
+            logger.exception("Allocation request failed")
+            self._send_json({"error": str(e)}, status=500)
+            return
+        if params.get("format") == "csv":
+            self._send(df.to_csv().encode(), "text/csv")
+            return
+        self._send_json(
+            {
+                "ts_now": ts_now,
+                "ts_in_the_past": ts_in_the_past,
+                "rows": df.rename_axis("pool_id").reset_index().to_dict("records"),
+            }
+        )
+
+    def _send_json(self, data: Dict, status: int = 200) -> None:
+        body = simplejson.dumps(data, use_decimal=True, ignore_nan=True, default=str)
+        self._send(body.encode(), "application/json", status)
+
+    def _send(self, body: bytes, content_type: str, status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.info(f"{self.address_string()} {format % args}")
+
+
+def serve(
+    web3_instances: Munch[Web3],
+    default_timestamps: Callable[[], Tuple[int, int]],
+    host: Optional[str] = None,
+    port: Optional[int] = None,
+) -> None:
+    """
+    Run the allocator service until interrupted. Current epoch is warmed in the background
+    """
+    service = AllocatorService(web3_instances, default_timestamps)
+    server = ThreadingHTTPServer(
+        (host or SERVICE_HOST, port or SERVICE_PORT), AllocatorRequestHandler
+    )
+    server.service = service
+    threading.Thread(target=service.warm, daemon=True).start()
+    logger.info(
+        f"Allocator service listening on http://{server.server_address[0]}:{server.server_address[1]}"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
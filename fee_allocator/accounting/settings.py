@@ -1,5 +1,9 @@
+import os
+from decimal import Decimal
 from enum import Enum
 
+from fee_allocator.accounting import PROJECT_ROOT
+
 
 class Chains(Enum):
     MAINNET = "mainnet"
@@ -19,3 +23,120 @@ OVERRIDES_URL = "https://raw.githubusercontent.com/BalancerMaxis/multisig-ops/ae
 #  Various distribution logic run one after the next can result in a state where there is a very small veBAL bribe and
 #  a sizable vlAURA bribe.  If there is less than this amount allocated to veBAL markets on a single gauge, move it over to vlAURA to save gass
 MIN_VERBAL_BRIBE_AFTER_ALL_REDISTRIBUTIONS = 75  # USDC
+# Max difference between fees collected and incentives distributed allowed by recon.
+# Amounts are split in integer micro-USDC, so they have to reconcile exactly
+RECON_MAX_DELTA = Decimal(0)
+
+# RPC connection pool size per chain, max calls per JSON-RPC batch request and request timeout in seconds
+RPC_POOL_SIZE = 20
+RPC_BATCH_SIZE = int(os.getenv("RPC_BATCH_SIZE", 50))
+RPC_TIMEOUT = 30
+# Extra endpoints serving the same chain, comma separated in RPC_URLS_<CHAIN> and SUBGRAPH_URLS_<CHAIN>
+# env vars, e.g. RPC_URLS_MAINNET. They back the dRPC endpoint and the subgraph gateway of the chain
+RPC_URLS = {
+    chain.value: [
+        url for url in os.getenv(f"RPC_URLS_{chain.name}", "").split(",") if url
+    ]
+    for chain in Chains
+}
+SUBGRAPH_URLS = {
+    chain.value: [
+        url for url in os.getenv(f"SUBGRAPH_URLS_{chain.name}", "").split(",") if url
+    ]
+    for chain in Chains
+}
+# Requests to an endpoint group are hedged to the next endpoint when the fastest one doesn't answer
+# within its HEDGE_PERCENTILE latency, once it has HEDGE_MIN_SAMPLES of the last
+# ENDPOINT_LATENCY_WINDOW latencies. Failed endpoints are skipped for ENDPOINT_COOLDOWN seconds
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+ENDPOINT_LATENCY_WINDOW = 200
+ENDPOINT_COOLDOWN = 60
+ENDPOINT_MAX_WORKERS = 32
+# Timeout in seconds of config, Hidden Hand and gql requests
+HTTP_TIMEOUT = 30
+# Seconds every run of a pipeline stage may take, and all stages of a chain together.
+# Stages running out of time fail the run, unless they have a fallback. Live data (configs,
+# overrides, bribes, valid core pools) never falls back to values fetched by earlier runs,
+# the gauge registry and token metadata fall back to the ones stored by earlier runs
+STAGE_BUDGETS = {
+    "gauge_registry": 120,
+    "configs": 120,
+    "overrides": 60,
+    "aura_bribs": 60,
+    "valid_core_pools": 300,
+    "token_metadata": 120,
+    "fetch_plan": 1200,
+    "aura_vebal_share": 120,
+    "collected_fees": 1200,
+    "join_exit": 600,
+}
+CHAIN_BUDGET = 2400
+# Default end of the period is DEFAULT_TS_NOW_LAG seconds before now. Work on a chain starts once
+# its subgraphs indexed past it, they are polled every SUBGRAPH_POLL_INTERVAL seconds
+# for up to SUBGRAPH_MAX_WAIT seconds
+DEFAULT_TS_NOW_LAG = 600
+SUBGRAPH_POLL_INTERVAL = 60
+SUBGRAPH_MAX_WAIT = 3 * 3600
+# Where collected fees come from: "subgraph" pool snapshots or "logs", fee events read with eth_getLogs.
+# Logs are read in chunks of LOGS_CHUNK_BLOCKS blocks on LOGS_MAX_WORKERS threads. Chunks halve when
+# the node rejects them and double up to LOGS_MAX_CHUNK_BLOCKS while they return less than half of
+# LOGS_TARGET_PER_REQUEST logs. Fees are cached per LOGS_CACHE_WINDOW blocks, windows ending within
+# LOGS_CONFIRMATIONS blocks of the chain head may still be reorged and are not cached
+FEE_SOURCE = os.getenv("FEE_SOURCE", "subgraph")
+LOGS_CHUNK_BLOCKS = 10_000
+LOGS_MAX_CHUNK_BLOCKS = 100_000
+LOGS_TARGET_PER_REQUEST = 2000
+LOGS_MAX_WORKERS = 8
+LOGS_CACHE_WINDOW = 100_000
+LOGS_CONFIRMATIONS = 128
+# Mimic fee reports synced into the fee ledger, fetched on up to FEE_LEDGER_MAX_WORKERS threads
+MIMIC_SUMMARY_URL = "https://api.mimic.fi/public/summary/"
+MIMIC_ENV_ID = "0xd28bd4e036df02abce84bc34ede2a63abcefa0567ff2d923f01c24633262c7f8"
+MIMIC_CHAIN_ID = "1"
+FEE_LEDGER_MAX_WORKERS = 4
+# Seconds between stack samples of --profile runs
+PROFILE_INTERVAL = 0.005
+# Max in-flight gql requests when running the async pipeline
+ASYNC_MAX_CONCURRENCY = 32
+
+# Ranges of token price histories served by the balancer api, by seconds they cover. Histories
+# are fetched for the longest range once, then extended with the shortest range covering the
+# time since they were last fetched
+PRICE_HISTORY_RANGES = [
+    (7 * 86400, "SEVEN_DAY"),
+    (30 * 86400, "THIRTY_DAY"),
+    (90 * 86400, "NINETY_DAY"),
+]
+# Seconds that configs, token price series and gauge data stay cached in long running processes
+CONFIG_CACHE_TTL = 600
+PRICE_CACHE_TTL = 3600
+GAUGE_CACHE_TTL = 3600
+# Allocator service defaults. Collected fees of the current epoch are recomputed at most once per
+# SERVICE_PERIOD_GRANULARITY seconds, fees of closed periods are kept for the life of the process
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8735
+SERVICE_PERIOD_GRANULARITY = 3600
+SERVICE_MAX_CACHED_PERIODS = 16
+# Local disk cache filled by the pre-epoch warm up job (main.py --warm_cache) and read by every run.
+# Files older than CACHE_MAX_AGE_DAYS are pruned by the warm up job
+CACHE_DIR = os.getenv(
+    "FEE_ALLOCATOR_CACHE_DIR", os.path.join(PROJECT_ROOT, "fee_allocator/cache")
+)
+CACHE_MAX_AGE_DAYS = 35
+# Seconds between block number samples stored by the warm up job
+BLOCK_SAMPLE_INTERVAL = 3600
+# Blocks BPT balances and supply are sampled at for pricing, evenly spaced in the period.
+# 1 prices pools with balances at the end of the period only
+BPT_PRICE_SAMPLES = 1
+# Fetch planner (main.py --plan). Rough seconds per request by kind, used to estimate runtime,
+# threads prefetching independent requests and tokens assumed for pools not in the local cache
+PLAN_REQUEST_LATENCY = {
+    "config": 0.3,
+    "subgraph": 0.8,
+    "gauge": 0.5,
+    "rpc_batch": 0.4,
+    "price": 0.6,
+}
+PLAN_MAX_WORKERS = 8
+PLAN_AVG_POOL_TOKENS = 3
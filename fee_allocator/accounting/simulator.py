@@ -0,0 +1,221 @@
+import argparse
+import contextlib
+import io
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+
+import pandas as pd
+import simplejson
+
+from fee_allocator.accounting import PROJECT_ROOT
+from fee_allocator.accounting.fee_pipeline import allocate_incentives
+from fee_allocator.accounting.settings import Chains
+
+# Parameters that can be varied between scenarios.
+# Fee constants come from the epoch inputs, aura_vebal_share is the measured veBAL share of Aura
+SCENARIO_PARAMS = [
+    "dao_share_pct",
+    "vebal_share_pct",
+    "min_aura_incentive",
+    "min_vote_incentive_amount",
+    "aura_vebal_share",
+]
+RESULT_FIELDS = [
+    "earned_fees",
+    "fees_to_dao",
+    "fees_to_vebal",
+    "total_incentives",
+    "aura_incentives",
+    "bal_incentives",
+    "redirected_incentives",
+    "reroute_incentives",
+]
+
+# Set once per worker process, so epoch inputs are not pickled with every scenario
+_EPOCH_INPUTS: Dict = {}
+
+
+def load_epoch_inputs(file_name: str) -> Dict:
+    """
+    Load allocation inputs stored by run_fees(epoch_inputs_file=...)
+    """
+    with open(file_name) as f:
+        return simplejson.load(f, use_decimal=True)
+
+
+def build_scenario_grid(epoch_inputs: Dict, grid: Dict[str, Sequence]) -> List[Dict]:
+    """
+    Cartesian product of the grid values. Parameters missing from the grid keep
+    the values of the epoch
+    """
+    unknown = set(grid) - set(SCENARIO_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown scenario parameters: {sorted(unknown)}")
+    base = {
+        **{
+            param: Decimal(epoch_inputs["fee_constants"][param])
+            for param in SCENARIO_PARAMS
+            if param != "aura_vebal_share"
+        },
+        "aura_vebal_share": Decimal(epoch_inputs["aura_vebal_share"]),
+    }
+    params = list(grid.keys())
+    return [
+        {**base, **dict(zip(params, [Decimal(value) for value in values]))}
+        for values in itertools.product(*[grid[param] for param in params])
+    ]
+
+
+def simulate_scenario(scenario_id: int, scenario: Dict) -> List[Dict]:
+    """
+    Run the allocation stage of every chain for one scenario.
+    Returns tidy rows, one per scenario and pool
+    """
+    epoch_inputs = _EPOCH_INPUTS
+    fee_constants = {
+        **epoch_inputs["fee_constants"],
+        **{
+            param: scenario[param]
+            for param in SCENARIO_PARAMS
+            if param != "aura_vebal_share"
+        },
+    }
+    rows = []
+    for chain in Chains:
+        chain_fees = epoch_inputs["collected_fees"].get(chain.value)
+        if not chain_fees:
+            continue
+        # Allocation logic is chatty, keep the simulator output readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            incentives = allocate_incentives(
+                chain,
+                chain_fees,
+                epoch_inputs["fees_to_distribute"][chain.value],
+                fee_constants,
+                scenario["aura_vebal_share"],
+                [],
+                {},
+                epoch_inputs["reroute_config"],
+                epoch_inputs["overrides"],
+            )
+        for pool_id, data in incentives.items():
+            rows.append(
+                {
+                    "scenario": scenario_id,
+                    **scenario,
+                    "chain": chain.value,
+                    "pool_id": pool_id,
+                    "symbol": data["symbol"],
+                    **{field: data[field] for field in RESULT_FIELDS},
+                }
+            )
+    return rows
+
+
+def _init_worker(epoch_inputs: Dict) -> None:
+    _EPOCH_INPUTS.clear()
+    _EPOCH_INPUTS.update(epoch_inputs)
+
+
+def _simulate_chunk(chunk: List) -> List[Dict]:
+    return [
+        row
+        for scenario_id, scenario in chunk
+        for row in simulate_scenario(scenario_id, scenario)
+    ]
+
+
+def run_simulation(
+    epoch_inputs: Dict,
+    scenarios: List[Dict],
+    processes: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Evaluate calc_and_split_incentives -> re_route_incentives -> re_distribute_incentives
+    -> filter_dusty_bal_incentives for all scenarios on a process pool.
+    Epoch inputs must hold the overrides config the epoch was allocated with
+    """
+    if "overrides" not in epoch_inputs:
+        raise ValueError(
+            "Epoch inputs have no overrides, store them again with main.py --epoch_inputs_file"
+        )
+    processes = processes or os.cpu_count() or 1
+    indexed = list(enumerate(scenarios))
+    # A few chunks per worker balance load without paying per scenario overhead
+    chunk_size = max(1, len(indexed) // (processes * 4))
+    chunks = [indexed[i : i + chunk_size] for i in range(0, len(indexed), chunk_size)]
+    rows = []
+    if processes == 1:
+        _init_worker(epoch_inputs)
+        for chunk in chunks:
+            rows.extend(_simulate_chunk(chunk))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=processes, initializer=_init_worker, initargs=(epoch_inputs,)
+        ) as executor:
+            for chunk_rows in executor.map(_simulate_chunk, chunks):
+                rows.extend(chunk_rows)
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "scenario",
+            *SCENARIO_PARAMS,
+            "chain",
+            "pool_id",
+            "symbol",
+            *RESULT_FIELDS,
+        ],
+    )
+
+
+def parse_grid(grid_args: List[str]) -> Dict[str, List[str]]:
+    """
+    Parse ["dao_share_pct=0.15,0.175", ...] into {"dao_share_pct": ["0.15", "0.175"], ...}
+    """
+    grid = {}
+    for grid_arg in grid_args:
+        param, _, values = grid_arg.partition("=")
+        grid[param] = [value for value in values.split(",") if value]
+    return grid
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Evaluate the allocation stage of one epoch for a grid of scenarios"
+    )
+    parser.add_argument(
+        "epoch_inputs_file", help="Json stored by main.py --epoch_inputs_file"
+    )
+    parser.add_argument(
+        "--grid",
+        nargs="+",
+        default=[],
+        help=f"Scenario values like dao_share_pct=0.15,0.175. Parameters: {', '.join(SCENARIO_PARAMS)}",
+    )
+    parser.add_argument(
+        "--output_file_name",
+        default="simulation.csv",
+        help="Results csv, stored in fee_allocator/allocations/simulations",
+    )
+    parser.add_argument("--processes", type=int, required=False)
+    args = parser.parse_args()
+
+    inputs = load_epoch_inputs(args.epoch_inputs_file)
+    scenario_grid = build_scenario_grid(inputs, parse_grid(args.grid))
+    results = run_simulation(inputs, scenario_grid, args.processes)
+    output_dir = os.path.join(PROJECT_ROOT, "fee_allocator/allocations/simulations")
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, args.output_file_name)
+    results.to_csv(output_path, index=False)
+    print(
+        results.groupby("scenario")[["aura_incentives", "bal_incentives"]]
+        .sum()
+        .to_string()
+    )
+    print(f"{len(scenario_grid)} scenarios written to {output_path}")
@@ -0,0 +1,247 @@
+"""
+Content-addressed pipeline stages.
+
+Every stage of the fee pipeline runs through run_stage. Memoized stages store their output in
+the local disk cache under a hash of the stage name and inputs, so a rerun only recomputes
+stages whose inputs changed. Outputs of upstream stages are inputs of downstream ones, so a
+config change invalidates the stage reading it and everything after it.
+Stage inputs and outputs have to be json serializable.
+
+Stages with a budget in STAGE_BUDGETS, or run under a Deadline, fail with StageDeadlineExceeded
+when they run out of time, unless they have a fallback, runs record which outputs came from
+a fallback. A stage that ran out of time can't be stopped and keeps running in a daemon thread,
+its disk cache writes and epoch boundaries are dropped from then on. Workers of executors
+the stage started still write, their keys name the block or range they were fetched for.
+
+Runs record wall and process CPU time and the thread that ran the stage, stages running
+right now are exposed to the sampling profiler, see fee_allocator.accounting.profiling.
+"""
+
+import hashlib
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import wait
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import simplejson
+
+from fee_allocator.accounting.logger import logger
+from fee_allocator.accounting.settings import STAGE_BUDGETS
+from fee_allocator.cache import disk_cache_get
+from fee_allocator.cache import disk_cache_set
+from fee_allocator.cache import set_thread_readonly
+
+# Stages run since the last reset, in order
+_RUNS: List[Dict] = []
+_RUNS_LOCK = threading.Lock()
+# Labels of stages running now, oldest first, and of the thread running each
+_ACTIVE: List[str] = []
+_THREAD_STAGES: Dict[int, str] = {}
+
+
+def stage_key(name: str, inputs: Dict) -> str:
+    """
+    Hash of the stage name and its inputs. Dict keys are sorted, so equal inputs hash equal
+    """
+    payload = simplejson.dumps(
+        [name, inputs], use_decimal=True, sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class StageDeadlineExceeded(Exception):
+    pass
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+class Deadline:
+    """
+    Time budget shared by several stages, e.g. every stage of a chain
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+
+def is_stage_cached(name: str, inputs: Dict) -> bool:
+    return disk_cache_get("stages", stage_key(name, inputs)) is not None
+
+
+def run_stage(
+    name: str,
+    inputs: Dict,
+    func: Callable[[], Any],
+    memoize: bool = True,
+    deadline: Optional[Deadline] = None,
+    fallback: Optional[Callable[[], Any]] = None,
+) -> Any:
+    """
+    Returns the stored output of the stage for these inputs, or func() stored under them.
+    Without memoize func() always runs and nothing is stored.
+    func() gets the budget of the stage in STAGE_BUDGETS, capped by the deadline. When it runs out,
+    the stage returns fallback(), or fails
+    """
+    started_at = time.time()
+    start = time.monotonic()
+    cpu_start = time.process_time()
+    label = stage_label(name, inputs)
+    thread = [threading.get_ident()]
+    output = None
+    key = stage_key(name, inputs) if memoize else None
+    if memoize:
+        output = disk_cache_get("stages", key)
+    cached = output is not None
+    from_fallback = False
+    if not cached:
+        budget = _budget(name, deadline)
+
+        def labeled():
+            thread[0] = threading.get_ident()
+            with _RUNS_LOCK:
+                previous = _THREAD_STAGES.get(thread[0])
+                _THREAD_STAGES[thread[0]] = label
+            try:
+                return func()
+            finally:
+                with _RUNS_LOCK:
+                    if previous is None:
+                        _THREAD_STAGES.pop(thread[0], None)
+                    else:
+                        _THREAD_STAGES[thread[0]] = previous
+
+        with _RUNS_LOCK:
+            _ACTIVE.append(label)
+        try:
+            output = _call_with_budget(labeled, budget)
+        except _OutOfTime:
+            if fallback is not None:
+                output = fallback()
+            if output is None:
+                raise StageDeadlineExceeded(
+                    f"Stage {name} ({inputs.get('chain', 'all chains')}) ran out of its "
+                    f"{budget:.0f}s budget and has no fallback"
+                )
+            from_fallback = True
+            logger.warning(f"Stage {name} ran out of time, using its fallback value")
+        else:
+            if memoize:
+                disk_cache_set("stages", key, output)
+        finally:
+            with _RUNS_LOCK:
+                _ACTIVE.remove(label)
+    with _RUNS_LOCK:
+        _RUNS.append(
+            {
+                "stage": name,
+                "chain": inputs.get("chain"),
+                "key": key,
+                "cached": cached,
+                "fallback": from_fallback,
+                "seconds": time.monotonic() - start,
+                "cpu_seconds": time.process_time() - cpu_start,
+                "started_at": started_at,
+                "thread": thread[0],
+            }
+        )
+    return output
+
+
+def stage_label(name: str, inputs: Dict) -> str:
+    chain = inputs.get("chain")
+    return f"{name}:{chain}" if chain else name
+
+
+def running_stage(thread_id: int) -> Optional[str]:
+    """
+    Label of the stage the thread runs, or of the latest stage started when the thread runs
+    none, e.g. a worker of an executor the stage started. None outside of stages
+    """
+    with _RUNS_LOCK:
+        return _THREAD_STAGES.get(thread_id) or (_ACTIVE[-1] if _ACTIVE else None)
+
+
+def _budget(name: str, deadline: Optional[Deadline]) -> Optional[float]:
+    """
+    Seconds left for the stage, None when it has no budget
+    """
+    budgets = [STAGE_BUDGETS.get(name)]
+    if deadline is not None:
+        budgets.append(deadline.remaining())
+    budgets = [budget for budget in budgets if budget is not None]
+    return min(budgets) if budgets else None
+
+
+def _call_with_budget(func: Callable[[], Any], budget: Optional[float]) -> Any:
+    """
+    Returns func(), raises _OutOfTime when it doesn't return within budget seconds.
+    A call that ran out of time is left running in a daemon thread, so it can't block exit,
+    and its disk cache writes are dropped
+    """
+    if budget is None:
+        return func()
+    result = Future()
+    lock = threading.Lock()
+    finished = [False]
+
+    def call():
+        try:
+            result.set_result(func())
+        except BaseException as e:
+            result.set_exception(e)
+        finally:
+            with lock:
+                finished[0] = True
+                set_thread_readonly(threading.get_ident(), False)
+
+    thread = threading.Thread(target=call, daemon=True)
+    thread.start()
+    if not wait([result], timeout=budget).done:
+        with lock:
+            # A finished thread's id may be reused by a new thread
+            if not finished[0]:
+                set_thread_readonly(thread.ident, True)
+        raise _OutOfTime()
+    return result.result()
+
+
+def reset_stages() -> None:
+    """
+    Forget stages run by the previous run
+    """
+    with _RUNS_LOCK:
+        _RUNS.clear()
+
+
+def stage_runs() -> List[Dict]:
+    with _RUNS_LOCK:
+        return list(_RUNS)
+
+
+def stages_report() -> Dict[str, Dict]:
+    """
+    Returns runs, cached runs, fallbacks, total wall and CPU seconds per stage since the last reset
+    """
+    report = {}
+    for run in stage_runs():
+        stage = report.setdefault(
+            run["stage"],
+            {"runs": 0, "cached": 0, "fallbacks": 0, "seconds": 0, "cpu_seconds": 0},
+        )
+        stage["runs"] += 1
+        stage["cached"] += run["cached"]
+        stage["fallbacks"] += run["fallback"]
+        stage["seconds"] = round(stage["seconds"] + run["seconds"], 3)
+        stage["cpu_seconds"] = round(stage["cpu_seconds"] + run["cpu_seconds"], 3)
+    return report
@@ -0,0 +1,171 @@
+import argparse
+import fcntl
+import os
+from contextlib import contextmanager
+from typing import Dict
+from typing import Iterator
+from typing import List
+
+import simplejson as json
+
+from fee_allocator.accounting import PROJECT_ROOT
+
+SUMMARIES_DIR = os.path.join(PROJECT_ROOT, "fee_allocator/summaries")
+RECON_JSONL_PATH = os.path.join(SUMMARIES_DIR, "recon.jsonl")
+RECON_INDEX_PATH = os.path.join(SUMMARIES_DIR, "recon.index.json")
+RECON_JSON_PATH = os.path.join(SUMMARIES_DIR, "recon.json")
+
+
+def _period_key(period_start: int, period_end: int) -> str:
+    return f"{int(period_start)}:{int(period_end)}"
+
+
+class ReconSummaryStore:
+    """
+    Append-only store for recon summaries.
+
+    Summaries are stored one per line in a JSON Lines file. A sidecar index maps
+    "periodStart:periodEnd" to the byte offset of the line, so duplicate detection
+    doesn't need to read the summaries themselves. The index also records the size
+    of the JSON Lines file it covers and is rebuilt whenever the two disagree
+    (interrupted append, manual edit, merge conflict resolution, etc.) or when it is
+    missing, so it is not tracked in git
+    """
+
+    def __init__(
+        self,
+        path: str = RECON_JSONL_PATH,
+        index_path: str = RECON_INDEX_PATH,
+        legacy_path: str = RECON_JSON_PATH,
+    ):
+        self.path = path
+        self.index_path = index_path
+        self.legacy_path = legacy_path
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        # Lock a sidecar file, the store itself may not exist yet
+        with open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Seed the store from the legacy json file on first use
+                if not os.path.exists(self.path):
+                    self._import_legacy()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _import_legacy(self) -> None:
+        summaries = []
+        if os.path.exists(self.legacy_path):
+            with open(self.legacy_path) as f:
+                summaries = json.load(f, use_decimal=True)
+        lines = "".join(
+            json.dumps(summary, use_decimal=True) + "\n" for summary in summaries
+        )
+        _atomic_write(self.path, lines)
+
+    def _load_index(self) -> Dict[str, int]:
+        size = os.path.getsize(self.path)
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            if index.get("size") == size:
+                return index["periods"]
+        return self._rebuild_index()
+
+    def _rebuild_index(self) -> Dict[str, int]:
+        periods = {}
+        offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    summary = json.loads(line)
+                    periods[
+                        _period_key(summary["periodStart"], summary["periodEnd"])
+                    ] = offset
+                offset += len(line)
+        self._save_index(periods, offset)
+        return periods
+
+    def _save_index(self, periods: Dict[str, int], size: int) -> None:
+        _atomic_write(
+            self.index_path,
+            json.dumps({"size": size, "periods": periods}, indent=2, sort_keys=True),
+        )
+
+    def contains(self, period_start: int, period_end: int) -> bool:
+        with self._locked():
+            return _period_key(period_start, period_end) in self._load_index()
+
+    def append(self, summary: Dict) -> bool:
+        """
+        Append summary to the store. Returns False if summary for the same period
+        is already stored
+        """
+        key = _period_key(summary["periodStart"], summary["periodEnd"])
+        line = (json.dumps(summary, use_decimal=True) + "\n").encode()
+        with self._locked():
+            periods = self._load_index()
+            if key in periods:
+                return False
+            offset = os.path.getsize(self.path)
+            # Single O_APPEND write so a reader never sees a half written summary
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+            try:
+                os.write(fd, line)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            periods[key] = offset
+            self._save_index(periods, offset + len(line))
+        return True
+
+    def get(self, period_start: int, period_end: int) -> Dict:
+        with self._locked():
+            offset = self._load_index()[_period_key(period_start, period_end)]
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                return json.loads(f.readline(), use_decimal=True)
+
+    def load_all(self) -> List[Dict]:
+        with self._locked():
+            with open(self.path) as f:
+                return [
+                    json.loads(line, use_decimal=True) for line in f if line.strip()
+                ]
+
+    def compact(self) -> str:
+        """
+        Regenerate legacy recon.json from the store for consumers that still read it
+        """
+        summaries = self.load_all()
+        _atomic_write(
+            self.legacy_path, json.dumps(summaries, use_decimal=True, indent=2)
+        )
+        return self.legacy_path
+
+
+def _atomic_write(path: str, content: str) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recon summary store maintenance")
+    parser.add_argument(
+        "command",
+        choices=["compact", "reindex"],
+        help="compact: regenerate legacy recon.json, reindex: rebuild sidecar index",
+    )
+    args = parser.parse_args()
+    store = ReconSummaryStore()
+    if args.command == "compact":
+        print(f"Wrote {store.compact()}")
+    else:
+        with store._locked():
+            print(f"Indexed {len(store._rebuild_index())} summaries")
@@ -0,0 +1,202 @@
+import functools
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+import simplejson
+
+from fee_allocator.accounting.settings import CACHE_DIR
+
+
+def ttl_cache(ttl: float) -> Callable:
+    """
+    Memoize function results for ttl seconds, keyed by call arguments.
+    Meant for data that changes slowly (configs, prices, gauges) and is reused
+    by long running processes. Use cache_clear() to drop all entries
+    """
+
+    def decorator(func: Callable) -> Callable:
+        entries: Dict[Hashable, Tuple[float, object]] = {}
+        lock = threading.Lock()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            with lock:
+                entry = entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < ttl:
+                return entry[1]
+            value = func(*args, **kwargs)
+            with lock:
+                entries[key] = (time.monotonic(), value)
+            return value
+
+        def cache_clear() -> None:
+            with lock:
+                entries.clear()
+
+        wrapper.cache_clear = cache_clear
+        wrapper.cache_size = lambda: len(entries)
+        return wrapper
+
+    return decorator
+
+
+class SingleFlight:
+    """
+    Merges concurrent identical requests into one call and memoizes completed ones until reset.
+    Requests are keyed by endpoint and request, failed calls are not memoized
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results: Dict[Hashable, Future] = {}
+        self._calls: Dict[str, int] = {}
+        self._saved: Dict[str, int] = {}
+
+    def call(self, endpoint: str, request: Hashable, func: Callable) -> Any:
+        key = (endpoint, request)
+        with self._lock:
+            result = self._results.get(key)
+            is_owner = result is None
+            if is_owner:
+                result = self._results[key] = Future()
+                self._calls[endpoint] = self._calls.get(endpoint, 0) + 1
+            else:
+                self._saved[endpoint] = self._saved.get(endpoint, 0) + 1
+        if not is_owner:
+            return result.result()
+        try:
+            value = func()
+        except BaseException as e:
+            with self._lock:
+                self._results.pop(key, None)
+            result.set_exception(e)
+            raise
+        result.set_result(value)
+        return value
+
+    def reset(self) -> None:
+        with self._lock:
+            self._results.clear()
+            self._calls.clear()
+            self._saved.clear()
+
+    def report(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns calls made and calls saved per endpoint since the last reset
+        """
+        with self._lock:
+            return {
+                endpoint: {"calls": calls, "saved": self._saved.get(endpoint, 0)}
+                for endpoint, calls in self._calls.items()
+            }
+
+
+_SINGLE_FLIGHT = SingleFlight()
+
+
+def single_flight(endpoint: str, key: Optional[Callable] = None) -> Callable:
+    """
+    Coalesce calls of the function for the run. Requests are keyed by call arguments,
+    or by key(*args, **kwargs) when arguments hold clients that don't identify the request
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if key is None:
+                request = (args, tuple(sorted(kwargs.items())))
+            else:
+                request = key(*args, **kwargs)
+            return _SINGLE_FLIGHT.call(endpoint, request, lambda: func(*args, **kwargs))
+
+        return wrapper
+
+    return decorator
+
+
+def reset_single_flight() -> None:
+    """
+    Forget requests of the previous run
+    """
+    _SINGLE_FLIGHT.reset()
+
+
+def single_flight_report() -> Dict[str, Dict[str, int]]:
+    return _SINGLE_FLIGHT.report()
+
+
+# Threads whose disk cache writes are dropped, see fee_allocator.accounting.stages
+_READONLY_THREADS: Set[int] = set()
+
+
+def set_thread_readonly(thread_id: int, readonly: bool) -> None:
+    if readonly:
+        _READONLY_THREADS.add(thread_id)
+    else:
+        _READONLY_THREADS.discard(thread_id)
+
+
+def is_thread_readonly() -> bool:
+    return threading.get_ident() in _READONLY_THREADS
+
+
+def _disk_cache_path(namespace: str, key: str) -> str:
+    file_name = hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join(CACHE_DIR, namespace, f"{file_name}.json")
+
+
+def disk_cache_get(namespace: str, key: str) -> Optional[Any]:
+    """
+    Returns value stored in the local disk cache or None. Decimals are kept as Decimal
+    """
+    try:
+        with open(_disk_cache_path(namespace, key)) as f:
+            return simplejson.load(f, use_decimal=True)["value"]
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+
+def disk_cache_set(namespace: str, key: str, value: Any) -> None:
+    """
+    Store json serializable value in the local disk cache. Writes are atomic,
+    so concurrent readers never see partial files. Writes of readonly threads are dropped
+    """
+    if is_thread_readonly():
+        return
+    path = _disk_cache_path(namespace, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            simplejson.dump({"value": value}, f, use_decimal=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def prune_disk_cache(max_age_seconds: float) -> int:
+    """
+    Delete cache files not written for max_age_seconds. Returns number of deleted files
+    """
+    deleted = 0
+    oldest = time.time() - max_age_seconds
+    for root, _, files in os.walk(CACHE_DIR):
+        for file_name in files:
+            path = os.path.join(root, file_name)
+            if os.path.getmtime(path) < oldest:
+                os.unlink(path)
+                deleted += 1
+    return deleted
@@ -0,0 +1,188 @@
+"""
+Endpoint groups for hedged requests.
+
+A group holds endpoints serving the same data (RPC nodes of a chain, subgraph gateways).
+Requests go to the fastest healthy endpoint. When it doesn't answer within its p95 latency,
+a hedged duplicate is sent to the next endpoint and the first answer wins. Requests are reads
+at fixed blocks, so any endpoint returns the same result.
+"""
+
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+
+from fee_allocator.accounting.settings import ENDPOINT_COOLDOWN
+from fee_allocator.accounting.settings import ENDPOINT_LATENCY_WINDOW
+from fee_allocator.accounting.settings import ENDPOINT_MAX_WORKERS
+from fee_allocator.accounting.settings import HEDGE_MIN_SAMPLES
+from fee_allocator.accounting.settings import HEDGE_PERCENTILE
+
+# Groups keyed by their primary url
+_GROUPS: Dict[str, "EndpointGroup"] = {}
+_GROUPS_LOCK = threading.Lock()
+# Requests of groups with more than one endpoint run here, so a slow one can be hedged
+_EXECUTOR = ThreadPoolExecutor(
+    max_workers=ENDPOINT_MAX_WORKERS, thread_name_prefix="endpoint"
+)
+
+
+class EndpointGroup:
+    """
+    Endpoints serving the same data. The first url is the primary one, groups with a single
+    endpoint call it directly
+    """
+
+    def __init__(self, urls: Sequence[str]):
+        self.urls = list(dict.fromkeys(urls))
+        self.hedged = 0
+        self._lock = threading.Lock()
+        self._latencies = {
+            url: deque(maxlen=ENDPOINT_LATENCY_WINDOW) for url in self.urls
+        }
+        self._failures = {url: 0 for url in self.urls}
+        self._failed_at: Dict[str, float] = {}
+
+    def percentile(self, url: str, percentile: float) -> Optional[float]:
+        """
+        Latency percentile of the endpoint in seconds, None until it has HEDGE_MIN_SAMPLES
+        """
+        with self._lock:
+            latencies = sorted(self._latencies[url])
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[
+            min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        ]
+
+    def ranked(self) -> List[str]:
+        """
+        Healthy endpoints, fastest median latency first. Endpoints without samples go first,
+        so every endpoint gets measured. When all endpoints failed recently, all are tried
+        """
+        now = time.monotonic()
+        with self._lock:
+            healthy = [
+                url
+                for url in self.urls
+                if url not in self._failed_at
+                or now - self._failed_at[url] >= ENDPOINT_COOLDOWN
+            ] or list(self.urls)
+            medians = {
+                url: (
+                    statistics.median(self._latencies[url])
+                    if self._latencies[url]
+                    else 0.0
+                )
+                for url in healthy
+            }
+        return sorted(healthy, key=lambda url: medians[url])
+
+    def request(self, func: Callable[[str], Any]) -> Any:
+        """
+        Returns func(url) of the first endpoint that answers. A hedged duplicate goes to the next
+        endpoint when the first one is slower than its p95 latency, failed requests fail over
+        """
+        if len(self.urls) == 1:
+            return func(self.urls[0])
+        ranked = self.ranked()
+        backups = iter(ranked[1:])
+        pending = {_EXECUTOR.submit(self._timed, ranked[0], func)}
+        hedge_delay = self.percentile(ranked[0], HEDGE_PERCENTILE)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(
+                pending, timeout=hedge_delay, return_when=FIRST_COMPLETED
+            )
+            # Only one hedge per request, after that wait for the first answer
+            hedge_delay = None
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+            # Hedge a slow request, or fail over when all requests failed
+            if not done or not pending:
+                backup = next(backups, None)
+                if backup is None:
+                    continue
+                if not done:
+                    with self._lock:
+                        self.hedged += 1
+                pending.add(_EXECUTOR.submit(self._timed, backup, func))
+        raise error
+
+    def report(self) -> Dict[str, Dict]:
+        """
+        Returns requests, failures and p50/p95 latencies per endpoint
+        """
+        with self._lock:
+            latencies = {url: sorted(self._latencies[url]) for url in self.urls}
+            failures = dict(self._failures)
+        return {
+            url: {
+                "requests": len(latencies[url]) + failures[url],
+                "failures": failures[url],
+                "p50": (
+                    round(statistics.median(latencies[url]), 3)
+                    if latencies[url]
+                    else None
+                ),
+                "p95": (
+                    round(
+                        latencies[url][
+                            int(len(latencies[url]) * HEDGE_PERCENTILE / 100)
+                        ],
+                        3,
+                    )
+                    if latencies[url]
+                    else None
+                ),
+            }
+            for url in self.urls
+        }
+
+    def _timed(self, url: str, func: Callable[[str], Any]) -> Any:
+        start = time.monotonic()
+        try:
+            result = func(url)
+        except Exception:
+            with self._lock:
+                self._failures[url] += 1
+                self._failed_at[url] = time.monotonic()
+            raise
+        with self._lock:
+            self._latencies[url].append(time.monotonic() - start)
+            self._failed_at.pop(url, None)
+        return result
+
+
+def get_endpoint_group(url: str, fallback_urls: Sequence[str] = ()) -> EndpointGroup:
+    """
+    Returns the group of endpoints with url as primary. Fallback urls are added
+    when the group is created
+    """
+    with _GROUPS_LOCK:
+        if url not in _GROUPS:
+            _GROUPS[url] = EndpointGroup([url, *fallback_urls])
+        return _GROUPS[url]
+
+
+def endpoints_report() -> Dict[str, Dict]:
+    """
+    Returns hedged requests and endpoint stats of groups with more than one endpoint
+    """
+    with _GROUPS_LOCK:
+        groups = [group for group in _GROUPS.values() if len(group.urls) > 1]
+    return {
+        group.urls[0]: {"hedged": group.hedged, "endpoints": group.report()}
+        for group in groups
+    }
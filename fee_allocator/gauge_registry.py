@@ -0,0 +1,174 @@
+"""
+Persisted registry of voting list gauges.
+
+The registry is built from veBalGetVotingList and stored in the local disk cache with checksummed
+gauge and pool addresses and pool to gauge indexes. A refresh diffs the fresh list against the
+stored one and only checksums entries that were added or changed, an unchanged list is detected
+by its hash and reuses the stored registry as is.
+"""
+
+import hashlib
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import simplejson
+from web3 import Web3
+
+from fee_allocator.accounting.logger import logger
+from fee_allocator.accounting.stages import run_stage
+from fee_allocator.accounting.settings import GAUGE_CACHE_TTL
+from fee_allocator.cache import disk_cache_get
+from fee_allocator.cache import disk_cache_set
+from fee_allocator.cache import ttl_cache
+from fee_allocator.helpers import fetch_all_pools_info
+
+_CACHE_KEY = "voting_list"
+
+
+def _entry(pool: Dict) -> Dict:
+    """
+    Fields of a voting list pool the registry keeps
+    """
+    return {
+        "address": pool["address"],
+        "chain": pool["chain"],
+        "symbol": pool["symbol"],
+        "gauge": pool["gauge"]["address"],
+        "is_killed": pool["gauge"]["isKilled"],
+    }
+
+
+def _list_hash(voting_list: List[Dict]) -> str:
+    payload = simplejson.dumps(voting_list, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class GaugeRegistry:
+    """
+    Voting list pools by pool id, with checksummed addresses and pool <-> gauge indexes
+    """
+
+    def __init__(self, entries: Dict[str, Dict], checksums: Dict[str, str]):
+        self.entries = entries
+        # Lowercase address to checksummed address
+        self.checksums = checksums
+        # Pools of alive gauges to their checksummed root gauge
+        self.pool_to_gauge = {
+            pool_id: checksums[entry["gauge"].lower()]
+            for pool_id, entry in entries.items()
+            if not entry["is_killed"]
+        }
+        self.gauge_to_pool = {
+            checksums[entry["gauge"].lower()]: pool_id
+            for pool_id, entry in entries.items()
+        }
+
+    def checksum(self, address: str) -> str:
+        """
+        Checksummed address, hashed only for addresses the registry doesn't know
+        """
+        checksummed = self.checksums.get(address.lower())
+        if checksummed is None:
+            checksummed = Web3.to_checksum_address(address)
+            self.checksums[address.lower()] = checksummed
+        return checksummed
+
+    def gauge(self, pool_id: str) -> Optional[str]:
+        return self.pool_to_gauge.get(pool_id)
+
+    def pool(self, gauge: str) -> Optional[str]:
+        return self.gauge_to_pool.get(self.checksum(gauge))
+
+    def killed(self) -> List[str]:
+        return [
+            pool_id for pool_id, entry in self.entries.items() if entry["is_killed"]
+        ]
+
+    def to_dict(self) -> Dict:
+        return {"entries": self.entries, "checksums": self.checksums}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "GaugeRegistry":
+        return cls(data["entries"], data["checksums"])
+
+
+def diff_voting_list(stored: Dict[str, Dict], fresh: Dict[str, Dict]) -> Dict:
+    """
+    Pool ids added, removed and changed between two versions of registry entries
+    """
+    return {
+        "added": [pool_id for pool_id in fresh if pool_id not in stored],
+        "removed": [pool_id for pool_id in stored if pool_id not in fresh],
+        "changed": [
+            pool_id
+            for pool_id, entry in fresh.items()
+            if pool_id in stored and stored[pool_id] != entry
+        ],
+    }
+
+
+def build_gauge_registry(
+    voting_list: List[Dict], stored: Optional[GaugeRegistry] = None
+) -> GaugeRegistry:
+    """
+    Registry of the voting list, reusing checksums of entries unchanged since stored
+    """
+    entries = {pool["id"]: _entry(pool) for pool in voting_list}
+    stored_entries = stored.entries if stored is not None else {}
+    diff = diff_voting_list(stored_entries, entries)
+    checksums = {}
+    for pool_id, entry in entries.items():
+        for address in (entry["address"], entry["gauge"]):
+            if stored is not None and address.lower() in stored.checksums:
+                checksums[address.lower()] = stored.checksums[address.lower()]
+            else:
+                checksums[address.lower()] = Web3.to_checksum_address(address)
+    if stored is not None:
+        logger.info(
+            f"Gauge registry: {len(diff['added'])} added, {len(diff['removed'])} removed, "
+            f"{len(diff['changed'])} changed"
+        )
+    return GaugeRegistry(entries, checksums)
+
+
+def load_stored_gauge_registry() -> Optional[GaugeRegistry]:
+    """
+    Registry stored by the last refresh, None when there is none
+    """
+    stored = disk_cache_get("gauges", _CACHE_KEY)
+    return GaugeRegistry.from_dict(stored["registry"]) if stored is not None else None
+
+
+def refresh_gauge_registry() -> GaugeRegistry:
+    """
+    Fetches the voting list and updates the stored registry with its diff
+    """
+    voting_list = fetch_all_pools_info()
+    list_hash = _list_hash(voting_list)
+    stored = disk_cache_get("gauges", _CACHE_KEY)
+    if stored is not None and stored["hash"] == list_hash:
+        return GaugeRegistry.from_dict(stored["registry"])
+    registry = build_gauge_registry(
+        voting_list,
+        GaugeRegistry.from_dict(stored["registry"]) if stored is not None else None,
+    )
+    disk_cache_set(
+        "gauges", _CACHE_KEY, {"hash": list_hash, "registry": registry.to_dict()}
+    )
+    return registry
+
+
+@ttl_cache(GAUGE_CACHE_TTL)
+def get_gauge_registry() -> GaugeRegistry:
+    """
+    Gauge registry shared by the fee pipeline, recon and the tx builder.
+    When the refresh runs out of its stage budget the stored registry is used
+    """
+    return run_stage(
+        "gauge_registry",
+        {},
+        refresh_gauge_registry,
+        False,
+        fallback=load_stored_gauge_registry,
+    )
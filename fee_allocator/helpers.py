@@ -1,24 +1,46 @@
 import json
 import logging
 import os
+import time
 from dataclasses import dataclass
 from datetime import datetime
 from datetime import timedelta
 from decimal import Decimal
+from functools import lru_cache
 from typing import Dict
 from typing import List
 from typing import Optional
+from typing import Tuple
 from typing import Union
 
+import ijson
 import requests
+from bal_tools import BalPoolsGauges
 from bal_tools import Subgraph
 from gql import Client
 from gql import gql
 from gql.transport.requests import RequestsHTTPTransport
 from gql.transport.requests import log
 from web3 import Web3
+from web3.contract import Contract
 from web3.exceptions import BadFunctionCallOutput
 
+from fee_allocator.accounting.settings import GAUGE_CACHE_TTL
+from fee_allocator.accounting.settings import HTTP_TIMEOUT
+from fee_allocator.accounting.settings import PRICE_CACHE_TTL
+from fee_allocator.accounting.settings import PRICE_HISTORY_RANGES
+from fee_allocator.accounting.settings import SUBGRAPH_URLS
+from fee_allocator.cache import disk_cache_get
+from fee_allocator.cache import disk_cache_set
+from fee_allocator.cache import single_flight
+from fee_allocator.cache import ttl_cache
+from fee_allocator.endpoints import get_endpoint_group
+from fee_allocator.rpc import BatchCaller
+from fee_allocator.rpc import get_pooled_session
+from fee_allocator.snapshots import PoolSnapshot
+from fee_allocator.snapshots import SnapshotDecoder
+from fee_allocator.snapshots import add_snapshot
+
 log.setLevel(logging.ERROR)
 
 
@@ -46,6 +68,8 @@ BAL_DEFAULT_HEADERS = {
     "x-graphql-client-name": "Maxis",
     "x-graphql-client-version": "protocol_fee_allocator",
 }
+# Blocks are looked up within this many seconds around a timestamp
+BLOCK_SEARCH_WINDOW = 200
 BLOCKS_QUERY = """
 query {{
     blocks(where:{{timestamp_gt: {ts_gt}, timestamp_lt: {ts_lt} }}) {{
@@ -56,7 +80,7 @@ query {{
 """
 BAL_GQL_QUERY = """
 query {{
-  tokenGetHistoricalPrices(addresses:["{token_addr}"], range: NINETY_DAY, chain: {upper_chain_name})
+  tokenGetHistoricalPrices(addresses:["{token_addr}"], range: {history_range}, chain: {upper_chain_name})
    {{
     prices {{
         price
@@ -82,20 +106,52 @@ POOLS_SNAPSHOTS_QUERY = """
       symbol
       totalProtocolFeePaidInBPT
       tokens {{
-        symbol
         address
         paidProtocolFees
       }}
     }}
     timestamp
-    protocolFee
-    swapFees
-    swapVolume
-    liquidity
   }}
 }}
 """
 
+SUBGRAPH_META_QUERY = """
+{
+  _meta {
+    block {
+      number
+      timestamp
+    }
+  }
+}
+"""
+
+INDEXED_BLOCK_QUERY = """
+{{
+  blocks(where: {{number: {number}}}) {{
+    timestamp
+  }}
+}}
+"""
+
+PREFERENTIAL_GAUGES_QUERY = """
+{{
+  pools(first: 1000, where: {{poolId_in: [{pool_ids}]}}) {{
+    poolId
+    preferentialGauge {{
+      isKilled
+    }}
+  }}
+}}
+"""
+
+LAST_JOIN_EXIT_QUERY = """
+{{
+  joinExits(first: 1, orderBy: timestamp, orderDirection: desc, where: {{pool: "{pool_id}"}}) {{
+    timestamp
+  }}
+}}
+"""
 
 BAL_GET_VOTING_LIST_QUERY = """
 query VeBalGetVotingList {
@@ -150,30 +206,80 @@ BALANCER_CONTRACTS = {
 HH_AURA_URL = "https://api.hiddenhand.finance/proposal/aura"
 
 
+VE_BAL_ADDRESS = "0xC128a9954e6c874eA3d62ce62B468bA073093F25"
+AURA_VE_BAL_HOLDER_ADDRESS = "0xaF52695E1bB01A16D33D7194C28C42b10e0Dbec2"
+
+# Process-wide cache of bound contracts keyed by (chain, checksum address, abi name)
+_CONTRACTS: Dict[Tuple[str, str, str], Contract] = {}
+# Token (decimals, name, symbol) keyed by (chain, checksum address). Token metadata never changes
+_TOKEN_METADATA: Dict[Tuple[str, str], Tuple[int, str, str]] = {}
+
+
+@lru_cache(maxsize=None)
 def get_abi(contract_name: str) -> Union[Dict, List[Dict]]:
+    """
+    Returns parsed abi. Abis are read from disk once per process, don't mutate the result
+    """
     project_root_dir = os.path.abspath(os.path.dirname(__file__))
     with open(f"{project_root_dir}/abi/{contract_name}.json") as f:
         return json.load(f)
 
 
+def get_contract(web3: Web3, chain: str, address: str, abi_name: str) -> Contract:
+    """
+    Returns a bound contract, reused across calls for the same chain, address and abi
+    """
+    key = (chain, Web3.to_checksum_address(address), abi_name)
+    contract = _CONTRACTS.get(key)
+    # Rebind if the contract was built for another web3 instance
+    if contract is None or contract.w3 is not web3:
+        contract = web3.eth.contract(address=key[1], abi=get_abi(abi_name))
+        _CONTRACTS[key] = contract
+    return contract
+
+
 # TODO: Improve block searching precision
+@single_flight(
+    "blocks", key=lambda timestamp, chain: (chain, clamp_block_timestamp(timestamp))
+)
 def get_block_by_ts(timestamp: int, chain: str) -> int:
     """
     Returns block number for a given timestamp
     """
+    return _get_block_by_ts(clamp_block_timestamp(timestamp), chain)
+
+
+def clamp_block_timestamp(timestamp: int) -> int:
+    """
+    Timestamps in the future are moved to a bit before now, where blocks are indexed
+    """
     if timestamp > int(datetime.now().strftime("%s")):
         timestamp = int(datetime.now().strftime("%s")) - 2000
+    return timestamp
+
+
+@lru_cache(maxsize=4096)
+def _get_block_by_ts(timestamp: int, chain: str) -> int:
+    """
+    Blocks subgraph lookup. Timestamps are in the past, so results are cached for the process
+    and in the local disk cache
+    """
+    cache_key = f"{chain}:{timestamp}"
+    cached_block = disk_cache_get("blocks", cache_key)
+    if cached_block is not None:
+        return cached_block
     transport = RequestsHTTPTransport(
-        url=Subgraph(chain).get_subgraph_url("blocks"),
+        url=get_blocks_subgraph_url(chain),
         retries=3,
         retry_backoff_factor=0.5,
         retry_status_forcelist=[429, 500, 502, 503, 504, 520],
+        timeout=HTTP_TIMEOUT,
         headers=BAL_DEFAULT_HEADERS,
     )
     query = gql(
         BLOCKS_QUERY.format(
-            ts_gt=timestamp - 200,
-            ts_lt=timestamp + 200,
+            ts_gt=timestamp - BLOCK_SEARCH_WINDOW,
+            ts_lt=timestamp + BLOCK_SEARCH_WINDOW,
         )
     )
     client = Client(transport=transport, fetch_schema_from_transport=True)
@@ -184,8 +290,10 @@ def get_block_by_ts(timestamp: int, chain: str) -> int:
         print(
             f"Warning:  Can't find any blocks around timestamp {timestamp}, trying 5 minutes sooner."
         )
-        return get_block_by_ts(timestamp - 15 * 60, chain)
-    return int(result["blocks"][0]["number"])
+        return _get_block_by_ts(timestamp - 15 * 60, chain)
+    block = int(result["blocks"][0]["number"])
+    disk_cache_set("blocks", cache_key, block)
+    return block
 
 
 def get_twap_bpt_price(
@@ -200,48 +308,233 @@ def get_twap_bpt_price(
     BPT dollar price equals to Sum of all underlying ERC20 tokens in the Balancer pool divided by
     total supply of BPT token
     """
-    balancer_vault = web3.eth.contract(
-        address=web3.to_checksum_address(
-            BALANCER_CONTRACTS[chain]["BALANCER_VAULT_ADDRESS"]
-        ),
-        abi=get_abi("BalancerVault"),
+    return get_twap_bpt_prices(
+        [balancer_pool_id],
+        chain,
+        web3,
+        int(start_date.timestamp()),
+        int(end_date.timestamp()),
+        block_number or web3.eth.block_number,
+    )[balancer_pool_id]
+
+
+def get_pools_tokens(web3: Web3, chain: str, pool_ids: List[str]) -> List[str]:
+    """
+    Returns unique tokens of all pools, read in one batch. Tokens of every pool are kept
+    in the local cache for the fetch planner
+    """
+    balancer_vault = get_contract(
+        web3,
+        chain,
+        BALANCER_CONTRACTS[chain]["BALANCER_VAULT_ADDRESS"],
+        "BalancerVault",
     )
-    balancer_pool_address, _ = balancer_vault.functions.getPool(balancer_pool_id).call()
-    weighed_pool_contract = web3.eth.contract(
-        address=web3.to_checksum_address(balancer_pool_address),
-        abi=get_abi("WeighedPool"),
+    batch = BatchCaller(web3)
+    for pool_id in pool_ids:
+        batch.add(balancer_vault.functions.getPoolTokens(pool_id))
+    unique_tokens = {}
+    for pool_id, (tokens, _, _) in zip(pool_ids, batch.execute()):
+        disk_cache_set("pool_tokens", f"{chain}:{pool_id}", list(tokens))
+        unique_tokens.update(dict.fromkeys(tokens))
+    return list(unique_tokens)
+
+
+def get_pools_state(
+    web3: Web3, chain: str, balancer_pool_ids: List[str], block_numbers: List[int]
+) -> Dict[int, Dict[str, Optional[List]]]:
+    """
+    [BPT decimals, BPT supply, tokens, balances] of pools at every block, keyed by block and
+    pool id, None before a pool was created. States are kept in the local disk cache, reads of
+    the missing ones are sent in two batches: pool addresses, then decimals and
+    tokens, balances and supply at every block
+    """
+    states = {block_number: {} for block_number in block_numbers}
+    missing = []
+    for block_number in states:
+        for pool_id in balancer_pool_ids:
+            cached = disk_cache_get("pool_state", f"{chain}:{pool_id}:{block_number}")
+            if cached is None:
+                missing.append((block_number, pool_id))
+            else:
+                states[block_number][pool_id] = cached["state"]
+    if not missing:
+        return states
+    missing_pools = list(dict.fromkeys(pool_id for _, pool_id in missing))
+    balancer_vault = get_contract(
+        web3,
+        chain,
+        BALANCER_CONTRACTS[chain]["BALANCER_VAULT_ADDRESS"],
+        "BalancerVault",
     )
-    decimals = weighed_pool_contract.functions.decimals().call()
-    try:
-        total_supply = Decimal(
-            weighed_pool_contract.functions.totalSupply().call(
-                block_identifier=block_number
-            )
-            / 10**decimals
+    batch = BatchCaller(web3)
+    for pool_id in missing_pools:
+        batch.add(balancer_vault.functions.getPool(pool_id))
+    pool_contracts = {
+        pool_id: get_contract(web3, chain, pool_address, "WeighedPool")
+        for pool_id, (pool_address, _) in zip(missing_pools, batch.execute())
+    }
+    for pool_id in missing_pools:
+        batch.add(pool_contracts[pool_id].functions.decimals())
+    for block_number, pool_id in missing:
+        batch.add(balancer_vault.functions.getPoolTokens(pool_id), block_number)
+        batch.add(pool_contracts[pool_id].functions.totalSupply(), block_number)
+    results = batch.execute(return_exceptions=True)
+    bpt_decimals = dict(zip(missing_pools, results[: len(missing_pools)]))
+    last_block = max(block_numbers)
+    for index, (block_number, pool_id) in enumerate(missing):
+        offset = len(missing_pools) + index * 2
+        pool_tokens, total_supply = results[offset : offset + 2]
+        state = None
+        # Supply can't be read before the pool was created
+        if not isinstance(total_supply, BadFunctionCallOutput):
+            for result in (bpt_decimals[pool_id], pool_tokens, total_supply):
+                if isinstance(result, Exception):
+                    raise result
+            tokens, balances, _ = pool_tokens
+            state = [bpt_decimals[pool_id], total_supply, list(tokens), list(balances)]
+            if block_number == last_block:
+                disk_cache_set("pool_tokens", f"{chain}:{pool_id}", list(tokens))
+        disk_cache_set(
+            "pool_state", f"{chain}:{pool_id}:{block_number}", {"state": state}
+        )
+        states[block_number][pool_id] = state
+    return states
+
+
+def get_twap_bpt_prices(
+    balancer_pool_ids: List[str],
+    chain: str,
+    web3: Web3,
+    start_date_ts: int,
+    end_date_ts: int,
+    block_number: int,
+) -> Dict[str, Optional[Decimal]]:
+    """
+    Twap BPT prices of many pools, keyed by pool id. Pool reads are sent in two batches,
+    token metadata in one and every token price is fetched once
+    """
+    pools_state = get_pools_state(web3, chain, balancer_pool_ids, [block_number])
+    pools_balances = {}
+    for pool_id in balancer_pool_ids:
+        state = pools_state[block_number][pool_id]
+        if state is None:
+            print("Pool wasn't created at the block number")
+            continue
+        decimals, total_supply, tokens, balances = state
+        pools_balances[pool_id] = (
+            Decimal(total_supply / 10**decimals),
+            tokens,
+            balances,
+        )
+
+    all_tokens = list(
+        dict.fromkeys(
+            token for _, tokens, _ in pools_balances.values() for token in tokens
         )
-    except BadFunctionCallOutput:
-        print("Pool wasn't created at the block number")
-        return None
-    balances = _get_balancer_pool_tokens_balances(
-        balancer_pool_id=balancer_pool_id,
-        web3=web3,
-        chain=chain,
-        block_number=block_number or web3.eth.block_number,
     )
-    # Now let's calculate price with twap
-    for balance in balances:
-        balance.twap_price = fetch_token_price_balgql_timerange(
-            balance.token_addr,
-            chain,
-            int(start_date.timestamp()),
-            int(end_date.timestamp()),
+    token_metadata, token_prices = _get_tokens_twap_prices(
+        web3, chain, all_tokens, start_date_ts, end_date_ts
+    )
+    bpt_prices = {pool_id: None for pool_id in balancer_pool_ids}
+    for pool_id, (total_supply, tokens, balances) in pools_balances.items():
+        # Make sure we have all prices
+        if not all(token_prices[token] for token in tokens):
+            continue
+        # Now we have all prices, let's calculate total price
+        total_price = sum(
+            [
+                Decimal(balance)
+                / Decimal(10 ** token_metadata[token][0])
+                * token_prices[token]
+                for token, balance in zip(tokens, balances)
+            ]
         )
-    # Make sure we have all prices
-    if not all([balance.twap_price for balance in balances]):
-        return None
-    # Now we have all prices, let's calculate total price
-    total_price = sum([balance.balance * balance.twap_price for balance in balances])
-    return total_price / Decimal(total_supply)
+        bpt_prices[pool_id] = total_price / total_supply
+    return bpt_prices
+
+
+def get_sampled_twap_bpt_prices(
+    balancer_pool_ids: List[str],
+    chain: str,
+    web3: Web3,
+    start_date_ts: int,
+    end_date_ts: int,
+    block_numbers: List[int],
+) -> Dict[str, Optional[Decimal]]:
+    """
+    Twap BPT prices of many pools, with pool balances and BPT supply averaged over samples taken
+    at block_numbers. Reads of all samples are sent in two batches. Samples before a pool was
+    created are skipped, pools holding a token without a price get None
+    """
+    pools_state = get_pools_state(web3, chain, balancer_pool_ids, block_numbers)
+    all_tokens = {}
+    for block_states in pools_state.values():
+        for state in block_states.values():
+            if state is not None:
+                all_tokens.update(dict.fromkeys(state[2]))
+    token_metadata, token_prices = _get_tokens_twap_prices(
+        web3, chain, list(all_tokens), start_date_ts, end_date_ts
+    )
+    # Dollar value of a BPT at every sample, per pool. Math is exact Decimal like in
+    # get_twap_bpt_prices, so one sample gives the same price as the unsampled path
+    sample_prices: Dict[str, List[Decimal]] = {
+        pool_id: [] for pool_id in balancer_pool_ids
+    }
+    unpriced = set()
+    for block_number in block_numbers:
+        for pool_id in balancer_pool_ids:
+            state = pools_state[block_number][pool_id]
+            if state is None:
+                continue
+            decimals, total_supply, tokens, token_balances = state
+            if not all(token_prices[token] for token in tokens):
+                unpriced.add(pool_id)
+                continue
+            supply = Decimal(total_supply) / Decimal(10**decimals)
+            if not supply:
+                continue
+            total_price = sum(
+                Decimal(balance)
+                / Decimal(10 ** token_metadata[token][0])
+                * token_prices[token]
+                for token, balance in zip(tokens, token_balances)
+            )
+            sample_prices[pool_id].append(total_price / supply)
+    return {
+        pool_id: (
+            sum(prices) / len(prices) if prices and pool_id not in unpriced else None
+        )
+        for pool_id, prices in sample_prices.items()
+    }
+
+
+def bpt_price_sample_timestamps(
+    start_date_ts: int, end_date_ts: int, samples: int
+) -> List[int]:
+    """
+    Evenly spaced sample timestamps in the period, the last one is end_date_ts
+    """
+    return [
+        start_date_ts + (end_date_ts - start_date_ts) * (index + 1) // samples
+        for index in range(samples)
+    ]
+
+
+def _get_tokens_twap_prices(
+    web3: Web3, chain: str, tokens: List[str], start_date_ts: int, end_date_ts: int
+) -> Tuple[Dict[str, Tuple[int, str, str]], Dict[str, Optional[Decimal]]]:
+    """
+    Metadata and twap prices of tokens, keyed by token
+    """
+    token_metadata = dict(zip(tokens, get_tokens_metadata(web3, chain, tokens)))
+    # Now let's calculate prices with twap
+    token_prices = {
+        token: fetch_token_price_balgql_timerange(
+            token, chain, start_date_ts, end_date_ts
+        )
+        for token in tokens
+    }
+    return token_metadata, token_prices
 
 
 def _get_balancer_pool_tokens_balances(
@@ -253,25 +546,21 @@ def _get_balancer_pool_tokens_balances(
     if not block_number:
         block_number = web3.eth.block_number
     vault_addr = BALANCER_CONTRACTS[chain]["BALANCER_VAULT_ADDRESS"]
-    balancer_vault = web3.eth.contract(
-        address=web3.to_checksum_address(vault_addr), abi=get_abi("BalancerVault")
-    )
+    balancer_vault = get_contract(web3, chain, vault_addr, "BalancerVault")
 
     # Get all tokens in the pool and their balances
     tokens, balances, _ = balancer_vault.functions.getPoolTokens(balancer_pool_id).call(
         block_identifier=block_number
     )
+    token_metadata = get_tokens_metadata(web3, chain, tokens)
     token_balances = []
     for index, token in enumerate(tokens):
-        token_contract = web3.eth.contract(
-            address=web3.to_checksum_address(token), abi=get_abi("ERC20")
-        )
-        decimals = token_contract.functions.decimals().call()
+        decimals, name, symbol = token_metadata[index]
         balance = Decimal(balances[index]) / Decimal(10**decimals)
         pool_token_balance = PoolBalance(
             token_addr=token,
-            token_name=token_contract.functions.name().call(),
-            token_symbol=token_contract.functions.symbol().call(),
+            token_name=name,
+            token_symbol=symbol,
             pool_id=balancer_pool_id,
             balance=balance,
         )
@@ -279,6 +568,50 @@ def _get_balancer_pool_tokens_balances(
     return token_balances
 
 
+def get_tokens_metadata(
+    web3: Web3, chain: str, tokens: List[str]
+) -> List[Tuple[int, str, str]]:
+    """
+    Returns (decimals, name, symbol) of tokens. Metadata is read once and kept in the
+    local disk cache, reads for unknown tokens are sent in one batch
+    """
+    keys = [(chain, Web3.to_checksum_address(token)) for token in tokens]
+    for key in keys:
+        if key not in _TOKEN_METADATA:
+            cached_metadata = disk_cache_get("tokens", ":".join(key))
+            if cached_metadata is not None:
+                _TOKEN_METADATA[key] = tuple(cached_metadata)
+    missing = list(dict.fromkeys(key for key in keys if key not in _TOKEN_METADATA))
+    if missing:
+        batch = BatchCaller(web3)
+        for _, token in missing:
+            token_contract = get_contract(web3, chain, token, "ERC20")
+            batch.add(token_contract.functions.decimals())
+            batch.add(token_contract.functions.name())
+            batch.add(token_contract.functions.symbol())
+        results = batch.execute()
+        for index, key in enumerate(missing):
+            _TOKEN_METADATA[key] = tuple(results[index * 3 : index * 3 + 3])
+            disk_cache_set("tokens", ":".join(key), _TOKEN_METADATA[key])
+    return [_TOKEN_METADATA[key] for key in keys]
+
+
+def load_tokens_metadata(
+    chain: str, tokens: List[str]
+) -> Dict[str, Tuple[int, str, str]]:
+    """
+    (decimals, name, symbol) of tokens stored by earlier runs, keyed by token.
+    Tokens without stored metadata are left out
+    """
+    stored = {}
+    for token in tokens:
+        key = (chain, Web3.to_checksum_address(token))
+        metadata = _TOKEN_METADATA.get(key) or disk_cache_get("tokens", ":".join(key))
+        if metadata is not None:
+            stored[token] = tuple(metadata)
+    return stored
+
+
 def fetch_token_price_balgql_timerange(
     token_addr: str,
     chain: str,
@@ -288,22 +621,97 @@ def fetch_token_price_balgql_timerange(
     """
     Fetches 30 days of token prices from balancer graphql api and calculate twap over time range
     """
+    return calculate_twap_price(
+        get_token_price_history(token_addr, chain, end_date_ts),
+        start_date_ts,
+        end_date_ts,
+    )
+
+
+@single_flight(
+    "prices",
+    key=lambda token_addr, chain, end_date_ts: (chain, token_addr.lower(), end_date_ts),
+)
+def get_token_price_history(
+    token_addr: str, chain: str, end_date_ts: int
+) -> List[Dict]:
+    """
+    Returns token price history covering end_date_ts. Histories fetched after end_date_ts
+    are served from the local disk cache, older ones are extended with the prices since
+    they were fetched
+    """
+    cache_key = f"{chain}:{token_addr.lower()}"
+    cached = disk_cache_get("prices", cache_key)
+    if cached is not None and cached["fetched_at"] >= end_date_ts:
+        return cached["prices"]
+    now = int(time.time())
+    prices = fetch_token_price_history(
+        token_addr.lower(),
+        chain,
+        price_history_range(cached["fetched_at"] if cached is not None else None, now),
+    )
+    prices = merge_price_history(cached["prices"] if cached else [], prices, now)
+    disk_cache_set("prices", cache_key, {"fetched_at": now, "prices": prices})
+    return prices
+
+
+def price_history_range(fetched_at: Optional[int], now: int) -> str:
+    """
+    Shortest balancer api range covering prices since fetched_at, the longest one without it
+    """
+    if fetched_at is not None:
+        for seconds, history_range in PRICE_HISTORY_RANGES:
+            if now - fetched_at < seconds:
+                return history_range
+    return PRICE_HISTORY_RANGES[-1][1]
+
+
+def merge_price_history(
+    stored: List[Dict], fetched: List[Dict], now: int
+) -> List[Dict]:
+    """
+    Stored prices extended with fetched ones, sorted by timestamp. Fetched prices replace stored
+    ones at the same timestamp, prices older than the longest api range are dropped
+    """
+    oldest = now - PRICE_HISTORY_RANGES[-1][0]
+    merged = {int(price["timestamp"]): price for price in stored}
+    merged.update({int(price["timestamp"]): price for price in fetched})
+    return [merged[timestamp] for timestamp in sorted(merged) if timestamp >= oldest]
+
+
+@ttl_cache(PRICE_CACHE_TTL)
+def fetch_token_price_history(
+    token_addr: str, chain: str, history_range: str = PRICE_HISTORY_RANGES[-1][1]
+) -> List[Dict]:
+    """
+    Fetches token prices of the history_range from balancer graphql api, 90 days by default
+    """
     transport = RequestsHTTPTransport(
         url=BAL_GQL_URL,
         retries=3,
         retry_backoff_factor=0.5,
         retry_status_forcelist=[429, 500, 502, 503, 504, 520],
+        timeout=HTTP_TIMEOUT,
         headers={**BAL_DEFAULT_HEADERS, "chainId": CHAIN_TO_CHAIN_ID_MAP[chain]},
     )
     client = Client(transport=transport, fetch_schema_from_transport=True)
     query = gql(
         BAL_GQL_QUERY.format(
-            token_addr=token_addr.lower(), upper_chain_name=chain.upper()
+            token_addr=token_addr.lower(),
+            upper_chain_name=chain.upper(),
+            history_range=history_range,
         )
     )
     result = client.execute(query)
-    prices = result["tokenGetHistoricalPrices"][0]["prices"]
-    # Filter results so they are in between start_date and end_date timestamps
+    return result["tokenGetHistoricalPrices"][0]["prices"]
+
+
+def calculate_twap_price(
+    prices: List[Dict], start_date_ts: int, end_date_ts: int
+) -> Optional[Decimal]:
+    """
+    Calculates twap over time range from balancer api historical prices
+    """
     # Sort result by timestamp desc
     time_sorted_prices = sorted(prices, key=lambda x: int(x["timestamp"]), reverse=True)
     # Filter results so they are in between start_date and end_date timestamps
@@ -321,50 +729,147 @@ def fetch_token_price_balgql_timerange(
     return twap_price
 
 
-def get_balancer_pool_snapshots(block: int, graph_url: str) -> Optional[List[Dict]]:
-    transport = RequestsHTTPTransport(
-        url=graph_url,
-        retries=3,
-        retry_backoff_factor=0.5,
-        retry_status_forcelist=[429, 500, 502, 503, 504, 520],
-        headers=BAL_DEFAULT_HEADERS,
-    )
-    client = Client(
-        transport=transport, fetch_schema_from_transport=True, execute_timeout=60
-    )
-    all_pools = []
+def get_balancer_pool_snapshots(block: int, graph_url: str) -> Dict[str, PoolSnapshot]:
+    """
+    Returns newest snapshot of every pool at block, keyed by pool id.
+    Responses are decoded while they stream in. Snapshots at a block never change,
+    so they are kept in the local disk cache
+    """
+    cache_key = f"{graph_url}:{block}"
+    cached_snapshots = disk_cache_get("pool_snapshots", cache_key)
+    if cached_snapshots is not None:
+        return {data[0]: PoolSnapshot.from_list(data) for data in cached_snapshots}
+    endpoint_group = get_endpoint_group(graph_url)
+    snapshots = {}
     limit = 1000
     offset = 0
     while True:
-        result = client.execute(
-            gql(POOLS_SNAPSHOTS_QUERY.format(first=limit, skip=offset, block=block))
+        page_snapshots, records = endpoint_group.request(
+            lambda url: _fetch_pool_snapshots_page(url, block, limit, offset)
         )
-        all_pools.extend(result["poolSnapshots"])
+        for snapshot in page_snapshots.values():
+            add_snapshot(snapshots, snapshot)
         offset += limit
         if offset >= 5000:
             break
-        if len(result["poolSnapshots"]) < limit - 1:
+        if records < limit - 1:
             break
-    return all_pools
+    disk_cache_set(
+        "pool_snapshots",
+        cache_key,
+        [snapshot.to_list() for snapshot in snapshots.values()],
+    )
+    return snapshots
+
+
+def _fetch_pool_snapshots_page(
+    graph_url: str, block: int, limit: int, offset: int
+) -> Tuple[Dict[str, PoolSnapshot], int]:
+    """
+    Returns newest snapshots of a poolSnapshots page and number of records in it
+    """
+    snapshots = {}
+    decoder = SnapshotDecoder(snapshots)
+    with get_pooled_session(graph_url).post(
+        graph_url,
+        json={
+            "query": POOLS_SNAPSHOTS_QUERY.format(first=limit, skip=offset, block=block)
+        },
+        headers=BAL_DEFAULT_HEADERS,
+        timeout=60,
+        stream=True,
+    ) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        for prefix, event, value in ijson.parse(response.raw):
+            decoder.feed(prefix, event, value)
+    return snapshots, decoder.finish()
+
+
+def get_subgraph_url(chain: str) -> str:
+    """
+    Returns url of the Balancer subgraph of the chain. Snapshot queries to it are hedged
+    across SUBGRAPH_URLS of the chain
+    """
+    graph_url = Subgraph(chain).get_subgraph_url()
+    get_endpoint_group(graph_url, SUBGRAPH_URLS.get(chain, []))
+    return graph_url
+
+
+def get_blocks_subgraph_url(chain: str) -> str:
+    return Subgraph(chain).get_subgraph_url("blocks")
+
+
+def get_gauges_subgraph_url(chain: str) -> str:
+    return Subgraph(chain).get_subgraph_url("gauges")
+
+
+def get_subgraph_meta(graph_url: str) -> Tuple[int, Optional[int]]:
+    """
+    Returns number and timestamp of the last block indexed by a subgraph.
+    Timestamp is None for graph nodes that don't report it
+    """
+    response = get_pooled_session(graph_url).post(
+        graph_url,
+        json={"query": SUBGRAPH_META_QUERY},
+        headers=BAL_DEFAULT_HEADERS,
+        timeout=HTTP_TIMEOUT,
+    )
+    response.raise_for_status()
+    block = response.json()["data"]["_meta"]["block"]
+    timestamp = block.get("timestamp")
+    return int(block["number"]), int(timestamp) if timestamp is not None else None
 
 
+def get_indexed_block_timestamp(graph_url: str, number: int) -> Optional[int]:
+    """
+    Returns timestamp of a block in a blocks subgraph, None if it isn't indexed
+    """
+    response = get_pooled_session(graph_url).post(
+        graph_url,
+        json={"query": INDEXED_BLOCK_QUERY.format(number=number)},
+        headers=BAL_DEFAULT_HEADERS,
+        timeout=HTTP_TIMEOUT,
+    )
+    response.raise_for_status()
+    blocks = response.json()["data"]["blocks"]
+    return int(blocks[0]["timestamp"]) if blocks else None
+
+
+@single_flight("aura_vebal_share", key=lambda web3, block_number: block_number)
 def calculate_aura_vebal_share(web3: Web3, block_number: int) -> Decimal:
     """
     Function that calculate veBAL share of AURA auraBAL from the total supply of veBAL
     """
-    ve_bal_contract = web3.eth.contract(
-        address=web3.to_checksum_address("0xC128a9954e6c874eA3d62ce62B468bA073093F25"),
-        abi=get_abi("ERC20"),
-    )
-    total_supply = ve_bal_contract.functions.totalSupply().call(
-        block_identifier=block_number
+    ve_bal_contract = get_contract(web3, "mainnet", VE_BAL_ADDRESS, "ERC20")
+    batch = BatchCaller(web3)
+    batch.add(ve_bal_contract.functions.totalSupply(), block_number)
+    batch.add(
+        ve_bal_contract.functions.balanceOf(
+            AURA_VE_BAL_HOLDER_ADDRESS  # veBAL aura holder
+        ),
+        block_number,
     )
-    aura_vebal_balance = ve_bal_contract.functions.balanceOf(
-        "0xaF52695E1bB01A16D33D7194C28C42b10e0Dbec2"  # veBAL aura holder
-    ).call(block_identifier=block_number)
+    total_supply, aura_vebal_balance = batch.execute()
     return Decimal(aura_vebal_balance) / Decimal(total_supply)
 
 
+@ttl_cache(GAUGE_CACHE_TTL)
+def get_pools_gauges(chain: str) -> BalPoolsGauges:
+    """
+    Returns gauge registry of a chain, shared by everything that checks pool gauges
+    """
+    return BalPoolsGauges(chain)
+
+
+@ttl_cache(GAUGE_CACHE_TTL)
+def get_last_join_exit(chain: str, pool_id: str) -> int:
+    """
+    Returns timestamp of the last join or exit of a pool
+    """
+    return get_pools_gauges(chain).get_last_join_exit(pool_id)
+
+
 def fetch_all_pools_info() -> List[Dict]:
     """
     Fetches all pools info from balancer graphql api
@@ -374,6 +879,7 @@ def fetch_all_pools_info() -> List[Dict]:
         retries=3,
         retry_backoff_factor=0.5,
         retry_status_forcelist=[429, 500, 502, 503, 504, 520],
+        timeout=HTTP_TIMEOUT,
         headers=BAL_DEFAULT_HEADERS,
     )
     client = Client(transport=transport, fetch_schema_from_transport=True)
@@ -386,7 +892,7 @@ def fetch_hh_aura_bribs() -> List[Dict]:
     """
     Fetch GET bribes from hidden hand api
     """
-    res = requests.get(HH_AURA_URL)
+    res = requests.get(HH_AURA_URL, timeout=HTTP_TIMEOUT)
     if not res.ok:
         raise ValueError("Error fetching bribes from hidden hand api")
 
@@ -0,0 +1,449 @@
+import asyncio
+import time
+import weakref
+from decimal import Decimal
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+import aiohttp
+import ijson
+from gql import Client
+from gql import gql
+from gql.transport.aiohttp import AIOHTTPTransport
+from gql.transport.exceptions import TransportServerError
+from web3 import AsyncWeb3
+from web3 import Web3
+from web3.exceptions import BadFunctionCallOutput
+
+from fee_allocator.accounting.settings import ASYNC_MAX_CONCURRENCY
+from fee_allocator.accounting.settings import RPC_TIMEOUT
+from fee_allocator.cache import disk_cache_get
+from fee_allocator.cache import disk_cache_set
+from fee_allocator.helpers import AURA_VE_BAL_HOLDER_ADDRESS
+from fee_allocator.helpers import BAL_DEFAULT_HEADERS
+from fee_allocator.helpers import BAL_GQL_QUERY
+from fee_allocator.helpers import BAL_GQL_URL
+from fee_allocator.helpers import BALANCER_CONTRACTS
+from fee_allocator.helpers import BLOCK_SEARCH_WINDOW
+from fee_allocator.helpers import BLOCKS_QUERY
+from fee_allocator.helpers import CHAIN_TO_CHAIN_ID_MAP
+from fee_allocator.helpers import HH_AURA_URL
+from fee_allocator.helpers import INDEXED_BLOCK_QUERY
+from fee_allocator.helpers import LAST_JOIN_EXIT_QUERY
+from fee_allocator.helpers import POOLS_SNAPSHOTS_QUERY
+from fee_allocator.helpers import PREFERENTIAL_GAUGES_QUERY
+from fee_allocator.helpers import PoolBalance
+from fee_allocator.helpers import SUBGRAPH_META_QUERY
+from fee_allocator.helpers import VE_BAL_ADDRESS
+from fee_allocator.helpers import calculate_twap_price
+from fee_allocator.helpers import clamp_block_timestamp
+from fee_allocator.helpers import get_blocks_subgraph_url
+from fee_allocator.helpers import get_contract
+from fee_allocator.helpers import get_gauges_subgraph_url
+from fee_allocator.helpers import get_subgraph_url
+from fee_allocator.helpers import merge_price_history
+from fee_allocator.helpers import price_history_range
+from fee_allocator.rpc import get_endpoint_uri
+from fee_allocator.snapshots import PoolSnapshot
+from fee_allocator.snapshots import SnapshotDecoder
+
+RETRY_STATUS_FORCELIST = [429, 500, 502, 503, 504, 520]
+
+# Limits in-flight gql requests per event loop, so we don't hammer the apis
+_LIMITERS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _get_limiter() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    if loop not in _LIMITERS:
+        _LIMITERS[loop] = asyncio.Semaphore(ASYNC_MAX_CONCURRENCY)
+    return _LIMITERS[loop]
+
+
+def get_async_web3(web3: Web3) -> AsyncWeb3:
+    """
+    Returns AsyncWeb3 talking to the same endpoint as a sync web3 instance
+    """
+    return AsyncWeb3(
+        AsyncWeb3.AsyncHTTPProvider(
+            get_endpoint_uri(web3), request_kwargs={"timeout": RPC_TIMEOUT}
+        )
+    )
+
+
+async def execute_gql(
+    url: str,
+    query: str,
+    headers: Optional[Dict] = None,
+    execute_timeout: Optional[int] = None,
+    retries: int = 3,
+    retry_backoff_factor: float = 0.5,
+) -> Dict:
+    """
+    Async counterpart of executing a query through RequestsHTTPTransport,
+    with the same retry policy
+    """
+    for attempt in range(retries + 1):
+        transport = AIOHTTPTransport(url=url, headers=headers or BAL_DEFAULT_HEADERS)
+        try:
+            async with _get_limiter():
+                async with Client(
+                    transport=transport,
+                    fetch_schema_from_transport=True,
+                    execute_timeout=execute_timeout,
+                ) as session:
+                    return await session.execute(gql(query))
+        except (TransportServerError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            retryable = not isinstance(e, TransportServerError) or (
+                e.code in RETRY_STATUS_FORCELIST
+            )
+            if attempt == retries or not retryable:
+                raise
+            await asyncio.sleep(retry_backoff_factor * 2**attempt)
+
+
+async def fetch_json_async(session: aiohttp.ClientSession, url: str) -> Dict:
+    async with session.get(url) as response:
+        response.raise_for_status()
+        # Raw github urls are served as text/plain
+        return await response.json(content_type=None)
+
+
+async def get_block_by_ts_async(timestamp: int, chain: str) -> int:
+    """
+    Returns block number for a given timestamp
+    """
+    return await _get_block_by_ts_async(clamp_block_timestamp(timestamp), chain)
+
+
+async def _get_block_by_ts_async(timestamp: int, chain: str) -> int:
+    """
+    Blocks subgraph lookup, shares the local disk cache with get_block_by_ts
+    """
+    cache_key = f"{chain}:{timestamp}"
+    cached_block = disk_cache_get("blocks", cache_key)
+    if cached_block is not None:
+        return cached_block
+    result = await execute_gql(
+        get_blocks_subgraph_url(chain),
+        BLOCKS_QUERY.format(
+            ts_gt=timestamp - BLOCK_SEARCH_WINDOW,
+            ts_lt=timestamp + BLOCK_SEARCH_WINDOW,
+        ),
+    )
+    # Sort result by timestamp desc
+    result["blocks"].sort(key=lambda x: x["timestamp"], reverse=True)
+    if len(result["blocks"]) == 0:
+        print(
+            f"Warning:  Can't find any blocks around timestamp {timestamp}, trying 5 minutes sooner."
+        )
+        return await _get_block_by_ts_async(timestamp - 15 * 60, chain)
+    block = int(result["blocks"][0]["number"])
+    disk_cache_set("blocks", cache_key, block)
+    return block
+
+
+async def get_subgraph_meta_async(graph_url: str) -> Tuple[int, Optional[int]]:
+    """
+    Returns number and timestamp of the last block indexed by a subgraph.
+    Timestamp is None for graph nodes that don't report it
+    """
+    result = await execute_gql(graph_url, SUBGRAPH_META_QUERY)
+    block = result["_meta"]["block"]
+    timestamp = block.get("timestamp")
+    return int(block["number"]), int(timestamp) if timestamp is not None else None
+
+
+async def get_indexed_block_timestamp_async(
+    graph_url: str, number: int
+) -> Optional[int]:
+    """
+    Returns timestamp of a block in a blocks subgraph, None if it isn't indexed
+    """
+    result = await execute_gql(graph_url, INDEXED_BLOCK_QUERY.format(number=number))
+    blocks = result["blocks"]
+    return int(blocks[0]["timestamp"]) if blocks else None
+
+
+async def get_alive_gauge_pools_async(chain: str, pool_ids: List[str]) -> Set[str]:
+    """
+    Returns pools of pool_ids with an alive preferential gauge, from the gauges subgraph
+    """
+    if not pool_ids:
+        return set()
+    result = await execute_gql(
+        get_gauges_subgraph_url(chain),
+        PREFERENTIAL_GAUGES_QUERY.format(
+            pool_ids=", ".join(f'"{pool_id}"' for pool_id in pool_ids)
+        ),
+    )
+    return {
+        pool["poolId"]
+        for pool in result["pools"]
+        if pool["preferentialGauge"] is not None
+        and not pool["preferentialGauge"]["isKilled"]
+    }
+
+
+async def get_last_join_exit_async(chain: str, pool_id: str) -> Optional[int]:
+    """
+    Returns timestamp of the last join or exit of a pool, None if it couldn't be fetched
+    """
+    try:
+        result = await execute_gql(
+            get_subgraph_url(chain), LAST_JOIN_EXIT_QUERY.format(pool_id=pool_id)
+        )
+        return int(result["joinExits"][0]["timestamp"])
+    except Exception:
+        return None
+
+
+async def fetch_token_price_balgql_timerange_async(
+    token_addr: str,
+    chain: str,
+    start_date_ts: int,
+    end_date_ts: int,
+) -> Optional[Decimal]:
+    """
+    Fetches token prices from balancer graphql api and calculate twap over time range.
+    Histories fetched after end_date_ts are served from the local disk cache, older ones
+    are extended with the prices since they were fetched
+    """
+    cache_key = f"{chain}:{token_addr.lower()}"
+    cached = disk_cache_get("prices", cache_key)
+    if cached is not None and cached["fetched_at"] >= end_date_ts:
+        return calculate_twap_price(cached["prices"], start_date_ts, end_date_ts)
+    now = int(time.time())
+    result = await execute_gql(
+        BAL_GQL_URL,
+        BAL_GQL_QUERY.format(
+            token_addr=token_addr.lower(),
+            upper_chain_name=chain.upper(),
+            history_range=price_history_range(
+                cached["fetched_at"] if cached is not None else None, now
+            ),
+        ),
+        headers={**BAL_DEFAULT_HEADERS, "chainId": CHAIN_TO_CHAIN_ID_MAP[chain]},
+    )
+    prices = merge_price_history(
+        cached["prices"] if cached else [],
+        result["tokenGetHistoricalPrices"][0]["prices"],
+        now,
+    )
+    disk_cache_set("prices", cache_key, {"fetched_at": now, "prices": prices})
+    return calculate_twap_price(prices, start_date_ts, end_date_ts)
+
+
+class TokenPriceFetcher:
+    """
+    Memoizes twap token prices for one run. Concurrent requests for the same token
+    share a single in-flight fetch
+    """
+
+    def __init__(self, start_date_ts: int, end_date_ts: int):
+        self.start_date_ts = start_date_ts
+        self.end_date_ts = end_date_ts
+        self._tasks: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    async def get(self, token_addr: str, chain: str) -> Optional[Decimal]:
+        key = (chain, token_addr.lower())
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.ensure_future(
+                fetch_token_price_balgql_timerange_async(
+                    token_addr, chain, self.start_date_ts, self.end_date_ts
+                )
+            )
+        return await self._tasks[key]
+
+
+async def _stream_pool_snapshots(
+    session: aiohttp.ClientSession,
+    graph_url: str,
+    query: str,
+    snapshots: Dict[str, PoolSnapshot],
+    retries: int = 3,
+    retry_backoff_factor: float = 0.5,
+) -> int:
+    """
+    Post a poolSnapshots query and decode the response while it streams in.
+    Returns number of snapshot records in the response
+    """
+    for attempt in range(retries + 1):
+        # Re-feeding snapshots of a failed attempt is harmless, newest snapshot per pool wins
+        decoder = SnapshotDecoder(snapshots)
+        try:
+            async with _get_limiter():
+                async with session.post(
+                    graph_url, json={"query": query}, headers=BAL_DEFAULT_HEADERS
+                ) as response:
+                    response.raise_for_status()
+                    async for prefix, event, value in ijson.parse_async(
+                        response.content
+                    ):
+                        decoder.feed(prefix, event, value)
+            return decoder.finish()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            retryable = not isinstance(e, aiohttp.ClientResponseError) or (
+                e.status in RETRY_STATUS_FORCELIST
+            )
+            if attempt == retries or not retryable:
+                raise
+            await asyncio.sleep(retry_backoff_factor * 2**attempt)
+
+
+async def get_balancer_pool_snapshots_async(
+    block: int, graph_url: str
+) -> Dict[str, PoolSnapshot]:
+    cache_key = f"{graph_url}:{block}"
+    cached_snapshots = disk_cache_get("pool_snapshots", cache_key)
+    if cached_snapshots is not None:
+        return {data[0]: PoolSnapshot.from_list(data) for data in cached_snapshots}
+    snapshots = {}
+    limit = 1000
+    offset = 0
+    async with aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=60)
+    ) as session:
+        # Pages depend on the size of the previous one, so they are fetched in order
+        while True:
+            records = await _stream_pool_snapshots(
+                session,
+                graph_url,
+                POOLS_SNAPSHOTS_QUERY.format(first=limit, skip=offset, block=block),
+                snapshots,
+            )
+            offset += limit
+            if offset >= 5000:
+                break
+            if records < limit - 1:
+                break
+    disk_cache_set(
+        "pool_snapshots",
+        cache_key,
+        [snapshot.to_list() for snapshot in snapshots.values()],
+    )
+    return snapshots
+
+
+async def calculate_aura_vebal_share_async(
+    web3: AsyncWeb3, block_number: int
+) -> Decimal:
+    """
+    Function that calculate veBAL share of AURA auraBAL from the total supply of veBAL
+    """
+    ve_bal_contract = get_contract(web3, "mainnet", VE_BAL_ADDRESS, "ERC20")
+    total_supply, aura_vebal_balance = await asyncio.gather(
+        ve_bal_contract.functions.totalSupply().call(block_identifier=block_number),
+        ve_bal_contract.functions.balanceOf(AURA_VE_BAL_HOLDER_ADDRESS).call(
+            block_identifier=block_number
+        ),
+    )
+    return Decimal(aura_vebal_balance) / Decimal(total_supply)
+
+
+async def _get_balancer_pool_tokens_balances_async(
+    balancer_pool_id: str, web3: AsyncWeb3, chain: str, block_number: int
+) -> List[PoolBalance]:
+    """
+    Returns all token balances for a given balancer pool
+    """
+    balancer_vault = get_contract(
+        web3,
+        chain,
+        BALANCER_CONTRACTS[chain]["BALANCER_VAULT_ADDRESS"],
+        "BalancerVault",
+    )
+    tokens, balances, _ = await balancer_vault.functions.getPoolTokens(
+        balancer_pool_id
+    ).call(block_identifier=block_number)
+
+    async def token_balance(index: int, token: str) -> PoolBalance:
+        token_contract = get_contract(web3, chain, token, "ERC20")
+        decimals, name, symbol = await asyncio.gather(
+            token_contract.functions.decimals().call(),
+            token_contract.functions.name().call(),
+            token_contract.functions.symbol().call(),
+        )
+        return PoolBalance(
+            token_addr=token,
+            token_name=name,
+            token_symbol=symbol,
+            pool_id=balancer_pool_id,
+            balance=Decimal(balances[index]) / Decimal(10**decimals),
+        )
+
+    return list(
+        await asyncio.gather(
+            *[token_balance(index, token) for index, token in enumerate(tokens)]
+        )
+    )
+
+
+async def get_twap_bpt_price_async(
+    balancer_pool_id: str,
+    chain: str,
+    web3: AsyncWeb3,
+    token_prices: TokenPriceFetcher,
+    block_number: Optional[int] = None,
+) -> Optional[Decimal]:
+    """
+    BPT dollar price equals to Sum of all underlying ERC20 tokens in the Balancer pool divided by
+    total supply of BPT token. Token twap prices come from token_prices
+    """
+    balancer_vault = get_contract(
+        web3,
+        chain,
+        BALANCER_CONTRACTS[chain]["BALANCER_VAULT_ADDRESS"],
+        "BalancerVault",
+    )
+    balancer_pool_address, _ = await balancer_vault.functions.getPool(
+        balancer_pool_id
+    ).call()
+    weighed_pool_contract = get_contract(
+        web3, chain, balancer_pool_address, "WeighedPool"
+    )
+    decimals = await weighed_pool_contract.functions.decimals().call()
+    try:
+        total_supply = Decimal(
+            await weighed_pool_contract.functions.totalSupply().call(
+                block_identifier=block_number
+            )
+            / 10**decimals
+        )
+    except BadFunctionCallOutput:
+        print("Pool wasn't created at the block number")
+        return None
+    balances = await _get_balancer_pool_tokens_balances_async(
+        balancer_pool_id,
+        web3,
+        chain,
+        block_number or await web3.eth.block_number,
+    )
+    prices = await asyncio.gather(
+        *[token_prices.get(balance.token_addr, chain) for balance in balances]
+    )
+    # Make sure we have all prices
+    if not all(prices):
+        return None
+    total_price = sum(
+        [balance.balance * price for balance, price in zip(balances, prices)]
+    )
+    return total_price / Decimal(total_supply)
+
+
+async def fetch_hh_aura_bribs_async(session: aiohttp.ClientSession) -> List[Dict]:
+    """
+    Fetch GET bribes from hidden hand api
+    """
+    async with session.get(HH_AURA_URL) as res:
+        if not res.ok:
+            raise ValueError("Error fetching bribes from hidden hand api")
+        response_parsed = await res.json(content_type=None)
+    if response_parsed["error"]:
+        raise ValueError("HH API returned error")
+    return response_parsed["data"]
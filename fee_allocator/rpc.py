@@ -0,0 +1,267 @@
+import json
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+import requests
+from eth_utils.abi import collapse_if_tuple
+from hexbytes import HexBytes
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from web3 import Web3
+from web3._utils.abi import map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+from web3.contract.contract import ContractFunction
+from web3.exceptions import BadFunctionCallOutput
+from web3.exceptions import ContractLogicError
+from web3.types import RPCEndpoint
+from web3.types import RPCResponse
+
+from fee_allocator.accounting.settings import RPC_BATCH_SIZE
+from fee_allocator.accounting.settings import RPC_POOL_SIZE
+from fee_allocator.accounting.settings import RPC_TIMEOUT
+from fee_allocator.accounting.settings import RPC_URLS
+from fee_allocator.endpoints import get_endpoint_group
+
+BlockIdentifier = Union[int, str]
+
+# One pooled keep-alive session per rpc endpoint, shared by web3 providers and batch calls
+_SESSIONS: Dict[str, requests.Session] = {}
+_batch_size = RPC_BATCH_SIZE
+
+
+def set_batch_size(batch_size: int) -> None:
+    """
+    Set max number of calls sent in a single JSON-RPC batch. 1 disables batching
+    """
+    global _batch_size
+    _batch_size = max(1, int(batch_size))
+
+
+def get_batch_size() -> int:
+    return _batch_size
+
+
+def get_pooled_session(endpoint_uri: str) -> requests.Session:
+    """
+    Returns keep-alive session for the endpoint, sized for concurrent calls on one chain
+    """
+    if endpoint_uri not in _SESSIONS:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=RPC_POOL_SIZE,
+            pool_maxsize=RPC_POOL_SIZE,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504, 520],
+                # eth_call and friends are read only, so retrying POSTs is safe
+                allowed_methods=None,
+            ),
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({"Connection": "keep-alive"})
+        _SESSIONS[endpoint_uri] = session
+    return _SESSIONS[endpoint_uri]
+
+
+def get_endpoint_uri(web3: Web3) -> Optional[str]:
+    endpoint_uri = getattr(web3.provider, "endpoint_uri", None)
+    return endpoint_uri if isinstance(endpoint_uri, str) else None
+
+
+class HedgedHTTPProvider(Web3.HTTPProvider):
+    """
+    HTTP provider sending every request through the endpoint group of its endpoint
+    """
+
+    def __init__(self, endpoint_uri: str, fallback_urls: Sequence[str]):
+        super().__init__(
+            endpoint_uri,
+            request_kwargs={"timeout": RPC_TIMEOUT},
+            session=get_pooled_session(endpoint_uri),
+        )
+        self.endpoint_group = get_endpoint_group(endpoint_uri, fallback_urls)
+
+    def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        request_data = self.encode_rpc_request(method, params)
+        raw_response = self.endpoint_group.request(
+            lambda url: _post(url, data=request_data)
+        )
+        return self.decode_rpc_response(raw_response)
+
+
+def _post(url: str, **kwargs) -> bytes:
+    response = get_pooled_session(url).post(
+        url,
+        headers={"Content-Type": "application/json"},
+        timeout=RPC_TIMEOUT,
+        **kwargs,
+    )
+    response.raise_for_status()
+    return response.content
+
+
+def pooled_web3(web3: Web3, fallback_urls: Sequence[str] = ()) -> Web3:
+    """
+    Returns web3 instance talking to the same endpoint over a pooled keep-alive session.
+    With fallback urls requests are hedged across the endpoint and fallbacks.
+    Instances that are not HTTP based are returned as is
+    """
+    endpoint_uri = get_endpoint_uri(web3)
+    if endpoint_uri is None:
+        return web3
+    if fallback_urls:
+        return Web3(HedgedHTTPProvider(endpoint_uri, fallback_urls))
+    return Web3(
+        Web3.HTTPProvider(
+            endpoint_uri,
+            request_kwargs={"timeout": RPC_TIMEOUT},
+            session=get_pooled_session(endpoint_uri),
+        )
+    )
+
+
+class PooledWeb3ByChain:
+    """
+    Wraps Web3RpcByChain so every chain uses a pooled keep-alive session,
+    hedged across RPC_URLS of the chain when configured.
+    Supports both item and attribute access like the wrapped object
+    """
+
+    def __init__(self, web3_instances: Any):
+        self._web3_instances = web3_instances
+        self._pooled: Dict[str, Web3] = {}
+
+    def __getitem__(self, chain: str) -> Web3:
+        if chain not in self._pooled:
+            self._pooled[chain] = pooled_web3(
+                self._web3_instances[chain], RPC_URLS.get(chain, [])
+            )
+        return self._pooled[chain]
+
+    def __getattr__(self, chain: str) -> Web3:
+        if chain.startswith("_"):
+            raise AttributeError(chain)
+        return self[chain]
+
+
+class BatchCaller:
+    """
+    Collects independent contract calls and sends them as JSON-RPC batch requests.
+
+    Usage:
+        batch = BatchCaller(web3)
+        batch.add(erc20.functions.totalSupply(), block)
+        batch.add(erc20.functions.balanceOf(holder), block)
+        total_supply, balance = batch.execute()
+
+    Results are decoded and normalized the same way ContractFunction.call does.
+    Falls back to sequential calls for providers without an HTTP endpoint
+    or when the endpoint doesn't accept batches.
+    With execute(return_exceptions=True) reverted and empty calls are returned
+    as exceptions in place of their results
+    """
+
+    def __init__(self, web3: Web3, batch_size: Optional[int] = None):
+        self.web3 = web3
+        self.batch_size = batch_size or get_batch_size()
+        self._calls: List[Tuple[ContractFunction, BlockIdentifier]] = []
+
+    def add(
+        self, function: ContractFunction, block_identifier: BlockIdentifier = "latest"
+    ) -> int:
+        self._calls.append((function, block_identifier))
+        return len(self._calls) - 1
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def execute(self, return_exceptions: bool = False) -> List[Any]:
+        calls, self._calls = self._calls, []
+        endpoint_uri = get_endpoint_uri(self.web3)
+        if endpoint_uri is None or self.batch_size <= 1 or len(calls) <= 1:
+            return self._call_sequentially(calls, return_exceptions)
+        results = []
+        for i in range(0, len(calls), self.batch_size):
+            chunk = calls[i : i + self.batch_size]
+            raw_results = get_endpoint_group(endpoint_uri).request(
+                lambda url: self._post_batch(url, chunk)
+            )
+            if raw_results is None:
+                results.extend(self._call_sequentially(chunk, return_exceptions))
+                continue
+            for (function, _), raw in zip(chunk, raw_results):
+                try:
+                    results.append(self._decode(function, raw))
+                except (ContractLogicError, BadFunctionCallOutput) as e:
+                    if not return_exceptions:
+                        raise
+                    results.append(e)
+        return results
+
+    @staticmethod
+    def _call_sequentially(
+        calls: List[Tuple[ContractFunction, BlockIdentifier]],
+        return_exceptions: bool = False,
+    ) -> List[Any]:
+        results = []
+        for function, block_identifier in calls:
+            try:
+                results.append(function.call(block_identifier=block_identifier))
+            except (ContractLogicError, BadFunctionCallOutput) as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    def _post_batch(
+        self, endpoint_uri: str, calls: List[Tuple[ContractFunction, BlockIdentifier]]
+    ) -> Optional[List[Dict]]:
+        payload = [
+            {
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "method": "eth_call",
+                "params": [
+                    {
+                        "to": function.address,
+                        "data": function._encode_transaction_data(),
+                    },
+                    hex(block) if isinstance(block, int) else block,
+                ],
+            }
+            for request_id, (function, block) in enumerate(calls)
+        ]
+        try:
+            parsed = json.loads(_post(endpoint_uri, json=payload))
+        except requests.HTTPError as e:
+            # Endpoints rejecting the batch itself, e.g. 413 for too many calls, get them one by one
+            if e.response is not None and 400 <= e.response.status_code < 500:
+                return None
+            raise
+        # Endpoints without batch support answer with a single error object
+        if not isinstance(parsed, list) or len(parsed) != len(calls):
+            return None
+        return sorted(parsed, key=lambda item: item["id"])
+
+    def _decode(self, function: ContractFunction, raw: Dict) -> Any:
+        if "error" in raw:
+            raise ContractLogicError(
+                f"{function.fn_name} on {function.address} failed: {raw['error']}"
+            )
+        data = HexBytes(raw["result"])
+        output_types = [collapse_if_tuple(output) for output in function.abi["outputs"]]
+        if not data and output_types:
+            raise BadFunctionCallOutput(
+                f"Could not decode output of {function.fn_name} on {function.address}: "
+                "contract not deployed at this block or wrong abi"
+            )
+        decoded = self.web3.codec.decode(output_types, data)
+        normalized = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, decoded)
+        return normalized[0] if len(normalized) == 1 else normalized
@@ -0,0 +1,134 @@
+"""
+Compact pool snapshot records and a streaming decoder for poolSnapshots responses.
+
+Subgraph responses are parsed event by event with ijson, so the full response is never
+materialized as nested dicts. Only the newest snapshot of every pool is kept, holding
+the fields fee collection uses.
+"""
+
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+_ITEM = "data.poolSnapshots.item"
+_SNAPSHOT_FIELDS = {
+    f"{_ITEM}.timestamp": "timestamp",
+    f"{_ITEM}.pool.id": "pool_id",
+    f"{_ITEM}.pool.address": "pool_address",
+    f"{_ITEM}.pool.symbol": "symbol",
+    f"{_ITEM}.pool.totalProtocolFeePaidInBPT": "total_protocol_fee_paid_in_bpt",
+}
+_TOKEN_ITEM = f"{_ITEM}.pool.tokens.item"
+_TOKEN_FIELDS = {
+    f"{_TOKEN_ITEM}.address": 0,
+    f"{_TOKEN_ITEM}.paidProtocolFees": 1,
+}
+
+# (token address, paid protocol fees)
+TokenFees = Tuple[str, Optional[str]]
+
+
+class PoolSnapshot:
+    """
+    Snapshot of a pool. Amounts are kept as the decimal strings returned by the subgraph
+    """
+
+    __slots__ = (
+        "pool_id",
+        "pool_address",
+        "symbol",
+        "timestamp",
+        "total_protocol_fee_paid_in_bpt",
+        "tokens",
+    )
+
+    def __init__(
+        self,
+        pool_id: str = "",
+        pool_address: str = "",
+        symbol: str = "",
+        timestamp: int = 0,
+        total_protocol_fee_paid_in_bpt: Optional[str] = None,
+        tokens: Tuple[TokenFees, ...] = (),
+    ):
+        self.pool_id = pool_id
+        self.pool_address = pool_address
+        self.symbol = symbol
+        self.timestamp = timestamp
+        self.total_protocol_fee_paid_in_bpt = total_protocol_fee_paid_in_bpt
+        self.tokens = tokens
+
+    def paid_protocol_fees(self, token_addr: str) -> Optional[str]:
+        for address, paid_protocol_fees in self.tokens:
+            if address == token_addr:
+                return paid_protocol_fees
+        raise KeyError(token_addr)
+
+    def to_list(self) -> List:
+        return [
+            self.pool_id,
+            self.pool_address,
+            self.symbol,
+            self.timestamp,
+            self.total_protocol_fee_paid_in_bpt,
+            [list(token) for token in self.tokens],
+        ]
+
+    @classmethod
+    def from_list(cls, data: List) -> "PoolSnapshot":
+        *fields, tokens = data
+        return cls(*fields, tokens=tuple(tuple(token) for token in tokens))
+
+
+def add_snapshot(snapshots: Dict[str, PoolSnapshot], snapshot: PoolSnapshot) -> None:
+    """
+    Keep the newest snapshot per pool. Of snapshots with equal timestamps the first one wins
+    """
+    current = snapshots.get(snapshot.pool_id)
+    if current is None or snapshot.timestamp > current.timestamp:
+        snapshots[snapshot.pool_id] = snapshot
+
+
+class SnapshotDecoder:
+    """
+    Incremental decoder of a poolSnapshots response, fed with ijson parse events.
+    Newest snapshots are collected into snapshots, keyed by pool id
+    """
+
+    def __init__(self, snapshots: Dict[str, PoolSnapshot]):
+        self.snapshots = snapshots
+        self.records = 0
+        self.errors: List[str] = []
+        self._snapshot: Optional[PoolSnapshot] = None
+        self._tokens: List[TokenFees] = []
+        self._token: List = []
+
+    def feed(self, prefix: str, event: str, value) -> None:
+        if prefix in _SNAPSHOT_FIELDS:
+            setattr(self._snapshot, _SNAPSHOT_FIELDS[prefix], value)
+        elif prefix in _TOKEN_FIELDS:
+            self._token[_TOKEN_FIELDS[prefix]] = value
+        elif prefix == _TOKEN_ITEM:
+            if event == "start_map":
+                self._token = ["", None]
+            elif event == "end_map":
+                self._tokens.append(tuple(self._token))
+        elif prefix == _ITEM:
+            if event == "start_map":
+                self._snapshot = PoolSnapshot()
+                self._tokens = []
+            elif event == "end_map":
+                self._snapshot.tokens = tuple(self._tokens)
+                add_snapshot(self.snapshots, self._snapshot)
+                self.records += 1
+        elif prefix == "errors.item.message":
+            self.errors.append(value)
+
+    def finish(self) -> int:
+        """
+        Returns number of snapshot records in the response
+        """
+        if self.errors:
+            raise ValueError(f"Pool snapshots query failed: {self.errors}")
+        return self.records
@@ -0,0 +1,150 @@
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+from fee_allocator.accounting.accrual import accrued_usd
+from fee_allocator.accounting.accrual import collect_accrued_fee_info
+from fee_allocator.accounting.accrual import is_tracked
+from fee_allocator.accounting.accrual import pool_fee_deltas
+from fee_allocator.accounting.collectors import collect_fee_info
+from fee_allocator.accounting.settings import Chains
+from fee_allocator.snapshots import PoolSnapshot
+
+BPT_POOL = "0xbpt"
+TOKEN_POOL = "0xtoken"
+TOKEN = "0xtokenaddr"
+
+
+def make_snapshots(bpt_fee, token_fee):
+    return {
+        BPT_POOL: PoolSnapshot(BPT_POOL, "0xa", "BPT", 0, bpt_fee, ()),
+        TOKEN_POOL: PoolSnapshot(
+            TOKEN_POOL, "0xb", "TKN", 0, None, ((TOKEN, token_fee),)
+        ),
+    }
+
+
+def test_pool_fee_deltas():
+    deltas = pool_fee_deltas(
+        [BPT_POOL, TOKEN_POOL, "0xmissing"],
+        make_snapshots("15.5", "7"),
+        {BPT_POOL: make_snapshots("10", "2")[BPT_POOL]},
+    )
+    # Pools without a snapshot before accrued their whole counters
+    assert deltas == {
+        BPT_POOL: {"bpt_token_fee": Decimal("5.5"), "token_fees": {}},
+        TOKEN_POOL: {"bpt_token_fee": Decimal(0), "token_fees": {TOKEN: Decimal(7)}},
+    }
+
+
+def test_collect_accrued_fee_info(mocker):
+    mocker.patch(
+        "fee_allocator.accounting.accrual.get_pools_gauges",
+        return_value=MagicMock(
+            has_alive_preferential_gauge=MagicMock(return_value=True)
+        ),
+    )
+    start, day_one, day_two = (
+        make_snapshots("10", "2"),
+        make_snapshots("12", "3"),
+        make_snapshots("15", "5"),
+    )
+
+    def day(timestamp, snapshots, before):
+        fees = pool_fee_deltas([BPT_POOL, TOKEN_POOL], snapshots, before)
+        for delta in fees.values():
+            delta["bpt_token_fee_in_usd"] = delta["bpt_token_fee"]
+            delta["token_fees_in_usd"] = sum(delta["token_fees"].values(), Decimal(0))
+        return {
+            "timestamp": timestamp,
+            "block": timestamp,
+            "counters": {
+                pool: snapshot.to_list() for pool, snapshot in snapshots.items()
+            },
+            "fees": fees,
+        }
+
+    ledger = {
+        "pools": [BPT_POOL, TOKEN_POOL],
+        "days": [
+            {
+                "timestamp": 0,
+                "block": 0,
+                "counters": {
+                    pool: snapshot.to_list() for pool, snapshot in start.items()
+                },
+                "fees": {},
+            },
+            day(1, day_one, start),
+            day(2, day_two, day_one),
+        ],
+    }
+    assert is_tracked(ledger, [BPT_POOL, TOKEN_POOL])
+    assert not is_tracked(ledger, [BPT_POOL, "0xnew"])
+    assert accrued_usd(ledger) == {BPT_POOL: Decimal(5), TOKEN_POOL: Decimal(3)}
+
+    # Final day on top of the stored ones equals the delta against the epoch start
+    fees = collect_accrued_fee_info(
+        [BPT_POOL, TOKEN_POOL],
+        Chains.MAINNET,
+        make_snapshots("20", "9"),
+        ledger,
+        0,
+        3,
+        {Chains.MAINNET.value: {BPT_POOL: Decimal(2), TOKEN_POOL: None}},
+        {TOKEN: Decimal("1.5")},
+    )
+    assert fees[BPT_POOL]["bpt_token_fee"] == 10
+    assert fees[BPT_POOL]["bpt_token_fee_in_usd"] == Decimal(20)
+    assert fees[TOKEN_POOL]["bpt_token_fee"] == 0
+    assert fees[TOKEN_POOL]["token_fees_in_usd"] == Decimal("10.5")
+
+
+def test_collect_accrued_fee_info_matches_collect_fee_info(mocker):
+    for module in ("accrual", "collectors"):
+        mocker.patch(
+            f"fee_allocator.accounting.{module}.get_pools_gauges",
+            return_value=MagicMock(
+                has_alive_preferential_gauge=MagicMock(return_value=True)
+            ),
+        )
+    new_pool = "0xnew"
+    start = make_snapshots("10.25", "2.5")
+    day_one = make_snapshots("12.5", "3.75")
+    now = {
+        **make_snapshots("15.75", "7.125"),
+        # Created during the epoch, so it has no snapshot at the start
+        new_pool: PoolSnapshot(new_pool, "0xc", "NEW", 0, "4.5", ()),
+    }
+    pools = [BPT_POOL, TOKEN_POOL, new_pool, "0xmissing"]
+    bpt_twap_prices = {
+        Chains.MAINNET.value: {
+            BPT_POOL: Decimal("2.5"),
+            TOKEN_POOL: None,
+            new_pool: Decimal(3),
+        }
+    }
+    token_prices = {TOKEN: Decimal("1.5")}
+    expected = collect_fee_info(
+        pools, Chains.MAINNET, now, start, 0, 2, bpt_twap_prices, token_prices
+    )
+
+    def counters(snapshots):
+        return {pool: snapshot.to_list() for pool, snapshot in snapshots.items()}
+
+    baseline = {"timestamp": 0, "block": 0, "counters": counters(start), "fees": {}}
+    tracked_days = [
+        baseline,
+        {
+            "timestamp": 1,
+            "block": 1,
+            "counters": counters(day_one),
+            "fees": pool_fee_deltas([BPT_POOL, TOKEN_POOL], day_one, start),
+        },
+    ]
+    # Same fees whether days in between were tracked or not
+    for days in ([baseline], tracked_days):
+        ledger = {"pools": [BPT_POOL, TOKEN_POOL], "days": days}
+        fees = collect_accrued_fee_info(
+            pools, Chains.MAINNET, now, ledger, 0, 2, bpt_twap_prices, token_prices
+        )
+        assert fees == expected
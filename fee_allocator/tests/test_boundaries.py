@@ -0,0 +1,38 @@
+from fee_allocator.accounting.boundaries import save_boundary
+from fee_allocator.accounting.boundaries import seed_start_boundary
+from fee_allocator.cache import disk_cache_get
+from fee_allocator.helpers import get_balancer_pool_snapshots
+from fee_allocator.snapshots import PoolSnapshot
+
+EPOCH_END = 1_712_793_600
+POOL_A = "0x" + "a" * 64
+POOL_B = "0x" + "b" * 64
+
+
+def test_end_boundary_seeds_next_start(mocker, tmp_path):
+    mocker.patch("fee_allocator.cache.CACHE_DIR", str(tmp_path / "cache"))
+    mocker.patch("fee_allocator.accounting.boundaries.BOUNDARIES_DIR", str(tmp_path))
+    mocker.patch(
+        "fee_allocator.accounting.boundaries.get_subgraph_url",
+        return_value="https://subgraph",
+    )
+    snapshots = {
+        POOL_A: PoolSnapshot(POOL_A, POOL_A[:42], "A", EPOCH_END, "1.5"),
+        POOL_B: PoolSnapshot(
+            POOL_B, POOL_B[:42], "B", EPOCH_END, None, (("0x1", "2"),)
+        ),
+    }
+    save_boundary("mainnet", EPOCH_END, 19_000_000, snapshots, [POOL_A])
+
+    # Snapshots missing a core pool of the next epoch are not reused, the block is
+    assert not seed_start_boundary("mainnet", EPOCH_END, [POOL_A, POOL_B])
+    assert disk_cache_get("blocks", f"mainnet:{EPOCH_END}") == 19_000_000
+    assert disk_cache_get("pool_snapshots", "https://subgraph:19000000") is None
+
+    assert seed_start_boundary("mainnet", EPOCH_END, [POOL_A])
+    fetch = mocker.patch("fee_allocator.helpers.get_endpoint_group")
+    seeded = get_balancer_pool_snapshots(19_000_000, "https://subgraph")
+    assert seeded[POOL_A].total_protocol_fee_paid_in_bpt == "1.5"
+    assert list(seeded) == [POOL_A]
+    fetch.assert_not_called()
+    assert not seed_start_boundary("arbitrum", EPOCH_END, [POOL_A])
@@ -0,0 +1,81 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import pytest
+
+from fee_allocator.cache import disk_cache_get
+from fee_allocator.cache import disk_cache_set
+from fee_allocator.cache import SingleFlight
+from fee_allocator.cache import prune_disk_cache
+from fee_allocator.cache import ttl_cache
+
+
+def test_ttl_cache(mocker):
+    now = mocker.patch("fee_allocator.cache.time.monotonic", return_value=100.0)
+    calls = []
+
+    @ttl_cache(60)
+    def fetch(chain: str, block: int = 0):
+        calls.append((chain, block))
+        return len(calls)
+
+    assert fetch("mainnet") == fetch("mainnet") == 1
+    assert fetch("mainnet", block=1) == 2
+    assert fetch.cache_size() == 2
+    # Entries expire after ttl seconds
+    now.return_value = 160.0
+    assert fetch("mainnet") == 3
+    fetch.cache_clear()
+    assert fetch("mainnet") == 4
+    assert calls == [("mainnet", 0), ("mainnet", 1), ("mainnet", 0), ("mainnet", 0)]
+
+
+def test_disk_cache(mocker, tmp_path):
+    mocker.patch("fee_allocator.cache.CACHE_DIR", str(tmp_path))
+    assert disk_cache_get("prices", "mainnet:0xba") is None
+    prices = {"fetched_at": 1, "prices": [{"price": Decimal("1.000001")}]}
+    disk_cache_set("prices", "mainnet:0xba", prices)
+    assert disk_cache_get("prices", "mainnet:0xba") == prices
+    assert disk_cache_get("blocks", "mainnet:0xba") is None
+    assert prune_disk_cache(60) == 0
+    mocker.patch("fee_allocator.cache.time.time", return_value=time.time() + 61)
+    assert prune_disk_cache(60) == 1
+    assert disk_cache_get("prices", "mainnet:0xba") is None
+
+
+def test_single_flight():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch_block():
+        calls.append(1)
+        release.wait(5)
+        return 123
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(single_flight.call, "blocks", ("mainnet", 1), fetch_block)
+            for _ in range(4)
+        ]
+        # Let every thread join the in-flight call before it completes
+        while single_flight.report()["blocks"]["saved"] < 3:
+            time.sleep(0.01)
+        release.set()
+        assert [future.result() for future in futures] == [123] * 4
+    # Completed calls are memoized until reset
+    assert single_flight.call("blocks", ("mainnet", 1), fetch_block) == 123
+    assert len(calls) == 1
+    assert single_flight.report() == {"blocks": {"calls": 1, "saved": 4}}
+
+    def fail():
+        raise ValueError("503")
+
+    with pytest.raises(ValueError):
+        single_flight.call("prices", "0xba", fail)
+    # Failures are not memoized
+    assert single_flight.call("prices", "0xba", lambda: 1) == 1
+    single_flight.reset()
+    assert single_flight.report() == {}
@@ -0,0 +1,57 @@
+import time
+from unittest.mock import MagicMock
+
+from munch import Munch
+
+from fee_allocator.accounting.cache_warmer import warm_caches
+from fee_allocator.accounting.fee_pipeline import fetch_core_pools
+from fee_allocator.cache import disk_cache_set
+
+CORE_POOLS = {"mainnet": {"0xpool1": "P1", "0xpool2": "P2"}, "arbitrum": {}}
+TOKEN_A = "0x" + "1" * 40
+TOKEN_B = "0x" + "2" * 40
+
+
+def test_warm_caches(mocker, tmp_path):
+    mocker.patch("fee_allocator.cache.CACHE_DIR", str(tmp_path))
+    module = "fee_allocator.accounting.cache_warmer"
+    mocker.patch(f"{module}.fetch_pipeline_configs", return_value=(CORE_POOLS, {}, {}))
+    mocker.patch(
+        f"{module}.get_valid_core_pools", side_effect=lambda chain, pools: pools
+    )
+    mocker.patch(f"{module}.BLOCK_SAMPLE_INTERVAL", 3600)
+    mocker.patch(f"{module}.get_block_by_ts", side_effect=lambda ts, chain: ts // 12)
+    mocker.patch(f"{module}.get_subgraph_url", side_effect=lambda chain: chain)
+    snapshots = mocker.patch(f"{module}.get_balancer_pool_snapshots")
+    mocker.patch(f"{module}.get_pools_tokens", return_value=[TOKEN_A, TOKEN_B])
+    metadata = mocker.patch(f"{module}.get_tokens_metadata")
+    prices = mocker.patch(f"{module}.get_token_price_history")
+    # A stale cache file is pruned
+    disk_cache_set("blocks", "stale", 1)
+    mocker.patch(f"{module}.CACHE_MAX_AGE_DAYS", -1)
+
+    stats = warm_caches(Munch(mainnet=MagicMock()), 86400, 0)
+    # Block samples are only stored for chains with core pools
+    assert stats == {"pruned": 1, "blocks": 24, "tokens": 2}
+    snapshots.assert_called_once_with(0, "mainnet")
+    metadata.assert_called_once()
+    assert prices.call_count == 2
+    # The core pools list is stored for the next runs
+    fetch = mocker.patch("fee_allocator.accounting.fee_pipeline.requests.get")
+    assert fetch_core_pools() == CORE_POOLS
+    fetch.assert_not_called()
+
+
+def test_fetch_core_pools_refetches_stale_list(mocker, tmp_path):
+    mocker.patch("fee_allocator.cache.CACHE_DIR", str(tmp_path))
+    fetch = mocker.patch("fee_allocator.accounting.fee_pipeline.requests.get")
+    fetch.return_value.json.return_value = CORE_POOLS
+    disk_cache_set(
+        "configs",
+        "core_pools",
+        {"fetched_at": int(time.time()) - 3600, "core_pools": {"mainnet": {}}},
+    )
+    assert fetch_core_pools() == CORE_POOLS
+    # The fresh list is stored and reused
+    assert fetch_core_pools() == CORE_POOLS
+    assert fetch.call_count == 1
@@ -0,0 +1,184 @@
+import copy
+from decimal import Decimal
+
+from hypothesis import assume
+from hypothesis import given
+from hypothesis import strategies as st
+
+from fee_allocator.accounting.distribution import handle_aura_min
+from fee_allocator.accounting.distribution import re_distribute_incentives
+from fee_allocator.accounting.distribution import solve_aura_min
+from fee_allocator.accounting.money import from_micro
+
+BUFFER = Decimal("0.25")
+
+
+def make_incentives(pools):
+    return {
+        f"0x{index:064x}": {
+            "chain": "mainnet",
+            "total_incentives": from_micro(total),
+            "aura_incentives": from_micro(aura),
+            "bal_incentives": from_micro(total - aura),
+        }
+        for index, (total, aura) in enumerate(pools)
+    }
+
+
+# (total incentives, aura incentives) in micro-USDC, up to 5000 USDC per pool
+pools_strategy = st.lists(
+    st.integers(min_value=0, max_value=5_000_000_000).flatmap(
+        lambda total: st.tuples(
+            st.just(total), st.integers(min_value=0, max_value=total)
+        )
+    ),
+    max_size=30,
+)
+min_aura_strategy = st.sampled_from([1, 100, 500, 1000]).map(Decimal)
+
+
+@given(pools_strategy, min_aura_strategy, st.data())
+def test_solve_aura_min_invariants(pools, min_aura_incentive, data):
+    incentives = make_incentives(pools)
+    overrides = {
+        pool_id: {"voting_pool_override": "bal"}
+        for pool_id in incentives
+        if data.draw(st.booleans())
+    }
+    total_aura = sum(_data["aura_incentives"] for _data in incentives.values())
+    result, unrepaid_debt = solve_aura_min(
+        copy.deepcopy(incentives), min_aura_incentive, overrides, BUFFER
+    )
+    assert unrepaid_debt >= 0
+    assert sum(_data["aura_incentives"] for _data in result.values()) == (
+        total_aura - unrepaid_debt
+    )
+    for pool_id, _data in result.items():
+        assert _data["aura_incentives"] >= 0 and _data["bal_incentives"] >= 0
+        assert (
+            _data["aura_incentives"] + _data["bal_incentives"]
+            == incentives[pool_id]["total_incentives"]
+        )
+        assert (
+            _data["aura_incentives"] == 0
+            or _data["aura_incentives"] >= min_aura_incentive
+        )
+        if pool_id in overrides:
+            assert _data["aura_incentives"] == 0
+        elif incentives[pool_id]["aura_incentives"] >= min_aura_incentive:
+            assert _data["aura_incentives"] >= incentives[pool_id]["aura_incentives"]
+
+
+@given(pools_strategy, min_aura_strategy)
+def test_solve_aura_min_matches_two_passes(pools, min_aura_incentive):
+    incentives = make_incentives(pools)
+    two_passes = handle_aura_min(
+        handle_aura_min(
+            copy.deepcopy(incentives), min_aura_incentive * (1 - BUFFER), {}
+        ),
+        min_aura_incentive,
+        {},
+    )
+    result, unrepaid_debt = solve_aura_min(
+        copy.deepcopy(incentives), min_aura_incentive, {}, BUFFER
+    )
+    total_aura = sum(_data["aura_incentives"] for _data in incentives.values())
+    two_passes_unrepaid = total_aura - sum(
+        Decimal(_data["aura_incentives"]) for _data in two_passes.values()
+    )
+    # Never repays less and never keeps fewer Aura pools than the two passes
+    assert unrepaid_debt <= two_passes_unrepaid
+    assert sum(_data["aura_incentives"] > 0 for _data in result.values()) >= sum(
+        _data["aura_incentives"] > 0 for _data in two_passes.values()
+    )
+
+
+@given(st.data(), min_aura_strategy)
+def test_solve_aura_min_equals_two_passes_without_pools_in_buffer(
+    data, min_aura_incentive
+):
+    min_aura = int(min_aura_incentive) * 10**6
+    min_candidate_aura = int(min_aura * (1 - BUFFER))
+    # (aura incentives, bal incentives), no pool has Aura incentives within the buffer
+    aura_strategy = st.one_of(
+        st.integers(min_value=0, max_value=min_candidate_aura - 1),
+        st.integers(min_value=min_aura, max_value=5_000_000_000),
+    )
+    pools = data.draw(
+        st.lists(
+            st.tuples(aura_strategy, st.integers(min_value=0, max_value=5_000_000_000)),
+            max_size=30,
+        )
+    )
+    # No pool over the min runs out of BAL incentives while taking its share of the debt
+    debt = sum(aura for aura, _ in pools if aura < min_aura)
+    bal_over_min = [bal for aura, bal in pools if aura >= min_aura]
+    assume(all(bal >= -(-debt // len(bal_over_min)) for bal in bal_over_min))
+    incentives = make_incentives([(aura + bal, aura) for aura, bal in pools])
+    two_passes = handle_aura_min(
+        handle_aura_min(
+            copy.deepcopy(incentives), min_aura_incentive * (1 - BUFFER), {}
+        ),
+        min_aura_incentive,
+        {},
+    )
+    result, unrepaid_debt = solve_aura_min(
+        copy.deepcopy(incentives), min_aura_incentive, {}, BUFFER
+    )
+    assert result == two_passes
+    total_aura = sum(_data["aura_incentives"] for _data in incentives.values())
+    assert unrepaid_debt == total_aura - sum(
+        _data["aura_incentives"] for _data in two_passes.values()
+    )
+
+
+def test_solve_aura_min_tops_up_and_reports_residual():
+    incentives = make_incentives(
+        [
+            (1_000_000_000, 600_000_000),
+            (1_000_000_000, 450_000_000),
+            (800_000_000, 400_000_000),
+            (300_000_000, 100_000_000),
+        ]
+    )
+    result, unrepaid_debt = solve_aura_min(incentives, Decimal(500), {}, BUFFER)
+    aura = [_data["aura_incentives"] for _data in result.values()]
+    # Pool 3 can't hold 500 and the Aura total tops up only one of pools 1 and 2, the larger one.
+    # 50 of the 500 Aura debt tops pool 1 up to 500, the rest is split evenly
+    assert aura == [Decimal("825"), Decimal("725"), Decimal(0), Decimal(0)]
+    assert unrepaid_debt == 0
+    # No pool can take Aura, all of it is reported as unrepaid
+    incentives = make_incentives(
+        [(800_000_000, 600_000_000), (300_000_000, 100_000_000)]
+    )
+    overrides = {next(iter(incentives)): {"voting_pool_override": "bal"}}
+    result, unrepaid_debt = solve_aura_min(incentives, Decimal(500), overrides, BUFFER)
+    assert [_data["aura_incentives"] for _data in result.values()] == [0, 0]
+    assert unrepaid_debt == Decimal(700)
+
+
+def test_re_distribute_incentives_splits_sums_once():
+    incentives = make_incentives(
+        [
+            (1_000_000_000, 600_000_000),
+            (2_000_000_000, 1_200_000_000),
+            (100_000_001, 50_000_000),
+            (100_000_001, 50_000_001),
+        ]
+    )
+    for _data, earned_fees in zip(incentives.values(), [1, 2, 0, 0]):
+        _data.update(earned_fees=Decimal(earned_fees), redirected_incentives=Decimal(0))
+    result = re_distribute_incentives(
+        incentives, Decimal(0), Decimal(250), Decimal(0), {}
+    )
+    receiving = list(result.values())[:2]
+    # 200.000002 redistributed, 100.000001 Aura and 100.000001 BAL, split 1:2 once each
+    assert [_data["aura_incentives"] for _data in receiving] == [
+        Decimal("633.333334"),
+        Decimal("1266.666667"),
+    ]
+    assert [_data["bal_incentives"] for _data in receiving] == [
+        Decimal("433.333334"),
+        Decimal("866.666667"),
+    ]
+    assert sum(_data["redirected_incentives"] for _data in result.values()) == 0
@@ -0,0 +1,40 @@
+import threading
+
+import pytest
+
+from fee_allocator.endpoints import EndpointGroup
+
+
+def test_endpoint_group_fails_over():
+    group = EndpointGroup(["https://rpc-1", "https://rpc-2"])
+
+    def fetch(url):
+        if url == "https://rpc-1":
+            raise ConnectionError(url)
+        return url
+
+    assert group.request(fetch) == "https://rpc-2"
+    # Failed endpoint is skipped until the cooldown passes
+    assert group.ranked() == ["https://rpc-2"]
+    assert group.report()["https://rpc-1"]["failures"] == 1
+    with pytest.raises(ConnectionError):
+        EndpointGroup(["https://rpc-1"]).request(fetch)
+
+
+def test_endpoint_group_hedges_slow_requests(mocker):
+    mocker.patch("fee_allocator.endpoints.HEDGE_MIN_SAMPLES", 1)
+    group = EndpointGroup(["https://rpc-1", "https://rpc-2"])
+    group._latencies["https://rpc-1"].append(0.01)
+    group._latencies["https://rpc-2"].append(0.05)
+    release = threading.Event()
+
+    def fetch(url):
+        # The fastest endpoint stalls, well over its p95 latency
+        if url == "https://rpc-1":
+            release.wait(5)
+        return url
+
+    assert group.ranked() == ["https://rpc-1", "https://rpc-2"]
+    assert group.request(fetch) == "https://rpc-2"
+    assert group.hedged == 1
+    release.set()
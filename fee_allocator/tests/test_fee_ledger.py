@@ -0,0 +1,74 @@
+import json
+from datetime import date
+from datetime import datetime
+from datetime import timezone
+
+from fee_allocator.accounting.fee_ledger import get_epoch_fees
+from fee_allocator.accounting.fee_ledger import get_report_fees
+from fee_allocator.accounting.fee_ledger import missing_epochs
+from fee_allocator.accounting.fee_ledger import sync_fee_ledger
+
+
+def test_sync_fee_ledger(mocker, tmp_path):
+    mocker.patch("fee_allocator.cache.CACHE_DIR", str(tmp_path / "cache"))
+    mocker.patch("fee_allocator.accounting.fee_ledger.FEES_COLLECTED_DIR", tmp_path)
+    mocker.patch(
+        "fee_allocator.accounting.fee_ledger.LEDGER_FILE", tmp_path / "ledger.json"
+    )
+    # Older reports are in USDC, Mimic reports in micro-USDC
+    (tmp_path / "fees_2024-01-04_2024-01-18.json").write_text(
+        json.dumps({"mainnet": 100, "arbitrum": 2.5})
+    )
+    (tmp_path / "fees_2024-01-18_2024-02-01.json").write_text(
+        json.dumps({"mainnet": 3_000_000, "arbitrum": 0})
+    )
+    (tmp_path / "current_fees_collected.json").write_text(json.dumps({"mainnet": 0}))
+
+    def get(url, params, timeout):
+        response = mocker.Mock()
+        # The report of the last epoch isn't ready yet
+        amount = 0 if params["endDate"] == "2024-02-29" else 7_000_000
+        response.json.return_value = {"depositors": {"mainnet": str(amount)}}
+        return response
+
+    mimic = mocker.patch(
+        "fee_allocator.accounting.fee_ledger.requests.get", side_effect=get
+    )
+    epochs = sync_fee_ledger(until=date(2024, 3, 1))
+    assert list(epochs) == [
+        "2024-01-04_2024-01-18",
+        "2024-01-18_2024-02-01",
+        "2024-02-01_2024-02-15",
+    ]
+    assert epochs["2024-01-04_2024-01-18"]["fees"] == {
+        "mainnet": 100_000_000,
+        "arbitrum": 2_500_000,
+    }
+    assert json.loads((tmp_path / "fees_2024-02-01_2024-02-15.json").read_text()) == {
+        "mainnet": 7_000_000
+    }
+    assert mimic.call_count == 2
+
+    # Reports fetched before are cached, the missing one is retried
+    sync_fee_ledger(until=date(2024, 3, 1))
+    assert mimic.call_count == 3
+    ts_now = int(datetime(2024, 2, 1, tzinfo=timezone.utc).timestamp())
+    assert get_epoch_fees(ts_now) == {"mainnet": 3.0, "arbitrum": 0.0}
+    assert get_epoch_fees(ts_now + 86400) is None
+    assert get_report_fees("fees_2024-02-01_2024-02-15.json") == {"mainnet": 7.0}
+    assert get_report_fees("current_fees_collected.json") is None
+
+
+def test_missing_epochs_finds_gaps():
+    epochs = {
+        f"{start}_{end}": {"start": start, "end": end}
+        for start, end in [
+            ("2025-02-27", "2025-03-13"),
+            ("2025-03-13", "2025-03-27"),
+            ("2025-04-10", "2025-04-24"),
+        ]
+    }
+    assert missing_epochs(epochs, date(2025, 5, 10)) == [
+        (date(2025, 3, 27), date(2025, 4, 10)),
+        (date(2025, 4, 24), date(2025, 5, 8)),
+    ]
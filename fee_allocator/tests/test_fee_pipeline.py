@@ -0,0 +1,184 @@
+import asyncio
+import copy
+from decimal import Decimal
+from unittest.mock import AsyncMock
+from unittest.mock import MagicMock
+
+from munch import Munch
+
+from fee_allocator.accounting import fee_pipeline
+from fee_allocator.accounting.fee_pipeline import run_fees
+from fee_allocator.accounting.fee_pipeline_async import run_fees_async
+from fee_allocator.snapshots import PoolSnapshot
+
+# Not an epoch boundary, so no boundary is stored
+TS_NOW = 1_700_000_000
+TS_2_WEEKS_AGO = TS_NOW - 14 * 86400
+TOKEN = "0xtokenaddr"
+CORE_POOLS = {
+    "mainnet": {"0xbptmainnet": "BPT-MAINNET", "0xtokenmainnet": "TKN-MAINNET"},
+    "arbitrum": {"0xbptarbitrum": "BPT-ARBITRUM"},
+}
+FEE_CONSTANTS = {
+    "min_aura_incentive": 500,
+    "dao_share_pct": "0.175",
+    "vebal_share_pct": "0.125",
+    "min_existing_aura_incentive": 50,
+    "min_vote_incentive_amount": 250,
+}
+REROUTE_CONFIG = {}
+OVERRIDES = {}
+FEES_TO_DISTRIBUTE = {"mainnet": 10_000.0, "arbitrum": 2_000.0}
+MAPPED_POOLS_INFO = {
+    pool_id: f"0xgauge{pool_id[2:]}"
+    for pools in CORE_POOLS.values()
+    for pool_id in pools
+}
+
+
+def block_at(timestamp, chain):
+    return timestamp // 12
+
+
+def snapshots_at(block, graph_url):
+    # Fee counters grow with the block, so every pool paid fees in the period
+    return {
+        pool_id: PoolSnapshot(
+            pool_id,
+            f"0x{index}",
+            symbol,
+            block,
+            None if pool_id.startswith("0xtoken") else str(block * (index + 1) / 1000),
+            ((TOKEN, str(block / 100)),) if pool_id.startswith("0xtoken") else (),
+        )
+        for pools in CORE_POOLS.values()
+        for index, (pool_id, symbol) in enumerate(pools.items())
+    }
+
+
+def bpt_price(pool_id, chain, *args):
+    return Decimal("1.5") if chain == "mainnet" else Decimal("2.25")
+
+
+def patch_shared(mocker, tmp_path):
+    mocker.patch("fee_allocator.cache.CACHE_DIR", str(tmp_path))
+    alive = MagicMock(has_alive_preferential_gauge=MagicMock(return_value=True))
+    mocker.patch(
+        "fee_allocator.accounting.fee_pipeline.get_pools_gauges", return_value=alive
+    )
+    mocker.patch(
+        "fee_allocator.accounting.collectors.get_pools_gauges", return_value=alive
+    )
+    mocker.patch(
+        "fee_allocator.accounting.distribution.get_last_join_exit",
+        return_value=TS_NOW - 3600,
+    )
+    for module in ("fee_pipeline", "fee_pipeline_async"):
+        mocker.patch(
+            f"fee_allocator.accounting.{module}.save_incentives",
+            side_effect=lambda incentives, output_file_name: incentives,
+        )
+
+
+def run_sync(mocker):
+    module = "fee_allocator.accounting.fee_pipeline"
+    mocker.patch(
+        f"{module}.fetch_pipeline_configs",
+        return_value=(CORE_POOLS, FEE_CONSTANTS, REROUTE_CONFIG),
+    )
+    mocker.patch(f"{module}.fetch_overrides", return_value=OVERRIDES)
+    mocker.patch(f"{module}.fetch_hh_aura_bribs", return_value=[])
+    mocker.patch(f"{module}.calculate_aura_vebal_share", return_value=Decimal("0.5"))
+    mocker.patch(f"{module}.seed_start_boundary", return_value=False)
+    mocker.patch(f"{module}.build_fetch_plan")
+    mocker.patch(f"{module}.format_fetch_plan", return_value="")
+    mocker.patch(f"{module}.execute_fetch_plan")
+    mocker.patch(f"{module}.save_run_manifest", return_value="")
+    mocker.patch(f"{module}.get_block_by_ts", side_effect=block_at)
+    mocker.patch(f"{module}.get_subgraph_url", side_effect=lambda chain: chain)
+    mocker.patch(f"{module}.get_balancer_pool_snapshots", side_effect=snapshots_at)
+    mocker.patch(
+        f"{module}.get_twap_bpt_prices",
+        side_effect=lambda pools, chain, *args: {
+            pool_id: bpt_price(pool_id, chain) for pool_id in pools
+        },
+    )
+    mocker.patch(
+        "fee_allocator.accounting.collectors.fetch_token_price_balgql_timerange",
+        return_value=Decimal("3.1"),
+    )
+    mocker.patch(
+        "fee_allocator.accounting.freshness.get_blocks_subgraph_url", return_value=None
+    )
+    mocker.patch(
+        "fee_allocator.accounting.freshness.get_subgraph_url", return_value=None
+    )
+    return run_fees(
+        Munch(mainnet=MagicMock(), arbitrum=MagicMock()),
+        TS_NOW,
+        TS_2_WEEKS_AGO,
+        "parity.csv",
+        copy.deepcopy(FEES_TO_DISTRIBUTE),
+        MAPPED_POOLS_INFO,
+        recompute=True,
+    )
+
+
+def run_async(mocker):
+    module = "fee_allocator.accounting.fee_pipeline_async"
+    mocker.patch(
+        f"{module}.fetch_pipeline_configs_async",
+        AsyncMock(return_value=(CORE_POOLS, FEE_CONSTANTS, REROUTE_CONFIG, OVERRIDES)),
+    )
+    mocker.patch(f"{module}.fetch_hh_aura_bribs_async", AsyncMock(return_value=[]))
+    mocker.patch(
+        f"{module}.calculate_aura_vebal_share_async",
+        AsyncMock(return_value=Decimal("0.5")),
+    )
+    mocker.patch(f"{module}.get_async_web3")
+    mocker.patch(f"{module}.get_subgraph_url", side_effect=lambda chain: chain)
+    mocker.patch(
+        f"{module}.get_alive_gauge_pools_async",
+        AsyncMock(side_effect=lambda chain, pool_ids: set(pool_ids)),
+    )
+    mocker.patch(
+        f"{module}.get_last_join_exit_async", AsyncMock(return_value=TS_NOW - 3600)
+    )
+    mocker.patch(f"{module}.get_block_by_ts_async", AsyncMock(side_effect=block_at))
+    mocker.patch(
+        f"{module}.get_balancer_pool_snapshots_async",
+        AsyncMock(side_effect=snapshots_at),
+    )
+    mocker.patch(f"{module}.get_twap_bpt_price_async", AsyncMock(side_effect=bpt_price))
+    mocker.patch(
+        "fee_allocator.helpers_async.fetch_token_price_balgql_timerange_async",
+        AsyncMock(return_value=Decimal("3.1")),
+    )
+    mocker.patch(
+        "fee_allocator.accounting.freshness_async.get_blocks_subgraph_url",
+        return_value=None,
+    )
+    mocker.patch(
+        "fee_allocator.accounting.freshness_async.get_subgraph_url", return_value=None
+    )
+    return asyncio.run(
+        run_fees_async(
+            Munch(mainnet=MagicMock(), arbitrum=MagicMock()),
+            TS_NOW,
+            TS_2_WEEKS_AGO,
+            "parity.csv",
+            copy.deepcopy(FEES_TO_DISTRIBUTE),
+            MAPPED_POOLS_INFO,
+        )
+    )
+
+
+def test_async_pipeline_matches_sync_pipeline(mocker, tmp_path):
+    patch_shared(mocker, tmp_path)
+    sync_incentives = run_sync(mocker)
+    # Previews don't store a run manifest
+    fee_pipeline.save_run_manifest.assert_not_called()
+    async_incentives = run_async(mocker)
+    assert set(sync_incentives) == {"mainnet", "arbitrum"}
+    assert all(sync_incentives.values())
+    assert async_incentives == sync_incentives
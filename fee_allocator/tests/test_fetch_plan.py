@@ -0,0 +1,126 @@
+from unittest.mock import MagicMock
+
+from munch import Munch
+
+from fee_allocator.accounting.fetch_plan import SNAPSHOT_PAGES
+from fee_allocator.accounting.fetch_plan import build_fetch_plan
+from fee_allocator.accounting.fetch_plan import execute_fetch_plan
+from fee_allocator.accounting.stages import reset_stages
+from fee_allocator.accounting.stages import stage_runs
+from fee_allocator.cache import disk_cache_set
+
+TS_NOW = 1_700_000_000
+TS_2_WEEKS_AGO = TS_NOW - 14 * 86400
+TOKEN_A = "0x" + "a" * 40
+TOKEN_B = "0x" + "b" * 40
+TOKEN_C = "0x" + "c" * 40
+CORE_POOLS = {
+    "mainnet": {"0xpool1": "P1", "0xpool2": "P2"},
+    "arbitrum": {"0xpool3": "P3"},
+    # No fees to distribute on polygon, it is left out of the plan
+    "polygon": {"0xpool4": "P4"},
+}
+FEES_TO_DISTRIBUTE = {"mainnet": 100.0, "arbitrum": 10.0}
+
+
+def plan_fixture(mocker, tmp_path):
+    mocker.patch("fee_allocator.cache.CACHE_DIR", str(tmp_path))
+    mocker.patch("fee_allocator.accounting.fetch_plan.get_batch_size", return_value=4)
+    mocker.patch("fee_allocator.accounting.fetch_plan.PLAN_AVG_POOL_TOKENS", 2)
+    mocker.patch(
+        "fee_allocator.accounting.fetch_plan.get_subgraph_url",
+        side_effect=lambda chain: chain,
+    )
+    # Tokens of mainnet pools are known, token B is shared by both pools
+    disk_cache_set("pool_tokens", "mainnet:0xpool1", [TOKEN_A, TOKEN_B])
+    disk_cache_set("pool_tokens", "mainnet:0xpool2", [TOKEN_B, TOKEN_C])
+    disk_cache_set("blocks", f"mainnet:{TS_2_WEEKS_AGO}", 100)
+    disk_cache_set("pool_snapshots", "mainnet:100", [])
+    disk_cache_set("tokens", f"mainnet:{TOKEN_A}", [18, "A", "A"])
+    disk_cache_set("prices", f"mainnet:{TOKEN_A}", {"fetched_at": TS_NOW, "prices": []})
+    # Prices fetched before the end of the epoch are stale
+    disk_cache_set(
+        "prices", f"mainnet:{TOKEN_B}", {"fetched_at": TS_NOW - 1, "prices": []}
+    )
+    return build_fetch_plan(CORE_POOLS, FEES_TO_DISTRIBUTE, TS_NOW, TS_2_WEEKS_AGO)
+
+
+def test_build_fetch_plan(mocker, tmp_path):
+    plan = plan_fixture(mocker, tmp_path)
+    assert plan.pools == {"mainnet": ["0xpool1", "0xpool2"], "arbitrum": ["0xpool3"]}
+    # Block now of mainnet is needed once, for collection and the aura veBAL share
+    assert plan.blocks == [
+        ("arbitrum", TS_2_WEEKS_AGO),
+        ("arbitrum", TS_NOW),
+        ("mainnet", TS_2_WEEKS_AGO),
+        ("mainnet", TS_NOW),
+    ]
+    assert plan.tokens == {"mainnet": [TOKEN_A, TOKEN_B, TOKEN_C], "arbitrum": []}
+    stages = {
+        stage.name: (stage.items, stage.cached, stage.requests) for stage in plan.stages
+    }
+    assert stages["blocks"] == (4, 1, 3)
+    assert stages["gauge checks"] == (3, 0, 3)
+    # 4 reads per pool, mainnet and arbitrum pools in 2 batches each
+    assert stages["pool reads"] == (12, 0, 4)
+    # 3 metadata calls per token, the unknown arbitrum pool counts 2 tokens
+    assert stages["token metadata"] == (15, 3, 4)
+    assert stages["token prices"] == (5, 1, 4)
+    assert stages["pool snapshots"] == (4 * SNAPSHOT_PAGES, SNAPSHOT_PAGES, 15)
+
+
+def test_execute_fetch_plan(mocker, tmp_path):
+    plan = plan_fixture(mocker, tmp_path)
+    module = "fee_allocator.accounting.fetch_plan"
+    web3_instances = Munch(mainnet=MagicMock(), arbitrum=MagicMock())
+    pools_tokens = mocker.patch(f"{module}.get_pools_tokens", return_value=[TOKEN_A])
+    metadata = mocker.patch(
+        f"{module}.get_tokens_metadata",
+        side_effect=lambda web3, chain, tokens: [(18, "T", "T")] * len(tokens),
+    )
+    prices = mocker.patch(f"{module}.get_token_price_history")
+    blocks = mocker.patch(
+        f"{module}.get_block_by_ts", side_effect=lambda ts, chain: ts // 12
+    )
+    pool_reads = mocker.patch(f"{module}.get_pools_state")
+    snapshots = mocker.patch(f"{module}.get_balancer_pool_snapshots")
+    reset_stages()
+
+    # Only chains yielded so far are prefetched, tokens right away
+    resolved = execute_fetch_plan(plan, web3_instances, ["arbitrum"])
+    assert resolved == {
+        ("arbitrum", TS_2_WEEKS_AGO): TS_2_WEEKS_AGO // 12,
+        ("arbitrum", TS_NOW): TS_NOW // 12,
+    }
+    # Tokens of the pool missing from the cache are read in one batch
+    pools_tokens.assert_called_once_with(
+        web3_instances.arbitrum, "arbitrum", ["0xpool3"]
+    )
+    assert plan.tokens["arbitrum"] == [TOKEN_A]
+    assert sorted(call.args[:2] for call in prices.call_args_list) == [
+        (TOKEN_A, "arbitrum"),
+        (TOKEN_A, "mainnet"),
+        (TOKEN_B, "mainnet"),
+        (TOKEN_C, "mainnet"),
+    ]
+    assert sorted(call.args[1:] for call in metadata.call_args_list) == [
+        ("arbitrum", [TOKEN_A]),
+        ("mainnet", [TOKEN_A, TOKEN_B, TOKEN_C]),
+    ]
+    assert [(run["stage"], run["fallback"]) for run in stage_runs()] == [
+        ("token_metadata", False)
+    ] * 2
+    pool_reads.assert_called_once_with(
+        web3_instances.arbitrum, "arbitrum", ["0xpool3"], [TS_NOW // 12]
+    )
+    assert sorted(call.args for call in snapshots.call_args_list) == [
+        (TS_2_WEEKS_AGO // 12, "arbitrum"),
+        (TS_NOW // 12, "arbitrum"),
+    ]
+
+    blocks.reset_mock()
+    assert len(execute_fetch_plan(plan, web3_instances)) == 4
+    assert {call.args for call in blocks.call_args_list} >= {
+        (ts, chain) for chain, ts in plan.blocks
+    }
+    assert pool_reads.call_count == 3
@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+from unittest.mock import AsyncMock
+
+import pytest
+
+from fee_allocator.accounting.freshness import FreshnessGate
+from fee_allocator.accounting.freshness import SubgraphNotIndexed
+from fee_allocator.accounting.freshness_async import AsyncFreshnessGate
+from fee_allocator.helpers import BLOCK_SEARCH_WINDOW
+
+TIMESTAMP = 1_700_000_000
+TARGET_BLOCK = 18_500_000
+
+
+def test_freshness_gate(mocker):
+    mocker.patch(
+        "fee_allocator.accounting.freshness.get_subgraph_url",
+        side_effect=lambda chain: f"{chain}/balancer",
+    )
+    mocker.patch(
+        "fee_allocator.accounting.freshness.get_blocks_subgraph_url",
+        side_effect=lambda chain: f"{chain}/blocks",
+    )
+    mocker.patch(
+        "fee_allocator.accounting.freshness.get_block_by_ts", return_value=TARGET_BLOCK
+    )
+    polls = {}
+
+    def get_subgraph_meta(graph_url):
+        polls[graph_url] = polls.get(graph_url, 0) + 1
+        if graph_url == "gnosis/balancer":
+            raise ConnectionError("down")
+        # Mainnet blocks subgraph catches up on the third poll
+        if graph_url == "mainnet/blocks" and polls[graph_url] < 3:
+            return 1, TIMESTAMP
+        # Arbitrum subgraphs don't report timestamps, the Balancer one is a block behind at first
+        if graph_url == "arbitrum/balancer":
+            return TARGET_BLOCK - (polls[graph_url] < 2), None
+        if graph_url == "arbitrum/blocks":
+            return TARGET_BLOCK + 10, None
+        return TARGET_BLOCK, TIMESTAMP + BLOCK_SEARCH_WINDOW
+
+    mocker.patch(
+        "fee_allocator.accounting.freshness.get_subgraph_meta",
+        side_effect=get_subgraph_meta,
+    )
+    mocker.patch(
+        "fee_allocator.accounting.freshness.get_indexed_block_timestamp",
+        return_value=TIMESTAMP + BLOCK_SEARCH_WINDOW,
+    )
+    gate = FreshnessGate(["mainnet", "arbitrum"], TIMESTAMP, poll_interval=0.01)
+    assert list(gate.ready_chains()) == ["arbitrum", "mainnet"]
+    assert list(gate.ready_chains()) == ["arbitrum", "mainnet"]
+    assert polls["mainnet/blocks"] == 3 and polls["arbitrum/blocks"] == 1
+    assert polls["arbitrum/balancer"] == 2
+
+    gate = FreshnessGate(["gnosis"], TIMESTAMP, poll_interval=0.01, max_wait=0.05)
+    with pytest.raises(SubgraphNotIndexed):
+        gate.wait("gnosis")
+
+
+def test_freshness_gate_clamps_future_timestamps(mocker):
+    mocker.patch(
+        "fee_allocator.accounting.freshness.get_blocks_subgraph_url",
+        side_effect=lambda chain: f"{chain}/blocks",
+    )
+    # Subgraphs indexed up to now, a timestamp in the future is never indexed past
+    now = int(time.time())
+    mocker.patch(
+        "fee_allocator.accounting.freshness.get_subgraph_meta",
+        return_value=(TARGET_BLOCK, now),
+    )
+    gate = FreshnessGate(
+        ["mainnet"],
+        now + 86400,
+        poll_interval=0.01,
+        max_wait=0.05,
+        check_balancer_subgraph=False,
+    )
+    gate.wait("mainnet")
+    assert gate.timestamp < now
+
+
+def test_async_freshness_gate(mocker):
+    module = "fee_allocator.accounting.freshness_async"
+    mocker.patch(
+        f"{module}.get_subgraph_url", side_effect=lambda chain: f"{chain}/balancer"
+    )
+    mocker.patch(
+        f"{module}.get_blocks_subgraph_url", side_effect=lambda chain: f"{chain}/blocks"
+    )
+    mocker.patch(
+        f"{module}.get_block_by_ts_async", AsyncMock(return_value=TARGET_BLOCK)
+    )
+    polls = {}
+
+    async def get_subgraph_meta(graph_url):
+        polls[graph_url] = polls.get(graph_url, 0) + 1
+        if graph_url == "gnosis/balancer":
+            raise ConnectionError("down")
+        # Mainnet blocks subgraph catches up on the third poll
+        if graph_url == "mainnet/blocks" and polls[graph_url] < 3:
+            return 1, TIMESTAMP
+        return TARGET_BLOCK, TIMESTAMP + BLOCK_SEARCH_WINDOW
+
+    mocker.patch(f"{module}.get_subgraph_meta_async", side_effect=get_subgraph_meta)
+    threads = threading.active_count()
+
+    async def run():
+        gate = AsyncFreshnessGate(["mainnet"], TIMESTAMP, poll_interval=0.01)
+        # Subgraphs are polled on the event loop
+        assert threading.active_count() == threads
+        await gate.wait("mainnet")
+        assert polls == {"mainnet/blocks": 3, "mainnet/balancer": 1}
+        gate = AsyncFreshnessGate(
+            ["gnosis"], TIMESTAMP, poll_interval=0.01, max_wait=0.05
+        )
+        with pytest.raises(SubgraphNotIndexed):
+            await gate.wait("gnosis")
+
+    asyncio.run(run())
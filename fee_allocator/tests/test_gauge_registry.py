@@ -0,0 +1,79 @@
+import threading
+
+from web3 import Web3
+
+from fee_allocator.accounting.stages import reset_stages
+from fee_allocator.accounting.stages import stage_runs
+from fee_allocator.gauge_registry import get_gauge_registry
+from fee_allocator.gauge_registry import refresh_gauge_registry
+
+
+def voting_list_pool(index: int, is_killed: bool = False) -> dict:
+    return {
+        "id": f"0x{index:040x}{0:024x}",
+        "address": f"0x{index:040x}",
+        "chain": "MAINNET",
+        "symbol": f"B-{index}",
+        "gauge": {"address": f"0x{index + 0xABC000:040x}", "isKilled": is_killed},
+    }
+
+
+def test_refresh_gauge_registry(mocker, tmp_path):
+    mocker.patch("fee_allocator.cache.CACHE_DIR", str(tmp_path))
+    voting_list = [voting_list_pool(1), voting_list_pool(2, is_killed=True)]
+    fetch = mocker.patch(
+        "fee_allocator.gauge_registry.fetch_all_pools_info",
+        side_effect=lambda: voting_list,
+    )
+    checksum = mocker.spy(Web3, "to_checksum_address")
+
+    registry = refresh_gauge_registry()
+    pool_1 = voting_list[0]["id"]
+    gauge_1 = Web3.to_checksum_address(voting_list[0]["gauge"]["address"])
+    assert registry.pool_to_gauge == {pool_1: gauge_1}
+    assert registry.pool(gauge_1.lower()) == pool_1
+    assert registry.killed() == [voting_list[1]["id"]]
+    assert checksum.call_count == 5
+
+    # Unchanged list reuses the stored registry
+    checksum.reset_mock()
+    assert refresh_gauge_registry().pool_to_gauge == registry.pool_to_gauge
+    assert checksum.call_count == 0
+
+    # Only the added pool is checksummed
+    voting_list.append(voting_list_pool(3))
+    registry = refresh_gauge_registry()
+    assert checksum.call_count == 2
+    assert registry.gauge(voting_list[2]["id"]) == Web3.to_checksum_address(
+        voting_list[2]["gauge"]["address"]
+    )
+    assert fetch.call_count == 3
+
+
+def test_get_gauge_registry_falls_back_to_stored_registry(mocker, tmp_path):
+    mocker.patch("fee_allocator.cache.CACHE_DIR", str(tmp_path))
+    mocker.patch(
+        "fee_allocator.accounting.stages.STAGE_BUDGETS", {"gauge_registry": 0.05}
+    )
+    voting_list = [voting_list_pool(1)]
+    mocker.patch(
+        "fee_allocator.gauge_registry.fetch_all_pools_info", return_value=voting_list
+    )
+    stored = refresh_gauge_registry()
+    release = threading.Event()
+
+    def hanging():
+        release.wait(5)
+        return voting_list + [voting_list_pool(2)]
+
+    mocker.patch("fee_allocator.gauge_registry.fetch_all_pools_info", hanging)
+    get_gauge_registry.cache_clear()
+    reset_stages()
+    try:
+        assert get_gauge_registry().pool_to_gauge == stored.pool_to_gauge
+    finally:
+        release.set()
+        get_gauge_registry.cache_clear()
+    assert [(run["stage"], run["fallback"]) for run in stage_runs()] == [
+        ("gauge_registry", True)
+    ]
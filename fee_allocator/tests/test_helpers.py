@@ -1,10 +1,22 @@
+import asyncio
 from decimal import Decimal
+from unittest.mock import AsyncMock
 from unittest.mock import MagicMock
 
 import pytest
+from web3.exceptions import BadFunctionCallOutput
 
+from fee_allocator.cache import disk_cache_get
+from fee_allocator.helpers import BLOCK_SEARCH_WINDOW
+from fee_allocator.helpers import BLOCKS_QUERY
+from fee_allocator.helpers import bpt_price_sample_timestamps
 from fee_allocator.helpers import calculate_aura_vebal_share
 from fee_allocator.helpers import fetch_all_pools_info
+from fee_allocator.helpers import get_block_by_ts
+from fee_allocator.helpers import get_pools_tokens
+from fee_allocator.helpers import get_sampled_twap_bpt_prices
+from fee_allocator.helpers import get_token_price_history
+from fee_allocator.helpers_async import get_block_by_ts_async
 
 
 def test_calculate_aura_vebal_share():
@@ -82,3 +94,123 @@ def test_fetch_all_pools_info(mocker):
     assert len(all_pools) == 1
     assert all_pools[0]["type"] == "PHANTOM_STABLE"
     assert all_pools[0]["chain"] == "MAINNET"
+
+
+def test_get_sampled_twap_bpt_prices(mocker, tmp_path):
+    usdc = "0xA0b86991c6218b36c1D19D4a2e9Eb0cE3606eB48"
+    weth = "0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2"
+    pool_tokens_a = [usdc, weth]
+    batch = mocker.patch("fee_allocator.helpers.BatchCaller").return_value
+    batch.execute.side_effect = [
+        [("0x01", 0), ("0x02", 0)],
+        [
+            18,
+            18,
+            # First sample, pool b isn't created yet
+            (pool_tokens_a, [1000 * 10**6, 10**18], 0),
+            10 * 10**18,
+            BadFunctionCallOutput(),
+            BadFunctionCallOutput(),
+            # Second sample
+            (pool_tokens_a, [3000 * 10**6, 0], 0),
+            20 * 10**18,
+            ([usdc], [500 * 10**6], 0),
+            100 * 10**18,
+        ],
+    ]
+    mocker.patch("fee_allocator.cache.CACHE_DIR", str(tmp_path))
+    mocker.patch("fee_allocator.helpers.get_contract")
+    mocker.patch(
+        "fee_allocator.helpers._get_tokens_twap_prices",
+        return_value=(
+            {usdc: (6, "USDC", "USDC"), weth: (18, "WETH", "WETH")},
+            {usdc: Decimal(1), weth: Decimal(2000)},
+        ),
+    )
+    prices = get_sampled_twap_bpt_prices(
+        ["0xa", "0xb"], "mainnet", MagicMock(), 0, 100, [50, 100]
+    )
+    # Pool a is 300 at the first sample and 150 at the second one, averaged exactly
+    assert prices["0xa"] == Decimal(225)
+    assert prices["0xb"] == Decimal(5)
+    # Pool reads are stored, pricing again doesn't read pools
+    assert (
+        get_sampled_twap_bpt_prices(
+            ["0xa", "0xb"], "mainnet", MagicMock(), 0, 100, [50, 100]
+        )
+        == prices
+    )
+    assert batch.execute.call_count == 2
+    assert disk_cache_get("pool_tokens", "mainnet:0xb") == [usdc]
+    assert bpt_price_sample_timestamps(0, 100, 3) == [33, 66, 100]
+
+
+def test_get_token_price_history_fetches_missing_tail(mocker, tmp_path):
+    mocker.patch("fee_allocator.cache.CACHE_DIR", str(tmp_path))
+    day = 86400
+    now = 200 * day
+    clock = mocker.patch("fee_allocator.helpers.time.time", return_value=now)
+    fetch = mocker.patch(
+        "fee_allocator.helpers.fetch_token_price_history",
+        return_value=[
+            {"timestamp": str(ts), "price": 1} for ts in range(now - 90 * day, now, day)
+        ],
+    )
+    assert len(get_token_price_history("0xToken", "mainnet", now)) == 90
+    fetch.assert_called_once_with("0xtoken", "mainnet", "NINETY_DAY")
+
+    # A day later only the last days are fetched, the latest stored price is updated
+    clock.return_value = now + day
+    fetch.return_value = [
+        {"timestamp": str(now - day), "price": 2},
+        {"timestamp": str(now), "price": 3},
+    ]
+    prices = get_token_price_history("0xToken", "mainnet", now + day)
+    fetch.assert_called_with("0xtoken", "mainnet", "SEVEN_DAY")
+    assert len(prices) == 90
+    assert [price["price"] for price in prices[-3:]] == [1, 2, 3]
+
+
+def test_get_pools_tokens(mocker, tmp_path):
+    mocker.patch("fee_allocator.cache.CACHE_DIR", str(tmp_path))
+    mocker.patch("fee_allocator.helpers.get_contract")
+    batch = mocker.patch("fee_allocator.helpers.BatchCaller")
+    token_a = "0x" + "1" * 40
+    token_b = "0x" + "2" * 40
+    batch.return_value.execute.return_value = [
+        ([token_a, token_b], [], 0),
+        ([token_b], [], 0),
+    ]
+    tokens = get_pools_tokens(MagicMock(), "mainnet", ["0xpool1", "0xpool2"])
+    assert tokens == [token_a, token_b]
+    assert batch.return_value.add.call_count == 2
+    assert disk_cache_get("pool_tokens", "mainnet:0xpool2") == [token_b]
+
+
+def test_get_block_by_ts_async_shares_blocks_cache(mocker, tmp_path):
+    mocker.patch("fee_allocator.cache.CACHE_DIR", str(tmp_path))
+    mocker.patch(
+        "fee_allocator.helpers_async.get_blocks_subgraph_url",
+        side_effect=lambda chain: f"{chain}/blocks",
+    )
+    execute_gql = mocker.patch(
+        "fee_allocator.helpers_async.execute_gql",
+        AsyncMock(
+            return_value={
+                "blocks": [
+                    {"number": "10", "timestamp": "1699999990"},
+                    {"number": "11", "timestamp": "1700000002"},
+                ]
+            }
+        ),
+    )
+    assert asyncio.run(get_block_by_ts_async(1_700_000_000, "mainnet")) == 11
+    execute_gql.assert_called_once_with(
+        "mainnet/blocks",
+        BLOCKS_QUERY.format(
+            ts_gt=1_700_000_000 - BLOCK_SEARCH_WINDOW,
+            ts_lt=1_700_000_000 + BLOCK_SEARCH_WINDOW,
+        ),
+    )
+    # The sync lookup reads the block the async one stored
+    assert get_block_by_ts(1_700_000_000, "mainnet") == 11
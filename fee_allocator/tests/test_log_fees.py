@@ -0,0 +1,95 @@
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+from eth_abi import encode
+from hexbytes import HexBytes
+
+from fee_allocator.accounting.log_fees import cache_windows
+from fee_allocator.accounting.log_fees import get_pool_fee_amounts
+from fee_allocator.accounting.log_fees import scan_logs
+from fee_allocator.accounting.log_fees import sum_fee_logs
+
+POOL_ID = "0x" + "ab" * 20 + "0" * 24
+TOKEN_A = "0x" + "1" * 40
+TOKEN_B = "0x" + "2" * 40
+
+
+def test_scan_logs_splits_rejected_ranges(mocker):
+    mocker.patch("fee_allocator.accounting.log_fees.LOGS_CHUNK_BLOCKS", 1000)
+    lock = threading.Lock()
+    requests = []
+
+    def get_logs(start, end):
+        with lock:
+            requests.append((start, end))
+        # The node rejects ranges over 300 blocks
+        if end - start + 1 > 300:
+            raise ValueError("query returned more than 10000 results")
+        return list(range(start, end + 1))
+
+    logs = scan_logs(get_logs, 5, 2504)
+    assert sorted(logs) == list(range(5, 2505))
+    assert len(requests) > 2500 // 300
+
+
+def test_scan_logs_fails_on_a_single_block():
+    def get_logs(start, end):
+        if start <= 42 <= end:
+            raise ValueError("down")
+        return []
+
+    with pytest.raises(ValueError):
+        scan_logs(get_logs, 0, 100)
+
+
+def test_cache_windows(mocker):
+    mocker.patch("fee_allocator.accounting.log_fees.LOGS_CACHE_WINDOW", 100)
+    assert cache_windows(150, 420) == [(150, 199), (200, 299), (300, 399), (400, 420)]
+    assert cache_windows(200, 200) == [(200, 200)]
+
+
+def test_sum_fee_logs():
+    bpt_mint_logs = [
+        {"address": POOL_ID[:42], "data": HexBytes((10**18).to_bytes(32, "big"))},
+        {"address": POOL_ID[:42], "data": HexBytes((5 * 10**17).to_bytes(32, "big"))},
+    ]
+    balance_changed_logs = [
+        {
+            "address": "0xBA12222222228d8Ba445958a75a0704d566BF2C8",
+            "topics": [HexBytes(0), HexBytes(POOL_ID)],
+            "data": HexBytes(
+                encode(
+                    ["address[]", "int256[]", "uint256[]"],
+                    [[TOKEN_A, TOKEN_B], [100, -50], [3, 0]],
+                )
+            ),
+        }
+    ] * 2
+    fees = sum_fee_logs(bpt_mint_logs, balance_changed_logs)
+    assert fees["bpt"] == {POOL_ID[:42]: 15 * 10**17}
+    assert fees["tokens"] == {POOL_ID: {TOKEN_A: 6}}
+
+
+def test_get_pool_fee_amounts_caches_final_windows(mocker, tmp_path):
+    mocker.patch("fee_allocator.cache.CACHE_DIR", str(tmp_path))
+    mocker.patch("fee_allocator.accounting.log_fees.LOGS_CACHE_WINDOW", 100)
+    mocker.patch("fee_allocator.accounting.log_fees.LOGS_CONFIRMATIONS", 50)
+    web3 = MagicMock()
+    web3.eth.block_number = 300
+    web3.eth.get_logs.return_value = []
+
+    def scanned():
+        ranges = {
+            (call.args[0]["fromBlock"], call.args[0]["toBlock"])
+            for call in web3.eth.get_logs.call_args_list
+        }
+        web3.eth.get_logs.reset_mock()
+        return sorted(ranges)
+
+    # Fees of block 120 are in the snapshot at block 120 already
+    get_pool_fee_amounts(web3, "mainnet", [POOL_ID], 120, 290)
+    assert scanned() == [(121, 199), (200, 290)]
+    # Only the window at least 50 blocks behind the head was cached
+    get_pool_fee_amounts(web3, "mainnet", [POOL_ID], 120, 290)
+    assert scanned() == [(200, 290)]
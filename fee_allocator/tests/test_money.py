@@ -0,0 +1,54 @@
+from decimal import Decimal
+
+import pytest
+
+from fee_allocator.accounting.money import apportion
+from fee_allocator.accounting.money import from_micro
+from fee_allocator.accounting.money import mul_micro
+from fee_allocator.accounting.money import quantize
+from fee_allocator.accounting.money import to_micro
+
+
+@pytest.mark.parametrize(
+    "amount, expected",
+    [
+        (0.1, 100_000),
+        (Decimal("1.0000005"), 1_000_001),
+        ("250000.123456", 250_000_123_456),
+        (3, 3_000_000),
+        # Mimic reports are in micro-USDC and converted to float in main.py
+        (float(Decimal(123456789) / Decimal(1e6)), 123_456_789),
+    ],
+)
+def test_to_micro(amount, expected):
+    assert to_micro(amount) == expected
+
+
+def test_from_micro_is_exact():
+    assert from_micro(1_234_567) == Decimal("1.234567")
+    assert str(from_micro(0)) == "0.000000"
+    assert quantize(Decimal("0.1234565")) == Decimal("0.123457")
+    assert mul_micro(1_000_000, Decimal("0.175")) == 175_000
+
+
+@pytest.mark.parametrize(
+    "total, weights",
+    [
+        (100, [1, 1, 1]),
+        (10**12 + 7, [3, 0, 7, 11, 13]),
+        (999_999, [10**15, 1, 1]),
+        (-10, [1, 2]),
+        (5, [0, 0]),
+    ],
+)
+def test_apportion_sums_to_total(total, weights):
+    parts = apportion(total, weights)
+    assert sum(parts) == total
+    # Every part is within one unit of its exact share, zero weights split evenly
+    shares = weights if sum(weights) else [1] * len(weights)
+    for part, share in zip(parts, shares):
+        assert abs(part - Decimal(total) * share / sum(shares)) <= 1
+
+
+def test_apportion_without_weights():
+    assert apportion(7, []) == []
@@ -0,0 +1,48 @@
+import time
+
+from fee_allocator.accounting.profiling import SamplingProfiler
+from fee_allocator.accounting.profiling import chrome_trace
+from fee_allocator.accounting.stages import reset_stages
+from fee_allocator.accounting.stages import run_stage
+from fee_allocator.accounting.stages import stage_runs
+
+
+def busy(seconds: float) -> dict:
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        sum(range(1000))
+    return {}
+
+
+def test_profile_stages(mocker):
+    mocker.patch(
+        "fee_allocator.accounting.stages.STAGE_BUDGETS", {"collected_fees": 10}
+    )
+    reset_stages()
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    run_stage("collected_fees", {"chain": "mainnet"}, lambda: busy(0.1), False)
+    run_stage("split", {}, lambda: busy(0.1), False)
+    profiler.stop()
+
+    stacks = profiler.collapsed().splitlines()
+    assert any(
+        line.startswith("collected_fees:mainnet;") and "busy (test_profiling.py" in line
+        for line in stacks
+    )
+    assert any(line.startswith("split;") and "busy (" in line for line in stacks)
+    # The caller waiting for the stage thread is not sampled
+    assert not any(
+        line.startswith("collected_fees:mainnet;")
+        and "busy (" not in line
+        and "_call_with_budget" in line
+        for line in stacks
+    )
+
+    events = chrome_trace(stage_runs())["traceEvents"]
+    assert [event["name"] for event in events] == ["collected_fees:mainnet", "split"]
+    assert events[0]["ts"] == 0
+    assert events[1]["ts"] >= events[0]["dur"]
+    assert events[0]["args"]["cpu_seconds"] > 0
+    # The stage with a budget ran on its own thread
+    assert events[0]["tid"] != events[1]["tid"]
@@ -0,0 +1,98 @@
+import json
+import os
+from unittest.mock import MagicMock
+
+import pytest
+import responses
+from web3 import Web3
+from web3.exceptions import BadFunctionCallOutput
+
+from fee_allocator.rpc import BatchCaller
+
+RPC_URL = "https://rpc.example.com/"
+VE_BAL = "0xC128a9954e6c874eA3d62ce62B468bA073093F25"
+HOLDER = "0xaF52695E1bB01A16D33D7194C28C42b10e0Dbec2"
+
+
+def _erc20(web3):
+    abi_path = os.path.join(
+        os.path.dirname(os.path.dirname(__file__)), "abi", "ERC20.json"
+    )
+    with open(abi_path) as f:
+        return web3.eth.contract(address=VE_BAL, abi=json.load(f))
+
+
+def _uint(value):
+    return "0x" + hex(value)[2:].rjust(64, "0")
+
+
+@responses.activate
+def test_batch_caller_sends_one_batch_request():
+    web3 = Web3(Web3.HTTPProvider(RPC_URL))
+    ve_bal = _erc20(web3)
+    responses.post(
+        RPC_URL,
+        json=[
+            # Out of order on purpose, results are matched by id
+            {"jsonrpc": "2.0", "id": 1, "result": _uint(50)},
+            {"jsonrpc": "2.0", "id": 0, "result": _uint(100)},
+        ],
+    )
+    batch = BatchCaller(web3)
+    batch.add(ve_bal.functions.totalSupply(), 123)
+    batch.add(ve_bal.functions.balanceOf(HOLDER), 123)
+    assert batch.execute() == [100, 50]
+
+    assert len(responses.calls) == 1
+    sent = json.loads(responses.calls[0].request.body)
+    assert [call["method"] for call in sent] == ["eth_call", "eth_call"]
+    assert sent[0]["params"][1] == hex(123)
+    assert sent[1]["params"][0]["data"].startswith("0x70a08231")
+
+
+@responses.activate
+def test_batch_caller_respects_batch_size_and_empty_output():
+    web3 = Web3(Web3.HTTPProvider(RPC_URL))
+    ve_bal = _erc20(web3)
+    responses.post(
+        RPC_URL,
+        json=[
+            {"jsonrpc": "2.0", "id": 0, "result": _uint(1)},
+            {"jsonrpc": "2.0", "id": 1, "result": "0x"},
+        ],
+    )
+    batch = BatchCaller(web3, batch_size=2)
+    for _ in range(2):
+        batch.add(ve_bal.functions.totalSupply())
+    with pytest.raises(BadFunctionCallOutput):
+        batch.execute()
+    # Failed calls can be returned in place of their results
+    for _ in range(2):
+        batch.add(ve_bal.functions.totalSupply())
+    result, error = batch.execute(return_exceptions=True)
+    assert result == 1 and isinstance(error, BadFunctionCallOutput)
+
+
+def test_batch_caller_falls_back_to_sequential_calls():
+    function = MagicMock(call=MagicMock(return_value=42))
+    batch = BatchCaller(MagicMock())
+    batch.add(function, 7)
+    batch.add(function, 7)
+    assert batch.execute() == [42, 42]
+    function.call.assert_called_with(block_identifier=7)
+
+
+@responses.activate
+def test_batch_caller_falls_back_when_batch_is_rejected():
+    web3 = Web3(Web3.HTTPProvider(RPC_URL))
+    responses.post(RPC_URL, status=413)
+    function = MagicMock(
+        address=VE_BAL,
+        _encode_transaction_data=MagicMock(return_value="0x18160ddd"),
+        call=MagicMock(return_value=42),
+    )
+    batch = BatchCaller(web3)
+    batch.add(function, 7)
+    batch.add(function, 7)
+    assert batch.execute() == [42, 42]
+    assert len(responses.calls) == 1
@@ -0,0 +1,145 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from decimal import Decimal
+from http.server import ThreadingHTTPServer
+from unittest.mock import MagicMock
+
+import pandas as pd
+import pytest
+
+from fee_allocator.accounting.service import AllocatorRequestHandler
+from fee_allocator.accounting.service import AllocatorService
+from fee_allocator.accounting.service import parse_params
+from fee_allocator.accounting.stages import run_stage
+from fee_allocator.accounting.stages import stage_runs
+
+POOL_ID = "0x" + "ab" * 32
+
+
+class StubService:
+    def __init__(self):
+        self.requests = []
+
+    def cached_periods(self):
+        return [(200, 100)]
+
+    def allocations(self, params):
+        self.requests.append(params)
+        return (200, 100), pd.DataFrame.from_dict(
+            {
+                POOL_ID: {
+                    "chain": "mainnet",
+                    "earned_fees": Decimal("12.5"),
+                    "aura_incentives": Decimal("3.25"),
+                }
+            },
+            orient="index",
+        )
+
+
+@pytest.fixture
+def service_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), AllocatorRequestHandler)
+    server.service = StubService()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", server.service
+    server.shutdown()
+    server.server_close()
+
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return response.status, response.headers["Content-Type"], response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers["Content-Type"], e.read()
+
+
+def test_parse_params():
+    params = parse_params(
+        {"ts_now": ["200"], "dao_share_pct": ["0.2"]},
+        {"fees_to_distribute": {"mainnet": 100}},
+    )
+    assert params["ts_now"] == 200
+    assert params["fee_constants"] == {"dao_share_pct": Decimal("0.2")}
+    assert params["fees_to_distribute"] == {"mainnet": Decimal(100)}
+    for query, body in [
+        ({"unknown": ["1"]}, None),
+        ({"ts_now": ["now"]}, None),
+        ({}, {"fee_constants": {"unknown": 1}}),
+        ({"fees_file_name": ["../../../etc/passwd"]}, None),
+        ({}, {"fees_file_name": "/tmp/fees.json"}),
+        ({}, {"fees_file_name": ".."}),
+    ]:
+        with pytest.raises(ValueError):
+            parse_params(query, body)
+
+
+def test_allocations_handler(service_url):
+    url, service = service_url
+    status, content_type, body = get(f"{url}/allocations?ts_now=200&ts_in_the_past=100")
+    assert status == 200 and content_type == "application/json"
+    # Amounts are sent as exact json numbers
+    assert json.loads(body, parse_float=Decimal) == {
+        "ts_now": 200,
+        "ts_in_the_past": 100,
+        "rows": [
+            {
+                "pool_id": POOL_ID,
+                "chain": "mainnet",
+                "earned_fees": Decimal("12.5"),
+                "aura_incentives": Decimal("3.25"),
+            }
+        ],
+    }
+    assert service.requests[-1]["ts_now"] == 200
+
+    status, content_type, body = get(f"{url}/allocations?format=csv")
+    assert status == 200 and content_type == "text/csv"
+    assert body.decode().splitlines() == [
+        ",chain,earned_fees,aura_incentives",
+        f"{POOL_ID},mainnet,12.5,3.25",
+    ]
+
+    status, _, body = get(f"{url}/allocations?fees_file_name=../secrets.json")
+    assert status == 400 and "fees_file_name" in json.loads(body)["error"]
+    status, _, body = get(f"{url}/allocations?ts_now=now")
+    assert status == 400
+    assert len(service.requests) == 2
+
+
+def test_allocations_keep_stage_runs_of_last_request(mocker, tmp_path):
+    mocker.patch("fee_allocator.cache.CACHE_DIR", str(tmp_path))
+    module = "fee_allocator.accounting.service"
+    mocker.patch(
+        f"{module}.fetch_service_configs",
+        return_value={
+            "fee_constants": {},
+            "existing_aura_bribs": [],
+            "mapped_pools_info": {},
+            "reroute_config": {},
+            "overrides": {},
+        },
+    )
+    mocker.patch(f"{module}.load_fees_to_distribute", return_value={"mainnet": 1})
+    mocker.patch(
+        f"{module}.allocate_incentives",
+        side_effect=lambda *args: run_stage("allocate", {}, lambda: {}, False),
+    )
+    mocker.patch(f"{module}.add_last_join_exit", side_effect=lambda incentives, _: {})
+    mocker.patch(f"{module}.incentives_to_df")
+    service = AllocatorService(MagicMock(), lambda: (200, 100))
+    mocker.patch.object(
+        service,
+        "get_period",
+        return_value={
+            "collected_fees": {"mainnet": {POOL_ID: {}}},
+            "aura_vebal_share": Decimal("0.5"),
+        },
+    )
+    for _ in range(3):
+        service.allocations({})
+    assert [run["stage"] for run in stage_runs()] == ["allocate"]
@@ -0,0 +1,79 @@
+import copy
+from decimal import Decimal
+
+import pytest
+
+from fee_allocator.accounting.fee_pipeline import allocate_incentives
+from fee_allocator.accounting.settings import Chains
+from fee_allocator.accounting.simulator import RESULT_FIELDS
+from fee_allocator.accounting.simulator import build_scenario_grid
+from fee_allocator.accounting.simulator import run_simulation
+
+
+def pool_fees(symbol, fees_in_usd):
+    return {
+        "symbol": symbol,
+        "pool_addr": "0x0",
+        "bpt_token_fee": fees_in_usd,
+        "bpt_token_fee_in_usd": fees_in_usd,
+        "token_fees_in_usd": Decimal(0),
+        "chain": "mainnet",
+        "token_fees": [],
+    }
+
+
+EPOCH_INPUTS = {
+    "collected_fees": {
+        "mainnet": {
+            f"0x{index:064x}": pool_fees(f"B-{index}", Decimal(fees))
+            for index, fees in enumerate(["12000.5", "3400.25", "800", "150.75"])
+        }
+    },
+    "fees_to_distribute": {"mainnet": Decimal("20000")},
+    "fee_constants": {
+        "min_aura_incentive": 500,
+        "dao_share_pct": "0.175",
+        "vebal_share_pct": "0.125",
+        "min_existing_aura_incentive": 50,
+        "min_vote_incentive_amount": 250,
+    },
+    "aura_vebal_share": Decimal("0.42"),
+    "reroute_config": {},
+    "overrides": {f"0x{1:064x}": {"voting_pool_override": "bal"}},
+}
+
+
+def test_run_simulation_base_scenario_matches_allocation():
+    scenarios = build_scenario_grid(EPOCH_INPUTS, {"dao_share_pct": ["0.175", "0.2"]})
+    results = run_simulation(copy.deepcopy(EPOCH_INPUTS), scenarios, processes=1)
+    assert sorted(results["scenario"].unique()) == [0, 1]
+
+    incentives = allocate_incentives(
+        Chains.MAINNET,
+        copy.deepcopy(EPOCH_INPUTS["collected_fees"]["mainnet"]),
+        EPOCH_INPUTS["fees_to_distribute"]["mainnet"],
+        EPOCH_INPUTS["fee_constants"],
+        EPOCH_INPUTS["aura_vebal_share"],
+        [],
+        {},
+        EPOCH_INPUTS["reroute_config"],
+        EPOCH_INPUTS["overrides"],
+    )
+    base_rows = results[results["scenario"] == 0].set_index("pool_id")
+    assert set(base_rows.index) == set(incentives)
+    for pool_id, data in incentives.items():
+        for field in RESULT_FIELDS:
+            assert base_rows.loc[pool_id, field] == data[field], (pool_id, field)
+    # The other scenario moves fees from incentives to the DAO
+    assert (
+        results[results["scenario"] == 1]["fees_to_dao"].sum()
+        > base_rows["fees_to_dao"].sum()
+    )
+
+
+def test_run_simulation_requires_overrides():
+    epoch_inputs = {
+        key: value for key, value in EPOCH_INPUTS.items() if key != "overrides"
+    }
+    with pytest.raises(ValueError):
+        run_simulation(epoch_inputs, build_scenario_grid(epoch_inputs, {}), processes=1)
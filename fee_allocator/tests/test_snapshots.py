@@ -0,0 +1,66 @@
+import io
+import json
+
+import ijson
+import pytest
+
+from fee_allocator.snapshots import PoolSnapshot
+from fee_allocator.snapshots import SnapshotDecoder
+
+
+def _snapshot(pool_id: str, timestamp: int, bpt_fees, tokens) -> dict:
+    return {
+        "pool": {
+            "address": pool_id[:42],
+            "id": pool_id,
+            "symbol": f"B-{pool_id[-4:]}",
+            "totalProtocolFeePaidInBPT": bpt_fees,
+            "tokens": [
+                {"address": address, "paidProtocolFees": fees}
+                for address, fees in tokens
+            ],
+        },
+        "timestamp": timestamp,
+    }
+
+
+def _decode(response: dict, snapshots: dict) -> int:
+    decoder = SnapshotDecoder(snapshots)
+    for prefix, event, value in ijson.parse(io.BytesIO(json.dumps(response).encode())):
+        decoder.feed(prefix, event, value)
+    return decoder.finish()
+
+
+def test_decoder_keeps_newest_snapshot_per_pool():
+    pool_a, pool_b = "0x" + "a" * 64, "0x" + "b" * 64
+    response = {
+        "data": {
+            "poolSnapshots": [
+                _snapshot(pool_a, 200, "12.5", [("0x01", "1"), ("0x02", "2")]),
+                _snapshot(pool_b, 200, None, [("0x01", "0.1"), ("0x03", None)]),
+                _snapshot(pool_a, 100, "10", [("0x01", "0"), ("0x02", "0")]),
+            ]
+        }
+    }
+    snapshots = {}
+    assert _decode(response, snapshots) == 3
+    assert list(snapshots) == [pool_a, pool_b]
+    snapshot = snapshots[pool_a]
+    assert (snapshot.timestamp, snapshot.total_protocol_fee_paid_in_bpt) == (
+        200,
+        "12.5",
+    )
+    assert snapshot.symbol == "B-aaaa"
+    assert snapshots[pool_b].tokens == (("0x01", "0.1"), ("0x03", None))
+    assert snapshots[pool_b].paid_protocol_fees("0x03") is None
+    # Newer snapshots from a later page replace older ones
+    later_page = {"data": {"poolSnapshots": [_snapshot(pool_b, 300, "1", [])]}}
+    assert _decode(later_page, snapshots) == 1
+    assert snapshots[pool_b].timestamp == 300
+    restored = PoolSnapshot.from_list(json.loads(json.dumps(snapshot.to_list())))
+    assert restored.to_list() == snapshot.to_list()
+
+
+def test_decoder_raises_on_query_errors():
+    with pytest.raises(ValueError, match="indexed up to block"):
+        _decode({"errors": [{"message": "indexed up to block 10"}]}, {})
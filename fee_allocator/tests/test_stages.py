@@ -0,0 +1,95 @@
+import threading
+from decimal import Decimal
+
+import pytest
+
+from fee_allocator.accounting.stages import Deadline
+from fee_allocator.accounting.stages import StageDeadlineExceeded
+from fee_allocator.accounting.stages import reset_stages
+from fee_allocator.accounting.stages import run_stage
+from fee_allocator.accounting.stages import stage_key
+from fee_allocator.accounting.stages import stage_runs
+from fee_allocator.accounting.stages import stages_report
+from fee_allocator.cache import disk_cache_get
+from fee_allocator.cache import disk_cache_set
+
+
+def test_run_stage(mocker, tmp_path):
+    mocker.patch("fee_allocator.cache.CACHE_DIR", str(tmp_path))
+    reset_stages()
+    calls = []
+
+    def split(fees):
+        calls.append(fees)
+        return {"0xpool": {"total_incentives": Decimal(fees) / 2}}
+
+    assert run_stage("split", {"fees": "10"}, lambda: split("10")) == {
+        "0xpool": {"total_incentives": Decimal(5)}
+    }
+    # Same inputs reuse the stored output, changed inputs recompute
+    assert run_stage("split", {"fees": "10"}, lambda: split("10")) == {
+        "0xpool": {"total_incentives": Decimal(5)}
+    }
+    run_stage("split", {"fees": "12"}, lambda: split("12"))
+    run_stage("split", {"fees": "10"}, lambda: split("10"), memoize=False)
+    assert calls == ["10", "12", "10"]
+    assert {
+        stage: (report["runs"], report["cached"])
+        for stage, report in stages_report().items()
+    } == {"split": (4, 1)}
+    assert stage_key("split", {"a": 1, "b": Decimal("1.5")}) == stage_key(
+        "split", {"b": Decimal("1.5"), "a": 1}
+    )
+    assert stage_key("split", {"a": 1}) != stage_key("reroute", {"a": 1})
+
+
+def test_run_stage_deadline(mocker, tmp_path):
+    mocker.patch("fee_allocator.cache.CACHE_DIR", str(tmp_path))
+    mocker.patch(
+        "fee_allocator.accounting.stages.STAGE_BUDGETS",
+        {"configs": 0.05, "collected_fees": 0.05},
+    )
+    reset_stages()
+    release = threading.Event()
+    written = threading.Event()
+
+    def hanging():
+        release.wait(5)
+        disk_cache_set("blocks", "hanging", 1)
+        written.set()
+        return {"stale": True}
+
+    try:
+        assert run_stage("configs", {}, lambda: {"fresh": True}, False) == {
+            "fresh": True
+        }
+        # Live configs don't fall back to values of earlier runs
+        with pytest.raises(StageDeadlineExceeded):
+            run_stage("configs", {}, hanging, False)
+        # The chain deadline caps budgets of stages without one
+        with pytest.raises(StageDeadlineExceeded):
+            run_stage("join_exit", {"chain": "mainnet"}, hanging, False, Deadline(0.05))
+        assert (
+            run_stage(
+                "join_exit",
+                {"chain": "mainnet"},
+                hanging,
+                False,
+                Deadline(0.05),
+                fallback=lambda: {},
+            )
+            == {}
+        )
+        with pytest.raises(StageDeadlineExceeded):
+            run_stage("collected_fees", {"chain": "mainnet"}, hanging)
+    finally:
+        release.set()
+    # Stages left running after they ran out of time don't write to the cache
+    assert written.wait(5)
+    assert disk_cache_get("blocks", "hanging") is None
+    disk_cache_set("blocks", "running", 1)
+    assert disk_cache_get("blocks", "running") == 1
+    assert [(run["stage"], run["fallback"]) for run in stage_runs()] == [
+        ("configs", False),
+        ("join_exit", True),
+    ]
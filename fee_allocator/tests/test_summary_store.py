@@ -0,0 +1,96 @@
+import fcntl
+import json
+import os
+from decimal import Decimal
+
+from fee_allocator.accounting.summary_store import ReconSummaryStore
+
+
+def _summary(period_start, period_end, fees=Decimal("100.01")):
+    return {
+        "feesCollected": fees,
+        "createdAt": 1,
+        "periodStart": period_start,
+        "periodEnd": period_end,
+    }
+
+
+def _store(tmp_path, legacy=None):
+    legacy_path = tmp_path / "recon.json"
+    if legacy is not None:
+        legacy_path.write_text(json.dumps(legacy))
+    return ReconSummaryStore(
+        path=str(tmp_path / "recon.jsonl"),
+        index_path=str(tmp_path / "recon.index.json"),
+        legacy_path=str(legacy_path),
+    )
+
+
+def test_append_skips_duplicate_periods(tmp_path):
+    store = _store(tmp_path)
+    assert store.append(_summary(1, 2))
+    assert store.append(_summary(2, 3))
+    assert not store.append(_summary(1, 2, fees=Decimal("1")))
+    assert store.contains(2, 3)
+    assert not store.contains(3, 4)
+    assert store.get(1, 2)["feesCollected"] == Decimal("100.01")
+    assert len(store.load_all()) == 2
+
+
+def test_store_is_seeded_from_legacy_and_compacts_back(tmp_path):
+    store = _store(
+        tmp_path, legacy=[{"feesCollected": 1.5, "periodStart": 1, "periodEnd": 2}]
+    )
+    assert store.contains(1, 2)
+    store.append(_summary(2, 3))
+    with open(store.compact()) as f:
+        compacted = json.load(f)
+    assert [(x["periodStart"], x["periodEnd"]) for x in compacted] == [(1, 2), (2, 3)]
+    assert compacted[0]["feesCollected"] == 1.5
+
+
+def test_stale_index_is_rebuilt(tmp_path):
+    store = _store(tmp_path)
+    store.append(_summary(1, 2))
+    # Simulate an append that happened without the index being updated
+    with open(store.path, "a") as f:
+        f.write(json.dumps(_summary(2, 3, fees=1)) + "\n")
+    assert store.contains(2, 3)
+    os.remove(store.index_path)
+    assert store.contains(1, 2)
+
+
+def test_missing_index_is_rebuilt_from_store(tmp_path):
+    # The index is not tracked in git, a fresh checkout only has the summaries
+    lines = [json.dumps(_summary(1, 2, fees=1)), json.dumps(_summary(2, 3, fees=2))]
+    (tmp_path / "recon.jsonl").write_text("\n".join(lines) + "\n")
+    store = _store(tmp_path, legacy=[{"periodStart": 5, "periodEnd": 6}])
+    assert not os.path.exists(store.index_path)
+    assert store.get(2, 3)["feesCollected"] == 2
+    # The store exists, so the legacy file is not imported again
+    assert not store.contains(5, 6)
+    with open(store.index_path) as f:
+        assert json.load(f)["periods"] == {"1:2": 0, "2:3": len(lines[0]) + 1}
+
+
+def test_legacy_is_imported_under_lock(tmp_path, mocker):
+    store = _store(tmp_path, legacy=[{"periodStart": 1, "periodEnd": 2}])
+    events = []
+    mocker.patch(
+        "fee_allocator.accounting.summary_store.fcntl.flock",
+        side_effect=lambda f, operation: events.append(operation),
+    )
+    import_legacy = store._import_legacy
+
+    def recorded_import():
+        events.append("import")
+        import_legacy()
+
+    mocker.patch.object(store, "_import_legacy", side_effect=recorded_import)
+    assert store.contains(1, 2)
+    assert store.contains(1, 2)
+    # The second call finds the store seeded
+    assert events == [fcntl.LOCK_EX, "import", fcntl.LOCK_UN] + [
+        fcntl.LOCK_EX,
+        fcntl.LOCK_UN,
+    ]
@@ -2,17 +2,16 @@ import copy
 import csv
 import json
 from datetime import date
+from decimal import Decimal
+from functools import lru_cache
 import os
 
 import requests
 from bal_addresses import AddrBook
 from web3 import Web3
 
-from fee_allocator.helpers import get_abi
-
-address_book = AddrBook("mainnet")
-safe = address_book.multisigs.fees
-today = str(date.today())
+from fee_allocator.gauge_registry import get_gauge_registry
+from fee_allocator.helpers import get_contract
 
 SNAPSHOT_URL = "https://hub.snapshot.org/graphql?"
 HH_API_URL = "https://api.hiddenhand.finance/proposal"
@@ -29,36 +28,38 @@ query ($proposal_id: String) {
 
 module_dir = os.path.dirname(os.path.abspath(__file__))
 
-# Load bribe_balancer.json
-bribe_balancer_path = os.path.join(module_dir, "templates/bribe_balancer.json")
-with open(bribe_balancer_path) as f:
-    PAYLOAD = json.load(f)
 
-# Load transactions from bribe_balancer.json
-with open(bribe_balancer_path) as f:
-    BALANCER_BRIB = json.load(f)["transactions"][0]
+@lru_cache(maxsize=None)
+def get_address_book() -> AddrBook:
+    """
+    Mainnet address book. Built on first use, since AddrBook fetches addresses over the network
+    """
+    return AddrBook("mainnet")
+
+
+def get_safe() -> str:
+    return get_address_book().multisigs.fees
 
-# Load transactions from bribe_aura.json
-bribe_aura_path = os.path.join(module_dir, "templates/bribe_aura.json")
-with open(bribe_aura_path) as f:
-    AURA_BRIB = json.load(f)["transactions"][0]
 
-# Load approve.json
-approve_path = os.path.join(module_dir, "templates/approve.json")
-with open(approve_path) as f:
-    APPROVE = json.load(f)
+@lru_cache(maxsize=None)
+def _read_template(template_name: str) -> dict:
+    with open(os.path.join(module_dir, f"templates/{template_name}.json")) as f:
+        return json.load(f)
 
-# Load erc20_transfer.json
-transfer_path = os.path.join(module_dir, "templates/erc20_transfer.json")
-with open(transfer_path) as f:
-    TRANSFER = json.load(f)
+
+def get_template(template_name: str) -> dict:
+    """
+    Returns a fresh copy of a transaction template, safe to mutate
+    """
+    return copy.deepcopy(_read_template(template_name))
 
 
 def get_hh_aura_target(target):
     response = requests.get(f"{HH_API_URL}/aura")
     options = response.json()["data"]
+    registry = get_gauge_registry()
     for option in options:
-        if Web3.to_checksum_address(option["proposal"]) == target:
+        if registry.checksum(option["proposal"]) == target:
             return option["proposalHash"]
     return False  # return false if no result
 
@@ -69,8 +70,9 @@ def get_gauge_name_map(map_url=GAUGE_MAPPING_URL):
     response = requests.get(map_url)
     item_list = response.json()
     output = {}
+    registry = get_gauge_registry()
     for mapping in item_list:
-        gauge_address = Web3.to_checksum_address(mapping["address"])
+        gauge_address = registry.checksum(mapping["address"])
         output[gauge_address] = mapping["label"]
     return output
 
@@ -97,7 +99,8 @@ def process_bribe_csv(csv_file):
     # Parse briibes per platform
     for bribe in bribe_csv:
         try:
-            bribes[bribe["platform"]][bribe["target"]] = float(bribe["amount"])
+            # Decimal keeps the 6 decimals of the csv exact when converting to mantissa
+            bribes[bribe["platform"]][bribe["target"]] = Decimal(bribe["amount"])
         except Exception:
             assert (
                 False
@@ -106,15 +109,17 @@ def process_bribe_csv(csv_file):
 
 
 def generate_payload(web3: Web3, csv_file: str):
+    address_book = get_address_book()
+    safe = get_safe()
+    today = str(date.today())
     tx_list = []
-    usdc = web3.eth.contract(
-        address=address_book.extras.tokens.USDC,
-        abi=get_abi("ERC20"),
-    )
+    usdc = get_contract(web3, "mainnet", address_book.extras.tokens.USDC, "ERC20")
     usdc_decimals = usdc.functions.decimals().call()
     usdc_mantissa_multilpier = 10 ** int(usdc_decimals)
 
     bribe_vault = address_book.extras.hidden_hand2.bribe_vault
+    # Csv targets are voting list gauges, checksummed once in the gauge registry
+    registry = get_gauge_registry()
     bribes = process_bribe_csv(csv_file)
 
     # Calculate total bribe
@@ -127,7 +132,7 @@ def generate_payload(web3: Web3, csv_file: str):
     total_usdc = total_balancer_usdc + total_aura_usdc
     total_mantissa = int(total_usdc * usdc_mantissa_multilpier)
 
-    usdc_approve = copy.deepcopy(APPROVE)
+    usdc_approve = get_template("approve")
     usdc_approve["to"] = address_book.extras.tokens.USDC
     usdc_approve["contractInputsValues"]["spender"] = bribe_vault
     usdc_approve["contractInputsValues"]["rawAmount"] = str(total_mantissa + 1)
@@ -141,7 +146,7 @@ def generate_payload(web3: Web3, csv_file: str):
         usdc_amount = amount * 10**usdc_decimals
         print(usdc_amount)
         payments_usd += amount
-        transfer = copy.deepcopy(TRANSFER)
+        transfer = get_template("erc20_transfer")
         transfer["to"] = address_book.extras.tokens.USDC
         transfer["contractInputsValues"]["value"] = str(int(usdc_amount))
         print("----------------------------------")
@@ -161,7 +166,7 @@ def generate_payload(web3: Web3, csv_file: str):
 
     # BALANCER
     def bribe_balancer(gauge, mantissa):
-        prop = Web3.solidity_keccak(["address"], [Web3.to_checksum_address(gauge)])
+        prop = Web3.solidity_keccak(["address"], [registry.checksum(gauge)])
         mantissa = int(mantissa)
         prophash = prop.hex()
         prophash = "0x" + prophash if prophash[:2] != "0x" else prophash
@@ -173,7 +178,7 @@ def generate_payload(web3: Web3, csv_file: str):
 
         if amount == 0:
             return
-        bal_tx = copy.deepcopy(BALANCER_BRIB)
+        bal_tx = get_template("bribe_balancer")["transactions"][0]
         bal_tx["contractInputsValues"]["_proposal"] = prophash
         bal_tx["contractInputsValues"]["_token"] = address_book.extras.tokens.USDC
         bal_tx["contractInputsValues"]["_amount"] = str(mantissa)
@@ -190,7 +195,7 @@ def generate_payload(web3: Web3, csv_file: str):
     for target, amount in bribes["aura"].items():
         if amount == 0:
             continue
-        target = Web3.to_checksum_address(target)
+        target = registry.checksum(target)
         # grab data from proposals to find out the proposal index
         prop = get_hh_aura_target(target)
         mantissa = int(amount * usdc_mantissa_multilpier)
@@ -203,30 +208,27 @@ def generate_payload(web3: Web3, csv_file: str):
 
         if amount == 0:
             return
-        tx = copy.deepcopy(AURA_BRIB)
+        tx = get_template("bribe_aura")["transactions"][0]
         tx["contractInputsValues"]["_proposal"] = prop
         tx["contractInputsValues"]["_token"] = address_book.extras.tokens.USDC
         tx["contractInputsValues"]["_amount"] = str(mantissa)
         tx_list.append(tx)
 
-    bal = web3.eth.contract(
-        address=address_book.extras.tokens.BAL,
-        abi=get_abi("ERC20"),
-    )
+    bal = get_contract(web3, "mainnet", address_book.extras.tokens.BAL, "ERC20")
 
     spent_usdc = payments + total_mantissa
     vebal_usdc = (
         int(usdc.functions.balanceOf(safe).call() - spent_usdc) - 1
     )  # Subtract 1 wei to avoid rounding errors
     print(f"non veBAL flows: {spent_usdc}, remainder to veBAL: {vebal_usdc}")
-    usdc_trasfer = copy.deepcopy(TRANSFER)
+    usdc_trasfer = get_template("erc20_transfer")
     usdc_trasfer["to"] = usdc.address
     usdc_trasfer["contractInputsValues"][
         "to"
     ] = address_book.extras.maxiKeepers.veBalFeeInjector
     usdc_trasfer["contractInputsValues"]["value"] = str(vebal_usdc)
     tx_list.append(usdc_trasfer)
-    bal_trasfer = TRANSFER
+    bal_trasfer = get_template("erc20_transfer")
     bal_trasfer["to"] = address_book.extras.tokens.BAL
     bal_trasfer["contractInputsValues"][
         "to"
@@ -237,7 +239,7 @@ def generate_payload(web3: Web3, csv_file: str):
     tx_list.append(bal_trasfer)
     print("\n\nBuilding and pushing multisig payload")
     print("saving payload")
-    payload = PAYLOAD
+    payload = get_template("bribe_balancer")
     payload["meta"]["createdFromSafeAddress"] = safe
     payload["transactions"] = tx_list
     # Load bribe_balancer.json
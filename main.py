@@ -1,26 +1,8 @@
 import argparse
-import json
 import os
 from datetime import datetime, timedelta
-from decimal import Decimal
 import pytz
 
-from dotenv import load_dotenv
-from web3 import Web3
-from bal_tools import Web3RpcByChain
-
-from fee_allocator.accounting.fee_pipeline import run_fees
-from fee_allocator.accounting.recon import generate_and_save_input_csv
-from fee_allocator.accounting.recon import recon_and_validate
-from fee_allocator.accounting.settings import Chains
-from fee_allocator.helpers import fetch_all_pools_info
-from fee_allocator.tx_builder.tx_builder import generate_payload
-from fee_allocator.helpers import get_block_by_ts
-from fee_allocator.helpers import calculate_aura_vebal_share
-
-
-DRPC_KEY = os.getenv("DRPC_KEY")
-
 
 def get_last_thursday_odd_week():
     # Use the current UTC date and time
@@ -55,70 +37,242 @@ def get_last_thursday_odd_week():
     return last_thursday_odd_utc
 
 
-now = datetime.utcnow()
-DELTA = 7200  # delay to deal with slow subgraphs
 # TS_NOW = 1704326400
 # TS_2_WEEKS_AGO = 1703116800
-TS_NOW = int(now.timestamp()) - DELTA
-TS_2_WEEKS_AGO = int(get_last_thursday_odd_week().timestamp())
-
-parser = argparse.ArgumentParser()
-parser.add_argument("--ts_now", help="Current timestamp", type=int, required=False)
-parser.add_argument(
-    "--ts_in_the_past", help="Timestamp in the past", type=int, required=False
-)
-parser.add_argument(
-    "--output_file_name", help="Output file name", type=str, required=False
-)
-parser.add_argument("--fees_file_name", help="Fees file name", type=str, required=False)
 
 ROOT = os.path.dirname(__file__)
 
 
+def get_default_timestamps() -> tuple[int, int]:
+    """
+    Returns default (ts_now, ts_2_weeks_ago) used when timestamps are not passed as arguments.
+    Runs wait for subgraphs lagging behind ts_now, see fee_allocator.accounting.freshness
+    """
+    from fee_allocator.accounting.settings import DEFAULT_TS_NOW_LAG
+
+    ts_now = int(datetime.utcnow().timestamp()) - DEFAULT_TS_NOW_LAG
+    ts_2_weeks_ago = int(get_last_thursday_odd_week().timestamp())
+    return ts_now, ts_2_weeks_ago
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ts_now", help="Current timestamp", type=int, required=False)
+    parser.add_argument(
+        "--ts_in_the_past", help="Timestamp in the past", type=int, required=False
+    )
+    parser.add_argument(
+        "--output_file_name", help="Output file name", type=str, required=False
+    )
+    parser.add_argument(
+        "--fees_file_name", help="Fees file name", type=str, required=False
+    )
+    parser.add_argument(
+        "--rpc_batch_size",
+        help="Max eth_calls per JSON-RPC batch request, 1 disables batching",
+        type=int,
+        required=False,
+    )
+    parser.add_argument(
+        "--epoch_inputs_file",
+        help="Store collected fees and allocation inputs to this json file for the scenario simulator",
+        type=str,
+        required=False,
+    )
+    parser.add_argument(
+        "--use_async",
+        help="Run the fee pipeline on asyncio, fetching all chains concurrently",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--serve",
+        help="Run the allocator service with warm caches and a local HTTP/JSON API",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--warm_cache",
+        help="Prefetch data of the running epoch into the local cache and exit, meant to run daily",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--track_accrual",
+        help="Store fees accrued by core pools since the previous day of the epoch and exit, meant to run daily",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--plan",
+        help="Print the requests the run needs and an estimated runtime, without fetching pool data",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--bpt_price_samples",
+        help="Average pool balances and BPT supply over this many blocks in the period when pricing BPT",
+        type=int,
+        required=False,
+    )
+    parser.add_argument(
+        "--fee_source",
+        help="Collect fees from subgraph pool snapshots or from fee events read with eth_getLogs",
+        choices=["subgraph", "logs"],
+        required=False,
+    )
+    parser.add_argument(
+        "--recompute",
+        help="Recompute every pipeline stage instead of reusing outputs stored for the same inputs",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--sync_fee_ledger",
+        help="Fetch Mimic reports of epochs missing from the fee ledger and exit. "
+        "Reports of epochs ending on the given days are fetched again",
+        nargs="*",
+        metavar="END_DAY",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Sample stacks per pipeline stage and chain, write collapsed stacks and a Chrome trace",
+        action="store_true",
+    )
+    parser.add_argument("--host", help="Service host", type=str, required=False)
+    parser.add_argument("--port", help="Service port", type=int, required=False)
+    return parser
+
+
 def main() -> None:
     """
     This function is used only to initialize the web3 instances and run main function
     """
+    parser = get_parser()
+    args = parser.parse_args()
+    if args.use_async:
+        # The async pipeline has no stages, accrual, boundaries or sampled prices
+        unsupported = [
+            flag
+            for flag, is_set in (
+                ("--bpt_price_samples", args.bpt_price_samples is not None),
+                ("--fee_source logs", args.fee_source == "logs"),
+                ("--recompute", args.recompute),
+                ("--profile", args.profile),
+            )
+            if is_set
+        ]
+        if unsupported:
+            parser.error(f"--use_async doesn't support {', '.join(unsupported)}")
+    # Heavy imports are deferred until the arguments are parsed,
+    # so `--help` and argument errors return without loading web3, pandas and gql
+    from dotenv import load_dotenv
+    from bal_tools import Web3RpcByChain
+
+    from fee_allocator.accounting.fee_ledger import get_epoch_fees
+    from fee_allocator.accounting.fee_pipeline import fetch_mapped_pools_info
+    from fee_allocator.accounting.fee_pipeline import load_fees_to_distribute
+    from fee_allocator.accounting.fee_pipeline import run_fees
+    from fee_allocator.accounting.recon import generate_and_save_input_csv
+    from fee_allocator.accounting.recon import recon_and_validate
+    from fee_allocator.accounting.settings import BPT_PRICE_SAMPLES
+    from fee_allocator.accounting.settings import Chains
+    from fee_allocator.accounting.settings import FEE_SOURCE
+    from fee_allocator.accounting.stages import stages_report
+    from fee_allocator.tx_builder.tx_builder import generate_payload
+    from fee_allocator.cache import single_flight_report
+    from fee_allocator.endpoints import endpoints_report
+    from fee_allocator.helpers import get_block_by_ts
+    from fee_allocator.helpers import calculate_aura_vebal_share
+    from fee_allocator.rpc import PooledWeb3ByChain
+    from fee_allocator.rpc import set_batch_size
+
     load_dotenv()
+    if args.sync_fee_ledger is not None:
+        from fee_allocator.accounting.fee_ledger import sync_fee_ledger
+
+        sync_fee_ledger(refetch=args.sync_fee_ledger)
+        return
+    drpc_key = os.getenv("DRPC_KEY")
+    if args.rpc_batch_size:
+        set_batch_size(args.rpc_batch_size)
+    web3_instances = PooledWeb3ByChain(Web3RpcByChain(drpc_key))
+    if args.serve:
+        from fee_allocator.accounting.service import serve
+
+        serve(web3_instances, get_default_timestamps, args.host, args.port)
+        return
     # Get from input params or use default
-    ts_now = parser.parse_args().ts_now or TS_NOW
-    ts_in_the_past = parser.parse_args().ts_in_the_past or TS_2_WEEKS_AGO
+    default_ts_now, default_ts_2_weeks_ago = get_default_timestamps()
+    ts_now = args.ts_now or default_ts_now
+    ts_in_the_past = args.ts_in_the_past or default_ts_2_weeks_ago
     print(
         f"\n\n\n------\nRunning  from timestamps {ts_in_the_past} to {ts_now}\n------\n\n\n"
     )
-    output_file_name = parser.parse_args().output_file_name or "current_fees.csv"
-    fees_file_name = parser.parse_args().fees_file_name or "current_fees_collected.json"
-    fees_path = f"fee_allocator/fees_collected/{fees_file_name}"
-    # If WEI, translate to float in order to handle mimic imports for now
-
-    with open(fees_path) as f:
-        fees_to_distribute = json.load(f)
-    if type(fees_to_distribute["mainnet"]) == int:
-        fees_to_distribute = {
-            k: float(Decimal(v) / Decimal(1e6)) for k, v in fees_to_distribute.items()
-        }
-    pools_info = fetch_all_pools_info()
-    # Then map pool_id to root gauge address
-    mapped_pools_info = {}
-
-    for pool in pools_info:
-        # Check if the gauge is not killed
-        if pool["gauge"]["isKilled"]:
-            print(f'{pool["id"]} gauge:{pool["gauge"]["address"]} is killed, skipping')
-            continue
-        mapped_pools_info[pool["id"]] = Web3.to_checksum_address(
-            pool["gauge"]["address"]
+    if args.warm_cache:
+        from fee_allocator.accounting.cache_warmer import warm_caches
+
+        warm_caches(web3_instances, ts_now, ts_in_the_past)
+        return
+    if args.track_accrual:
+        from fee_allocator.accounting.fee_pipeline import run_accrual_tracker
+
+        print(
+            f"Accrued fees: {run_accrual_tracker(web3_instances, ts_in_the_past, ts_now)}"
+        )
+        return
+    output_file_name = args.output_file_name or "current_fees.csv"
+    # Fees of the epoch ending at ts_now come from the fee ledger, unless a fees file is passed
+    fees_to_distribute = None
+    if not args.fees_file_name:
+        fees_to_distribute = get_epoch_fees(ts_now)
+    if fees_to_distribute is None:
+        fees_to_distribute = load_fees_to_distribute(
+            args.fees_file_name or "current_fees_collected.json"
         )
-    web3_instances = Web3RpcByChain(DRPC_KEY)
+    if args.plan:
+        from fee_allocator.accounting.fetch_plan import build_fetch_plan
+        from fee_allocator.accounting.fetch_plan import format_fetch_plan
+        from fee_allocator.accounting.fee_pipeline import fetch_core_pools
 
-    collected_fees = run_fees(
-        web3_instances,
-        ts_now,
-        ts_in_the_past,
-        output_file_name,
-        fees_to_distribute,
-        mapped_pools_info,
-    )
+        plan = build_fetch_plan(
+            fetch_core_pools(),
+            fees_to_distribute,
+            ts_now,
+            ts_in_the_past,
+            args.bpt_price_samples or BPT_PRICE_SAMPLES,
+        )
+        print(format_fetch_plan(plan))
+        return
+    if args.profile:
+        from fee_allocator.accounting.profiling import SamplingProfiler
+
+        profiler = SamplingProfiler()
+        profiler.start()
+    # Pipeline runs map pool_id to root gauge address with the gauge registry
+    mapped_pools_info = None
+    if args.use_async:
+        import asyncio
+        from fee_allocator.accounting.fee_pipeline_async import run_fees_async
+
+        mapped_pools_info = fetch_mapped_pools_info()
+        collected_fees = asyncio.run(
+            run_fees_async(
+                web3_instances,
+                ts_now,
+                ts_in_the_past,
+                output_file_name,
+                fees_to_distribute,
+                mapped_pools_info,
+                epoch_inputs_file=args.epoch_inputs_file,
+            )
+        )
+    else:
+        collected_fees = run_fees(
+            web3_instances,
+            ts_now,
+            ts_in_the_past,
+            output_file_name,
+            fees_to_distribute,
+            epoch_inputs_file=args.epoch_inputs_file,
+            bpt_price_samples=args.bpt_price_samples or BPT_PRICE_SAMPLES,
+            recompute=args.recompute,
+            fee_source=args.fee_source or FEE_SOURCE,
+        )
     _target_mainnet_block = get_block_by_ts(ts_now, Chains.MAINNET.value)
     target_aura_vebal_share = calculate_aura_vebal_share(
         web3_instances["mainnet"], _target_mainnet_block
@@ -133,6 +287,16 @@ def main() -> None:
     csvfile = generate_and_save_input_csv(collected_fees, ts_now, mapped_pools_info)
     if output_file_name != "current_fees.csv":
         generate_payload(web3_instances["mainnet"], csvfile)
+    if args.profile:
+        from fee_allocator.accounting.profiling import save_profile
+        from fee_allocator.accounting.stages import stage_runs
+
+        profiler.stop()
+        print(f"Profile: {save_profile(profiler, stage_runs(), output_file_name)}")
+    print(f"Coalesced requests: {single_flight_report()}")
+    print(f"Stages: {stages_report()}")
+    if endpoints_report():
+        print(f"Hedged endpoints: {endpoints_report()}")
 
 
 if __name__ == "__main__":